@@ -0,0 +1,116 @@
+""" bench_group_analysis.py
+Check and time the group totals of DataAnalysis on a random wide table
+(--samples x --masses, like highest_intensities_per_raw_wide.csv) with
+--groups named groups and as many ratios:
+
+    - conformance: group_totals returns the totals of a sum of the DataFrame
+      columns of every group (the former loop of do_analysis), with the same
+      missing values (NaN), and the ratios of those totals. Exit code 1 otherwise.
+    - speed: time of group_totals (one matrix product) and of the loop.
+
+python benchmarks/bench_group_analysis.py
+python benchmarks/bench_group_analysis.py --samples 5000 --masses 2000 --groups 500 --output groups.json
+"""
+import sys
+import json
+import time
+
+def random_table(opts, rng):
+    """ Wide table (pandas DataFrame): SAMPLE column, then one "<mass>-M/Z" column
+        per mass. Some intensities are missing.
+    """
+    import numpy as np
+    import pandas as pd
+
+    masses = np.round(rng.uniform(200, 2000, opts.masses), 5)
+    intensities = rng.uniform(0, 1e9, (opts.samples, opts.masses))
+    intensities[rng.random(intensities.shape) < opts.missing] = np.nan
+    df = pd.DataFrame(intensities, columns=[ f"{m}-M/Z" for m in masses ])
+    df.insert(0, 'SAMPLE', [ f"S{i}" for i in range(opts.samples) ])
+    return masses, df
+
+def loop_totals(analysis, df):
+    """ Group totals and ratios, one DataFrame column added at a time.
+    """
+    import numpy as np
+    import pandas as pd
+
+    totals = dict()
+    for name, masses in analysis.groups.items():
+        totals[name] = pd.to_numeric(0)
+        for m in masses:
+            header = f"{m}-M/Z"
+            if header in df.columns:
+                totals[name] = totals[name] + df[header]
+    columns = [ np.broadcast_to(np.asarray(totals[name], dtype=np.float64), len(df)) for name in analysis.groups ]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = [ columns[list(analysis.groups).index(n)] / columns[list(analysis.groups).index(d)]
+            for n, d in analysis.ratios.values() ]
+    return np.stack(columns, axis=1), np.stack(ratios, axis=1) if ratios else np.empty((len(df), 0))
+
+def read_options(args=sys.argv[1:]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark and conformance check of the DataAnalysis group totals.")
+    parser.add_argument("--samples", type=int, default=2000, help="samples (rows) of the wide table")
+    parser.add_argument("--masses", type=int, default=1000, help="masses (columns) of the wide table")
+    parser.add_argument("--groups", type=int, default=200, help="named groups (and ratios)")
+    parser.add_argument("--group-size", type=int, default=20, help="masses per group")
+    parser.add_argument("--missing", type=float, default=0.001, help="fraction of missing intensities")
+    parser.add_argument("--repeat", type=int, default=3, help="runs; the best run is kept")
+    parser.add_argument("--output", help="JSON file with the timings")
+    return parser.parse_args(args)
+
+def main():
+    import tempfile
+    import numpy as np
+    from iFishMass.DataAnalysis import DataAnalysis
+
+    opts = read_options()
+    rng = np.random.default_rng(0)
+    masses, df = random_table(opts, rng)
+
+    def pick():
+        # a few masses not found in the table, like masses without peaks.
+        return set(rng.choice(masses, opts.group_size, replace=False)) | {float(rng.uniform(1, 100))}
+    groups = { f"group_{g}": pick() for g in range(opts.groups) }
+    names = list(groups)
+    ratios = { f"ratio_{r}": (names[r], names[(r + 1) % len(names)]) for r in range(opts.groups) }
+
+    with tempfile.NamedTemporaryFile(suffix='.csv') as location:
+        analysis = DataAnalysis(location=location.name, output=None, modified_peptides=pick(),
+            unmodified_peptides=pick(), internal_standard=pick(), template_file=None, debug=False,
+            groups=groups, ratios=ratios)
+
+    differences = []
+    found, expected = analysis.group_totals(df), loop_totals(analysis, df)
+    for name, a, b in zip(('totals', 'ratios'), found, expected):
+        if a.shape != b.shape or not np.allclose(a, b, rtol=1e-12, atol=0, equal_nan=True) \
+                or not np.array_equal(np.isnan(a), np.isnan(b)):
+            differences.append(f"{name} differ from the loop over the DataFrame columns")
+    print(f"conformance: {len(differences)} differences")
+    for difference in differences:
+        print(f"\t{difference}")
+
+    timings = dict()
+    for name, function in (('group_totals', analysis.group_totals), ('loop', lambda df: loop_totals(analysis, df))):
+        runs = []
+        for _ in range(opts.repeat):
+            start = time.perf_counter()
+            function(df)
+            runs.append(time.perf_counter() - start)
+        timings[name] = min(runs)
+    print(f"\t{opts.samples} samples, {opts.masses} masses, {len(analysis.groups)} groups, {len(analysis.ratios)} ratios: "
+        f"group_totals {timings['group_totals']:.4f} s  loop {timings['loop']:.4f} s  "
+        f"speedup x{timings['loop'] / timings['group_totals']:.1f}")
+
+    if opts.output:
+        with open(opts.output, 'w') as fh:
+            json.dump({'differences': differences, 'timings': timings, 'parameters': vars(opts)}, fh, indent=2)
+        print(f"timings saved to {opts.output}")
+
+    if differences:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+""" bench_kernels.py
+Time the numba kernels of iFishMass (kernels.py) and their NumPy implementation
+(ppm_mask, match_sorted and group_argmax) on the same inputs. Both return the
+same arrays, see tests/test_kernels.py.
+
+numba must be importable (pip install numba); the NumPy kernels are used otherwise.
+
+python benchmarks/bench_kernels.py
+python benchmarks/bench_kernels.py --peaks 2000000 --targets 5000 --output kernels.json
+"""
+import sys
+import json
+import time
+
+def best_of(repeat, function, *args):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        runs.append(time.perf_counter() - start)
+    return min(runs)
+
+def read_options(args=sys.argv[1:]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark of the numba kernels.")
+    parser.add_argument("--peaks", type=int, default=1_000_000, help="peaks of the timed inputs")
+    parser.add_argument("--targets", type=int, default=2000, help="targets of the timed inputs")
+    parser.add_argument("--groups", type=int, default=20_000, help="groups of the timed group_argmax")
+    parser.add_argument("--ppm", type=float, default=10, help="ppm tolerance")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per kernel; the best run is kept")
+    parser.add_argument("--output", help="JSON file with the timings")
+    return parser.parse_args(args)
+
+def main():
+    import numpy as np
+    from iFishMass import kernels
+    from iFishMass.MassWindows import MassWindows
+
+    opts = read_options()
+    if not kernels.jit():
+        print("numba is not installed: nothing to compare.")
+        return
+
+    rng = np.random.default_rng(1)
+    windows = MassWindows(rng.uniform(200, 2000, opts.targets), opts.ppm)
+    mzs = np.sort(rng.uniform(200, 2000, opts.peaks).astype(np.float32))
+    match_args = (mzs, windows.masses, windows._order, windows._search_lower, windows._search_upper, opts.ppm)
+    targets = windows.masses[rng.integers(0, opts.targets, opts.peaks)]
+    groups = rng.integers(0, opts.groups, opts.peaks)
+    values = rng.uniform(0, 1e6, opts.peaks)
+    inputs = {
+        'ppm_mask': (mzs, targets, opts.ppm),
+        'match_sorted': match_args,
+        'group_argmax': (groups, values),
+    }
+
+    timings = dict()
+    for name, args in inputs.items():
+        numpy_kernel = getattr(kernels, f"{name}_numpy")
+        numba_kernel = getattr(kernels, f"{name}_numba")
+        numba_kernel(*args)  # compile (or load from the cache) before timing.
+        timings[name] = {'numpy': best_of(opts.repeat, numpy_kernel, *args),
+            'numba': best_of(opts.repeat, numba_kernel, *args)}
+        print(f"\t{name:14} numpy {timings[name]['numpy']:.4f} s  numba {timings[name]['numba']:.4f} s  "
+            f"speedup x{timings[name]['numpy'] / timings[name]['numba']:.1f}")
+
+    if opts.output:
+        with open(opts.output, 'w') as fh:
+            json.dump({'kernels': timings, 'parameters': vars(opts)}, fh, indent=2)
+        print(f"timings saved to {opts.output}")
+
+if __name__ == '__main__':
+    main()
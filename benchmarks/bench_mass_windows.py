@@ -0,0 +1,125 @@
+""" bench_mass_windows.py
+Check and time MassWindows.match for target lists of growing size
+(the 13 masses of the demo peak.ini up to proteome-wide lists):
+
+    - conformance: both searches (window edges in the peaks, peaks in the
+      merged windows) return the matches of a brute force ppm test on every
+      (peak, target) pair. Exit code 1 otherwise.
+    - speed: time to match --scans scans of --peaks peaks with one MassWindows
+      object for all targets, and with one per target (the former loop of Raw).
+
+python benchmarks/bench_mass_windows.py
+python benchmarks/bench_mass_windows.py --targets 13,5000,50000 --output windows.json
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_mzxml as synthetic
+
+def brute_force(masses, ppm, mzs):
+    """ Matches (peak_idx, target_idx) of a ppm test on every (peak, target) pair,
+        ordered by target and then by peak.
+    """
+    import numpy as np
+
+    mzs = np.asarray(mzs).astype(np.float64)
+    peak_idx, target_idx = [], []
+    for t, mass in enumerate(masses):
+        hits = np.flatnonzero((np.abs(mzs - mass) / mass) * 1_000_000 <= ppm)
+        peak_idx.append(hits)
+        target_idx.append(np.full(len(hits), t))
+    return np.concatenate(peak_idx), np.concatenate(target_idx)
+
+def random_targets(n, seed=0):
+    """ n target masses: the demo masses, then random ones (some of them
+        closer than the ppm windows, so windows overlap).
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    masses = list(synthetic.DEMO_MASSES[:n])
+    extra = rng.uniform(200, 2000, max(0, n - len(masses)))
+    extra[::7] = extra[::7] * (1 + 5e-6)
+    return masses + list(extra)
+
+def random_scans(masses, scans, peaks, seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(scans):
+        mzs = rng.uniform(200, 2000, peaks)
+        hits = rng.choice(len(masses), size=min(peaks // 10, len(masses)), replace=False)
+        mzs[:len(hits)] = np.asarray(masses)[hits] * (1 + rng.normal(0, 4e-6, len(hits)))
+        out.append(np.sort(mzs).astype(np.float32))
+    return out
+
+def read_options(args=sys.argv[1:]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark and conformance check of MassWindows.match.")
+    parser.add_argument("--targets", default="13,1000,5000,50000", help="comma separated target list sizes")
+    parser.add_argument("--scans", type=int, default=200, help="scans matched per target list")
+    parser.add_argument("--peaks", type=int, default=2000, help="peaks per scan")
+    parser.add_argument("--ppm", type=float, default=10, help="ppm tolerance")
+    parser.add_argument("--loop-limit", type=int, default=5000,
+        help="largest target list timed with one MassWindows object per target (slow)")
+    parser.add_argument("--output", help="JSON file with the timings")
+    return parser.parse_args(args)
+
+def main():
+    import numpy as np
+    from iFishMass.MassWindows import MassWindows
+
+    opts = read_options()
+    differences = []
+    timings = dict()
+    for n in (int(t) for t in opts.targets.split(',')):
+        masses = random_targets(n)
+        scans = random_scans(masses, opts.scans, opts.peaks)
+        windows = MassWindows(masses, opts.ppm)
+
+        # conformance on a few scans, both searches and unsorted peaks.
+        for mzs in scans[:3]:
+            expected = brute_force(masses, opts.ppm, mzs)
+            shuffled = np.random.default_rng(n).permutation(len(mzs))
+            peak_idx, target_idx = windows.match_by_peak(mzs[shuffled])
+            regroup = np.lexsort((shuffled[peak_idx], target_idx))
+            unsorted = (shuffled[peak_idx][regroup], target_idx[regroup])
+            for name, found in (('edges', windows.match(mzs, is_sorted=True)),
+                    ('merged', windows.match_by_peak(mzs)), ('unsorted', unsorted)):
+                if not (np.array_equal(found[0], expected[0]) and np.array_equal(found[1], expected[1])):
+                    differences.append(f"{n} targets: {name} search differs from the brute force test")
+
+        stage = dict()
+        start = time.perf_counter()
+        matches = sum(len(windows.match(mzs, is_sorted=True)[0]) for mzs in scans)
+        stage['match'] = time.perf_counter() - start
+        if n <= opts.loop_limit:
+            per_target = [ MassWindows([m], opts.ppm) for m in masses ]
+            start = time.perf_counter()
+            for mzs in scans:
+                for w in per_target:
+                    w.match(mzs, is_sorted=True)
+            stage['loop_per_target'] = time.perf_counter() - start
+        timings[n] = dict(stage, matches=matches, merged_windows=windows.merged())
+        loop = f"  loop per target {stage['loop_per_target']:.4f} s" if 'loop_per_target' in stage else ''
+        print(f"\t{n:6} targets ({windows.merged()} merged windows): match {stage['match']:.4f} s{loop}  ({matches} matches)")
+
+    print(f"conformance: {len(differences)} differences")
+    for difference in differences:
+        print(f"\t{difference}")
+
+    if opts.output:
+        with open(opts.output, 'w') as fh:
+            json.dump({'differences': differences, 'targets': timings}, fh, indent=2)
+        print(f"timings saved to {opts.output}")
+
+    if differences:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+""" bench_mzxml_reader.py
+Compare the native mzXML reader (MzXMLReader) with pyteomics on the same files:
+
+    - conformance: every scan has the same num, msLevel and m/z and intensity
+      arrays (values and dtype) with both readers. Exit code 1 otherwise.
+    - speed: time to read every scan and decode the peaks of the scans at
+      --ms-level, with pyteomics (all scans decoded), pyteomics decoding
+      only the scans kept (decode_peaks), and the native reader.
+
+Synthetic files cover 32/64 bits, zlib/no compression and nested scans.
+An indexed mzML copy of every synthetic file without nested scans is read too
+(read_spectra): it must give the same scans as the mzXML file.
+Real files can be checked too with --input. tests/test_mzxml_reader.py runs the
+same checks on small synthetic files with pytest.
+
+python benchmarks/bench_mzxml_reader.py
+python benchmarks/bench_mzxml_reader.py --input C:/temp/MERCK --output reader.json
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_mzxml as synthetic
+
+# (precision, compression, nested) of the synthetic files.
+VARIANTS = [(32, 'zlib', False), (32, 'none', False), (64, 'zlib', False), (64, 'none', True), (32, 'zlib', True)]
+
+def same_array(a, b):
+    import numpy as np
+    return a.dtype == b.dtype and np.array_equal(a, b)
+
+def conformance(file_xml):
+    """ Compare every scan of file_xml read by pyteomics and by MzXMLReader.
+
+        Return: list of differences (strings), empty if the readers agree.
+    """
+    from iFishMass import __main__ as ifm
+
+    differences = []
+    with ifm.read_mzxml(file_xml) as expected, ifm.read_mzxml(file_xml, reader='native') as native:
+        expected, native = list(expected), list(native)
+        if len(expected) != len(native):
+            return [f"{file_xml}: {len(expected)} scans with pyteomics, {len(native)} with the native reader"]
+        for e, n in zip(expected, native):
+            for key in ('num', 'msLevel', 'peaksCount'):
+                if e.get(key) != n.get(key):
+                    differences.append(f"{file_xml} scan {e['num']}: {key} {e.get(key)} != {n.get(key)}")
+            for key in ('m/z array', 'intensity array'):
+                if not same_array(e[key], n[key]):
+                    differences.append(f"{file_xml} scan {e['num']}: {key} differs")
+    return differences
+
+def format_conformance(file_xml, file_mzml):
+    """ Compare every scan of the same data written as mzXML and as mzML.
+
+        Return: list of differences (strings), empty if both formats agree.
+    """
+    import numpy as np
+    from iFishMass import __main__ as ifm
+
+    differences = []
+    with ifm.read_spectra(file_xml, reader='native') as expected, ifm.read_spectra(file_mzml) as mzml:
+        expected, mzml = list(expected), list(mzml)
+        if len(expected) != len(mzml):
+            return [f"{file_mzml}: {len(expected)} scans in mzXML, {len(mzml)} in mzML"]
+        for e, m in zip(expected, mzml):
+            for key in ('num', 'msLevel'):
+                if e.get(key) != m.get(key):
+                    differences.append(f"{file_mzml} scan {e['num']}: {key} {e.get(key)} != {m.get(key)}")
+            # byte order differs (network in mzXML, little endian in mzML): compare values.
+            for key in ('m/z array', 'intensity array'):
+                if not np.array_equal(e[key], m[key]):
+                    differences.append(f"{file_mzml} scan {e['num']}: {key} differs")
+    return differences
+
+def read_all(files, ms_level, mode):
+    """ Read every scan of files and decode the peaks of the scans at ms_level.
+
+        Return: number of peaks decoded.
+    """
+    from iFishMass import __main__ as ifm
+
+    peaks = 0
+    for file_xml in files:
+        if mode == 'pyteomics':
+            reader = ifm.read_mzxml(file_xml)
+        elif mode == 'pyteomics_selective':
+            reader = ifm.read_mzxml(file_xml, decode_binary=False)
+        else:
+            reader = ifm.read_mzxml(file_xml, reader='native')
+        with reader:
+            for spectrum in reader:
+                if str(spectrum['msLevel']) != ms_level:
+                    continue
+                ifm.decode_peaks(spectrum)
+                peaks += len(spectrum['m/z array'])
+    return peaks
+
+def read_options(args=sys.argv[1:]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark and conformance check of the native mzXML reader.")
+    parser.add_argument("--input", help="directory of mzXML files (default: synthetic files)")
+    parser.add_argument("--output", help="JSON file with the timings")
+    parser.add_argument("--scans", type=int, default=400, help="scans per synthetic file")
+    parser.add_argument("--peaks", type=int, default=2000, help="peaks per scan")
+    parser.add_argument("--ms-levels", default="1,2,2,2", help="comma separated msLevel cycle")
+    parser.add_argument("--ms-level", default='1', help="msLevel decoded")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per reader; the best run is kept")
+    return parser.parse_args(args)
+
+def main():
+    import shutil
+    import tempfile
+    from iFishMass import __main__ as ifm
+
+    opts = read_options()
+    workdir = None
+    pairs = []
+    if opts.input:
+        files = list(ifm.get_mzxml_files_yield(opts.input))
+    else:
+        workdir = tempfile.mkdtemp(prefix='ifishmass_reader_')
+        files = []
+        for n, (precision, compression, nested) in enumerate(VARIANTS):
+            path = os.path.join(workdir, f"SYNTHETIC_{precision}_{compression}{'_nested' if nested else ''}.mzXML")
+            synthetic.write_mzxml(path, scans=opts.scans, peaks=opts.peaks, precision=precision,
+                compression=compression, nested=nested, seed=n,
+                ms_levels=synthetic.ms_levels_from_string(opts.ms_levels))
+            files.append(path)
+            if not nested:
+                mzml = os.path.splitext(path)[0] + '.mzML'
+                synthetic.write_mzml(mzml, scans=opts.scans, peaks=opts.peaks, precision=precision,
+                    compression=compression, seed=n, ms_levels=synthetic.ms_levels_from_string(opts.ms_levels))
+                pairs.append((path, mzml))
+
+    try:
+        differences = []
+        for file_xml in files:
+            differences.extend(conformance(file_xml))
+        for file_xml, file_mzml in pairs:
+            differences.extend(format_conformance(file_xml, file_mzml))
+        print(f"conformance: {len(files)} files, {len(pairs)} mzML copies, {len(differences)} differences")
+        for difference in differences[:20]:
+            print(f"\t{difference}")
+
+        timings = dict()
+        for mode in ('pyteomics', 'pyteomics_selective', 'native'):
+            runs = []
+            for _ in range(opts.repeat):
+                start = time.perf_counter()
+                peaks = read_all(files, opts.ms_level, mode)
+                runs.append(time.perf_counter() - start)
+            timings[mode] = {'best': min(runs), 'runs': runs, 'peaks': peaks}
+            print(f"\t{mode:20} {min(runs):.4f} s  ({peaks} peaks)  "
+                f"speedup x{timings['pyteomics']['best'] / min(runs):.1f}")
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if opts.output:
+        with open(opts.output, 'w') as fh:
+            json.dump({'files': len(files), 'differences': differences, 'stages': timings}, fh, indent=2)
+        print(f"timings saved to {opts.output}")
+
+    if differences:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
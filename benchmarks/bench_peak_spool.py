@@ -0,0 +1,115 @@
+""" bench_peak_spool.py
+Check and time the reports built within a memory budget (--max-memory, PeakSpool)
+against the reports built in memory (--in-memory, PeakTable), on the same
+random matched peaks:
+
+    - conformance: every report written from the PeakSpool, spilled to disk
+      or not, is the one written from the PeakTable, byte for byte. The peaks
+      hold scans where several targets have their highest intensity among all
+      RAW files, so the report among all RAW files names a scan file more than
+      once. Exit code 1 otherwise.
+    - speed: time of Raw.write_reports with both stores.
+
+python benchmarks/bench_peak_spool.py
+python benchmarks/bench_peak_spool.py --peaks 5000000 --max-memory 8 --output spool.json
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_mzxml as synthetic
+
+def random_peaks(opts, rng):
+    """ Matched peaks as PeakTable.append arguments, one dictionary per (RAW file, scan).
+        The last scan of the first RAW file holds the highest intensity of every target.
+    """
+    import numpy as np
+
+    masses = np.asarray(synthetic.DEMO_MASSES)
+    per_scan = max(1, opts.peaks // (opts.raw_files * opts.scans))
+    appends = []
+    for r in range(opts.raw_files):
+        for scan in range(1, opts.scans + 1):
+            targets = masses[rng.integers(0, len(masses), per_scan)]
+            mzs = (targets * (1 + rng.normal(0, 3e-6, per_scan))).astype(np.float32)
+            intensities = rng.uniform(0, 1e6, per_scan).astype(np.float32)
+            appends.append(dict(raw_name=f"SAMPLE_{r + 1:03d}", scan=scan, targets=targets, mzs=mzs, intensities=intensities))
+    # shared scan: every target peaks here, above any other intensity.
+    appends.append(dict(raw_name="SAMPLE_001", scan=opts.scans + 1, targets=masses, mzs=masses.astype(np.float32),
+        intensities=np.full(len(masses), 2e6, dtype=np.float32)))
+    return appends
+
+def write_reports(peaks, output_dir, masses, ppm):
+    """ Reports of peaks written to output_dir. Return: wall time (seconds).
+    """
+    from iFishMass.Raw import Raw
+
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    Raw('out', peaks=peaks).write_reports(ppm_tolerance=ppm, list_of_masses=masses, output_dir=output_dir)
+    return time.perf_counter() - start
+
+def read_options(args=sys.argv[1:]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark and conformance check of the reports of PeakSpool.")
+    parser.add_argument("--peaks", type=int, default=500_000, help="matched peaks")
+    parser.add_argument("--raw-files", type=int, default=8, help="RAW files")
+    parser.add_argument("--scans", type=int, default=500, help="scans per RAW file")
+    parser.add_argument("--ppm", type=float, default=10, help="ppm tolerance")
+    parser.add_argument("--max-memory", type=int, default=1, metavar='MB',
+        help="memory budget of the spilled PeakSpool (the other one holds every peak in memory)")
+    parser.add_argument("--output", help="JSON file with the timings")
+    return parser.parse_args(args)
+
+def main():
+    import shutil
+    import filecmp
+    import tempfile
+    import numpy as np
+    from iFishMass.Raw import Raw
+    from iFishMass.PeakTable import PeakTable
+    from iFishMass.PeakSpool import PeakSpool
+
+    opts = read_options()
+    masses = list(synthetic.DEMO_MASSES)
+    appends = random_peaks(opts, np.random.default_rng(0))
+
+    workdir = tempfile.mkdtemp(prefix='ifishmass_spool_')
+    differences, timings = [], dict()
+    try:
+        table = PeakTable()
+        for kwargs in appends:
+            table.append(**kwargs)
+        timings['peak_table'] = write_reports(table, os.path.join(workdir, 'table'), masses, opts.ppm)
+
+        budgets = {'spool_in_memory': 1 << 40, 'spool_spilled': opts.max_memory * 1024 * 1024}
+        for name, budget in budgets.items():
+            with PeakSpool(masses, opts.ppm, budget, directory=workdir) as spool:
+                for kwargs in appends:
+                    spool.append(**kwargs)
+                timings[name] = write_reports(spool, os.path.join(workdir, name), masses, opts.ppm)
+            for report in sorted(os.listdir(os.path.join(workdir, 'table'))):
+                found = os.path.join(workdir, name, report)
+                if not os.path.exists(found) or not filecmp.cmp(os.path.join(workdir, 'table', report), found, shallow=False):
+                    differences.append(f"{name}: {report} differs from the PeakTable report")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"conformance: {len(differences)} differences")
+    for difference in differences:
+        print(f"\t{difference}")
+    print(f"\t{len(appends)} scans: " + "  ".join(f"{name} {t:.4f} s" for name, t in timings.items()))
+
+    if opts.output:
+        with open(opts.output, 'w') as fh:
+            json.dump({'differences': differences, 'timings': timings, 'parameters': vars(opts)}, fh, indent=2)
+        print(f"timings saved to {opts.output}")
+
+    if differences:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
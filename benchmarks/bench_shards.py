@@ -0,0 +1,140 @@
+""" bench_shards.py
+Check and time a run split in shards (--shard i/N, then merge) against a single
+run, on synthetic mzXML files. The shards are N local processes started at
+the same time and sharing one output directory, like N machines sharing a
+network folder:
+
+    - conformance: the reports written by merge are the ones of a single
+      --in-memory run, byte for byte. Exit code 1 otherwise.
+    - speed: wall time of the single run, of the N shards (running together) and of merge.
+
+python benchmarks/bench_shards.py
+python benchmarks/bench_shards.py --files 16 --shards 4 --output shards.json
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_mzxml as synthetic
+
+REPORTS = ('intensities_among_all_raw.csv', 'highest_intensities_per_raw.csv',
+    'highest_intensities_among_all_raw.csv', 'highest_intensities_per_raw_wide.csv')
+
+def write_ini(location, data_folder, output, ppm):
+    """ peak.ini with the demo masses and groups.
+    """
+    masses = synthetic.DEMO_MASSES
+    sections = {
+        'data_folder': {'location': data_folder},
+        'ms_level': {'level': '1'},
+        'ppm': {'value': str(ppm)},
+        'list_of_masses': { f"value{i + 1}": str(m) for i, m in enumerate(masses) },
+        'internal_standard': { f"value{i + 1}": str(m) for i, m in enumerate(masses[9:13]) },
+        'modified_peptides': { f"value{i + 1}": str(m) for i, m in enumerate(masses[0:4]) },
+        'unmodified_peptides': { f"value{i + 1}": str(m) for i, m in enumerate(masses[4:9]) },
+        'debug': {'debug': 'False'},
+        'output': {'location': output},
+    }
+    with open(location, 'w') as fh:
+        for section, values in sections.items():
+            fh.write(f"[{section}]\n")
+            fh.writelines(f"{key}={value}\n" for key, value in values.items())
+
+def start(args, cwd):
+    """ Start iFishMass with args in a new process, in directory cwd.
+    """
+    import subprocess
+    import iFishMass
+
+    env = dict(os.environ)
+    src = os.path.dirname(os.path.dirname(os.path.abspath(iFishMass.__file__)))
+    env['PYTHONPATH'] = src + os.pathsep + env.get('PYTHONPATH', '')
+    os.makedirs(cwd, exist_ok=True)
+    return subprocess.Popen([sys.executable, '-m', 'iFishMass'] + args, cwd=cwd, env=env,
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+def wait(processes):
+    """ Wait for every process. Return: list of error messages (empty if all succeeded).
+    """
+    errors = []
+    for process in processes:
+        _, stderr = process.communicate()
+        if process.returncode != 0:
+            errors.append(f"{' '.join(process.args[3:])} failed:\n{stderr[-2000:]}")
+    return errors
+
+def read_options(args=sys.argv[1:]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark and conformance check of sharded runs and merge.")
+    parser.add_argument("--files", type=int, default=8, help="number of mzXML files")
+    parser.add_argument("--scans", type=int, default=200, help="scans per file")
+    parser.add_argument("--peaks", type=int, default=2000, help="peaks per scan")
+    parser.add_argument("--shards", type=int, default=3, help="number of shards (local processes)")
+    parser.add_argument("--ppm", type=int, default=10, help="ppm tolerance")
+    parser.add_argument("--workdir", help="directory for the synthetic data (default: a temporary directory)")
+    parser.add_argument("--output", help="JSON file with the timings")
+    return parser.parse_args(args)
+
+def main():
+    import shutil
+    import filecmp
+    import tempfile
+
+    opts = read_options()
+    if opts.workdir:
+        os.makedirs(opts.workdir, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='ifishmass_shards_', dir=opts.workdir)
+    timings, errors, differences = dict(), [], []
+    try:
+        data_folder = os.path.join(workdir, 'mzxml')
+        synthetic.generate_dataset(data_folder, files=opts.files, scans=opts.scans, peaks=opts.peaks,
+            ms_levels=(1, 2, 2, 2))
+
+        # single run, and N shards then merge. Reports name the samples after the
+        # output directory, both use the same one.
+        ini_file = os.path.join(workdir, 'peak.ini')
+        os.makedirs(os.path.join(workdir, 'output'))
+        write_ini(ini_file, data_folder, os.path.join(workdir, 'output'), opts.ppm)
+        single, merged = os.path.join(workdir, 'single'), os.path.join(workdir, 'merged')
+
+        begin = time.perf_counter()
+        errors += wait([start(['--inifile', ini_file, '--in-memory', '--no-template'], single)])
+        timings['single'] = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        errors += wait([ start(['--inifile', ini_file, '--shard', f"{i}/{opts.shards}"], os.path.join(workdir, f"shard_{i}"))
+            for i in range(1, opts.shards + 1) ])
+        timings['shards'] = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        errors += wait([start(['merge', '--inifile', ini_file, '--no-template'], merged)])
+        timings['merge'] = time.perf_counter() - begin
+
+        for report in REPORTS:
+            if errors or not filecmp.cmp(os.path.join(single, report), os.path.join(merged, report), shallow=False):
+                differences.append(f"{report} differs from the single run")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for error in errors:
+        print(error)
+    print(f"conformance: {len(differences)} differences")
+    for difference in differences:
+        print(f"\t{difference}")
+    print(f"\t{opts.files} files: single run {timings.get('single', 0):.2f} s  {opts.shards} shards "
+        f"{timings.get('shards', 0):.2f} s  merge {timings.get('merge', 0):.2f} s")
+
+    if opts.output:
+        with open(opts.output, 'w') as fh:
+            json.dump({'differences': differences, 'errors': errors, 'timings': timings,
+                'parameters': vars(opts)}, fh, indent=2)
+        print(f"timings saved to {opts.output}")
+
+    if errors or differences:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+""" bench_startup.py
+Time the start of the iFishMass command line (python -X importtime) for the
+commands that do not process any data:
+
+    - import : import iFishMass.__main__
+    - help   : iFishMass --help
+    - printini: iFishMass --printini
+    - missing_ini: iFishMass --inifile <file that does not exist>
+    - bad_ini: iFishMass --inifile <INI file without [ppm]>
+
+For every command the time spent importing modules (best of --repeat runs)
+is saved as JSON. None of them may import a heavy module (numpy, pandas,
+openpyxl, pyteomics, numba, ...): such an import, or a command slower than
+threshold x baseline (--compare), gives exit code 1. Timings of a few tens of
+milliseconds are noisy; the heavy module check does not depend on the machine.
+
+python benchmarks/bench_startup.py --output startup.json
+python benchmarks/bench_startup.py --output new.json --compare startup.json --threshold 2
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import run_benchmarks
+
+# modules the commands above must not import.
+HEAVY_MODULES = ('numpy', 'pandas', 'openpyxl', 'pyteomics', 'lxml', 'numba', 'spectrum_utils',
+    'matplotlib', 'pkg_resources', 'tqdm', 'psims')
+
+BAD_INI = """[data_folder]
+location=.
+[ms_level]
+level=1
+[list_of_masses]
+value1=881.39739
+[output]
+location=.
+"""
+
+def commands(workdir):
+    """ argv of every command run (None: import only).
+    """
+    bad_ini = os.path.join(workdir, 'bad.ini')
+    with open(bad_ini, 'w') as fh:
+        fh.write(BAD_INI)
+    return {
+        'import'     : None,
+        'help'       : ['--help'],
+        'printini'   : ['--printini'],
+        'missing_ini': ['--inifile', os.path.join(workdir, 'missing.ini')],
+        'bad_ini'    : ['--inifile', bad_ini],
+    }
+
+def import_times(stderr):
+    """ Parse the output of python -X importtime.
+
+        Return: dictionary top level module -> cumulative import time (seconds),
+        and the set of every module imported.
+    """
+    top, modules = dict(), set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, field = line[len('import time:'):].split('|')
+        name = field.strip()
+        modules.add(name.split('.')[0])
+        # nested imports are indented under the module importing them.
+        if len(field) - len(field.lstrip()) == 1:
+            top[name] = int(cumulative) / 1_000_000
+    return top, modules
+
+def run_command(argv, workdir):
+    """ Run iFishMass with argv in a new interpreter.
+
+        Return: wall time (seconds), import time of iFishMass (seconds), modules imported.
+    """
+    import subprocess
+    import iFishMass
+
+    if argv is None:
+        code = "import iFishMass.__main__"
+    else:
+        code = f"import sys; sys.argv = ['iFishMass'] + {argv!r}; from iFishMass.__main__ import main; main()"
+    env = dict(os.environ)
+    src = os.path.dirname(os.path.dirname(os.path.abspath(iFishMass.__file__)))
+    env['PYTHONPATH'] = src + os.pathsep + env.get('PYTHONPATH', '')
+
+    start = time.perf_counter()
+    done = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=workdir, env=env,
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+    top, modules = import_times(done.stderr)
+    # main() imports at run time: every top level import but the interpreter's own (site, encodings).
+    imported = sum(t for name, t in top.items() if name not in ('site', 'encodings', 'zipimport', '_frozen_importlib_external'))
+    return wall, imported, modules
+
+def read_options(args=sys.argv[1:]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the start of the iFishMass command line.")
+    parser.add_argument("--output", default='startup.json', help="JSON file with the timings")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per command; the best run is kept")
+    parser.add_argument("--compare", metavar='JSON', help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=2.0,
+        help="with --compare, a command slower than threshold x baseline is a regression (exit code 1)")
+    return parser.parse_args(args)
+
+def main():
+    import shutil
+    import tempfile
+
+    opts = read_options()
+    workdir = tempfile.mkdtemp(prefix='ifishmass_startup_')
+    stages, heavy = dict(), dict()
+    try:
+        for name, argv in commands(workdir).items():
+            runs, walls, modules = [], [], set()
+            for _ in range(opts.repeat):
+                wall, imported, modules = run_command(argv, workdir)
+                runs.append(imported)
+                walls.append(wall)
+            stages[name] = {'best': min(runs), 'runs': runs, 'wall': min(walls), 'modules': len(modules)}
+            heavy[name] = sorted(m for m in HEAVY_MODULES if m in modules)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'environment': run_benchmarks.environment(),
+        'parameters': {'repeat': opts.repeat},
+        'stages': stages,
+        'heavy_imports': heavy,
+    }
+    with open(opts.output, 'w') as fh:
+        json.dump(results, fh, indent=2)
+    print(f"timings saved to {opts.output}")
+
+    failed = False
+    for name, values in stages.items():
+        print(f"\t{name:12} imports {values['best']:.4f} s  wall {values['wall']:.4f} s  "
+            f"({values['modules']} modules){'  heavy: ' + ', '.join(heavy[name]) if heavy[name] else ''}")
+        failed = failed or len(heavy[name]) > 0
+
+    if opts.compare:
+        regressions = run_benchmarks.compare(results, opts.compare, opts.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} command(s) slower than {opts.threshold} x baseline")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
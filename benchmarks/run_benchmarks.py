@@ -0,0 +1,230 @@
+""" run_benchmarks.py
+Time every stage of the iFishMass pipeline on synthetic mzXML files and save
+the timings as JSON, so releases can be compared and regressions caught.
+
+Stages: parse, filter_peaks, scan output (CSV and NPZ), Raw discovery, each Raw
+report, all reports in a single pass, long_to_wide and DataAnalysis.do_analysis.
+
+python benchmarks/run_benchmarks.py --output bench.json
+python benchmarks/run_benchmarks.py --output new.json --compare old.json --threshold 1.25
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_mzxml as synthetic
+
+def timed(timings, stage):
+    """ Context manager adding the wall time of the block to timings[stage].
+    """
+    from contextlib import contextmanager
+
+    @contextmanager
+    def timer():
+        start = time.perf_counter()
+        yield
+        timings.setdefault(stage, []).append(time.perf_counter() - start)
+    return timer()
+
+def run_pipeline(workdir, opts, timings):
+    """ Run every stage of the pipeline once in workdir, adding the wall time
+        of each stage to timings.
+    """
+    import iFishMass
+    from iFishMass import __main__ as ifm
+    from iFishMass.Raw import Raw
+    from iFishMass.DataAnalysis import DataAnalysis
+
+    masses = synthetic.DEMO_MASSES
+    ppm = opts.ppm
+    ms_level = str(opts.ms_level)
+    mzxml_dir = os.path.join(workdir, 'mzxml')
+    csv_dir = os.path.join(workdir, 'csv')
+    npz_dir = os.path.join(workdir, 'npz')
+
+    files = synthetic.generate_dataset(mzxml_dir, files=opts.files, scans=opts.scans, peaks=opts.peaks,
+        ms_levels=synthetic.ms_levels_from_string(opts.ms_levels), precision=opts.precision,
+        compression=opts.compression, seed=opts.seed)
+
+    # parse: read and decode every scan.
+    spectra = []
+    with timed(timings, 'parse'):
+        for file_xml in files:
+            raw_name = os.path.splitext(os.path.basename(file_xml))[0]
+            with ifm.read_mzxml(file_xml) as reader:
+                for spectrum in reader:
+                    spectra.append((raw_name, spectrum))
+
+    # filter_peaks: scans at ms_level only, ppm windows built once.
+    filtered = []
+    with timed(timings, 'filter_peaks'):
+        windows = ifm.mass_windows(masses, ppm)
+        for raw_name, spectrum in spectra:
+            if str(spectrum['msLevel']) != ms_level:
+                continue
+            sp = ifm.filter_peaks(spectrum, windows, ppm)
+            if not ifm.spectrum_is_empty(sp):
+                filtered.append((raw_name, sp))
+    del spectra
+
+    # scan output: one CSV file per scan.
+    with timed(timings, 'scan_output_csv'):
+        for raw_name, sp in filtered:
+            raw_dir = os.path.join(csv_dir, raw_name)
+            if not os.path.exists(raw_dir):
+                os.makedirs(raw_dir)
+            ifm.save_as_csv(sp, os.path.join(raw_dir, f"{sp['num']}.csv"))
+
+    # scan output: one NPZ file per RAW file.
+    with timed(timings, 'scan_output_npz'):
+        by_raw = dict()
+        for raw_name, sp in filtered:
+            by_raw.setdefault(raw_name, []).append(sp)
+        for raw_name, sps in by_raw.items():
+            ifm.save_as_npz(npz_dir, raw_name, [ int(sp['num']) for sp in sps ],
+                [ sp['m/z array'] for sp in sps ], [ sp['intensity array'] for sp in sps ])
+
+    # reports one at a time.
+    with timed(timings, 'raw_discovery'):
+        r1 = Raw(csv_dir)
+
+    with timed(timings, 'report_intensities_among_all_raw'):
+        r1.intensities_among_all_raw_files(ppm_tolerance=ppm, list_of_masses=masses)
+        r1.save_to_csv(os.path.join(workdir, 'intensities_among_all_raw.csv'))
+
+    with timed(timings, 'report_highest_intensities_per_raw'):
+        r1.get_highest_intensities_per_raw(ppm_tolerance=ppm, list_of_masses=masses)
+        r1.save_to_csv(os.path.join(workdir, 'highest_intensities_per_raw.csv'))
+
+    wide_csv = os.path.join(workdir, 'highest_intensities_per_raw_wide.csv')
+    with timed(timings, 'long_to_wide'):
+        r1.long_to_wide(csv_filename=wide_csv)
+
+    with timed(timings, 'report_highest_intensities_among_all_raw'):
+        r1.get_highest_intensity_among_all_raw_files(ppm_tolerance=ppm, list_of_masses=masses)
+        r1.save_to_csv(os.path.join(workdir, 'highest_intensities_among_all_raw.csv'))
+
+    # all reports in a single pass, as main() builds them.
+    with timed(timings, 'reports_single_pass'):
+        r3 = Raw(csv_dir)
+        r3.write_reports(ppm_tolerance=ppm, list_of_masses=masses, output_dir=workdir)
+
+    # same reports, read from the NPZ scan files.
+    with timed(timings, 'report_intensities_among_all_raw_npz'):
+        r2 = Raw(npz_dir)
+        r2.intensities_among_all_raw_files(ppm_tolerance=ppm, list_of_masses=masses)
+        r2.save_to_csv(os.path.join(workdir, 'intensities_among_all_raw_npz.csv'))
+
+    with timed(timings, 'data_analysis'):
+        template = os.path.join(os.path.dirname(iFishMass.__file__), 'data', 'template.xlsx')
+        d = DataAnalysis(location=wide_csv, output=os.path.join(workdir, 'analysis_plot.xlsx'),
+            modified_peptides=set(masses[0:4]), unmodified_peptides=set(masses[4:9]),
+            internal_standard=set(masses[9:13]), template_file=template, debug=False)
+        d.do_analysis()
+
+def environment():
+    """ Versions and machine the benchmark ran on.
+    """
+    import platform
+    import numpy as np
+
+    try:
+        from importlib.metadata import version
+        ifishmass_version = version('iFishMass')
+    except Exception:
+        ifishmass_version = 'unknown'
+
+    return {
+        'ifishmass': ifishmass_version,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+def compare(results, baseline_file, threshold):
+    """ Print the ratio current/baseline of every stage (best run).
+
+        Return:
+            list of stages slower than threshold times the baseline.
+    """
+    with open(baseline_file) as fh:
+        baseline = json.load(fh)
+
+    regressions = []
+    print(f"\n{'stage':45} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for stage, current in results['stages'].items():
+        old = baseline.get('stages', {}).get(stage)
+        if old is None:
+            print(f"{stage:45} {'-':>10} {current['best']:10.4f} {'new':>7}")
+            continue
+        ratio = current['best'] / old['best'] if old['best'] > 0 else float('inf')
+        flag = ''
+        if ratio > threshold:
+            regressions.append(stage)
+            flag = '  <-- REGRESSION'
+        print(f"{stage:45} {old['best']:10.4f} {current['best']:10.4f} {ratio:7.2f}{flag}")
+    return regressions
+
+def read_options(args=sys.argv[1:]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the iFishMass pipeline.")
+    parser.add_argument("--output", default='benchmark.json', help="JSON file with the timings")
+    parser.add_argument("--files", type=int, default=4, help="number of mzXML files")
+    parser.add_argument("--scans", type=int, default=200, help="scans per file")
+    parser.add_argument("--peaks", type=int, default=2000, help="peaks per scan")
+    parser.add_argument("--ms-levels", default="1,2,2,2", help="comma separated msLevel cycle")
+    parser.add_argument("--ms-level", type=int, default=1, help="msLevel filtered (peak.ini [ms_level])")
+    parser.add_argument("--ppm", type=int, default=10, help="ppm tolerance")
+    parser.add_argument("--precision", type=int, choices=[32, 64], default=32)
+    parser.add_argument("--compression", choices=['zlib', 'none'], default='zlib')
+    parser.add_argument("--repeat", type=int, default=3, help="runs of the whole pipeline; the best run is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="directory for the synthetic data (default: a temporary directory)")
+    parser.add_argument("--compare", metavar='JSON', help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+        help="with --compare, a stage slower than threshold x baseline is a regression (exit code 1)")
+    return parser.parse_args(args)
+
+def main():
+    import shutil
+    import tempfile
+
+    opts = read_options()
+    timings = dict()
+
+    for run in range(opts.repeat):
+        workdir = tempfile.mkdtemp(prefix='ifishmass_bench_', dir=opts.workdir)
+        try:
+            run_pipeline(workdir, opts, timings)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        print(f"run {run + 1}/{opts.repeat} done")
+
+    parameters = { k: v for k, v in vars(opts).items() if k not in ('output', 'compare', 'threshold', 'workdir') }
+    results = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'environment': environment(),
+        'parameters': parameters,
+        'stages': { stage: {'best': min(runs), 'runs': runs} for stage, runs in timings.items() },
+    }
+
+    with open(opts.output, 'w') as fh:
+        json.dump(results, fh, indent=2)
+    print(f"timings saved to {opts.output}")
+
+    for stage, values in results['stages'].items():
+        print(f"\t{stage:45} {values['best']:.4f} s")
+
+    if opts.compare:
+        regressions = compare(results, opts.compare, opts.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) slower than {opts.threshold} x baseline")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+""" synthetic_mzxml.py
+Write synthetic mzXML (or indexed mzML) files, so iFishMass can be benchmarked
+without lab data.
+
+Every scan holds random peaks (sorted m/z) plus, with probability hit_rate,
+a peak within a few ppm of every target mass, so filtering and reports have
+something to find.
+
+python benchmarks/synthetic_mzxml.py --output C:/temp/SYNTHETIC --files 8 --scans 500 --peaks 2000
+python benchmarks/synthetic_mzxml.py --output C:/temp/SYNTHETIC_MZML --format mzML
+"""
+import sys
+
+# masses of the demo peak.ini file (iFishMass --printini)
+DEMO_MASSES = [881.39739, 1761.78747, 587.93404, 441.20236, 1189.48879, 1190.49607, 595.75169,
+    397.50357, 298.37951, 1296.68481, 648.84607, 432.89982, 324.92669]
+
+def encode_peaks(mzs, intensities, precision, compression):
+    """ Encode m/z, intensity pairs the way mzXML stores them:
+        interleaved, network byte order, optionally zlib compressed, base64.
+
+        Return: (base64 string, compressed length)
+    """
+    import base64
+    import zlib
+    import numpy as np
+
+    dtype = '>f4' if precision == 32 else '>f8'
+    pairs = np.empty(2 * len(mzs), dtype=dtype)
+    pairs[0::2] = mzs
+    pairs[1::2] = intensities
+    payload = pairs.tobytes()
+    compressed_len = 0
+    if compression == 'zlib':
+        payload = zlib.compress(payload)
+        compressed_len = len(payload)
+    return base64.b64encode(payload).decode('ascii'), compressed_len
+
+def random_scans(scans, peaks, ms_levels, masses, hit_rate, ppm_spread, seed):
+    """ Yield (num, ms_level, mzs, intensities) for every synthetic scan.
+        Same arguments and seed, same scans, whatever the file format.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    masses = np.asarray(masses, dtype=np.float64)
+    for num in range(1, scans + 1):
+        ms_level = int(ms_levels[(num - 1) % len(ms_levels)])
+        mzs = rng.uniform(200, 2000, peaks)
+        hits = masses[rng.random(len(masses)) < hit_rate]
+        if len(hits) > 0:
+            slots = rng.choice(peaks, size=min(len(hits), peaks), replace=False)
+            mzs[slots] = hits[:len(slots)] * (1 + rng.normal(0, ppm_spread * 1e-6, len(slots)))
+        mzs.sort()
+        intensities = rng.uniform(1e3, 1e7, peaks)
+        yield num, ms_level, mzs, intensities
+
+def write_mzxml(filename, *, scans=100, peaks=1000, ms_levels=(1,), precision=32, compression='zlib',
+    masses=DEMO_MASSES, hit_rate=0.5, ppm_spread=3, seed=0, nested=False):
+    """ Write a synthetic mzXML file.
+
+        Parameters:
+        -----------
+        filename   : output file path
+        scans      : number of scans (integer)
+        peaks      : number of peaks per scan (integer)
+        ms_levels  : msLevel of the scans, repeated as a cycle. e.g. (1, 2, 2, 2) for DDA.
+        precision  : 32 or 64 bits floating point values
+        compression: 'zlib' or 'none'
+        masses     : target masses injected in the scans
+        hit_rate   : probability of injecting every target mass in a scan
+        ppm_spread : standard deviation (ppm) of the injected peaks around the targets
+        seed       : random seed. Same arguments and seed, same file.
+        nested     : nest the MS2+ scans inside the preceding MS1 scan, like some
+                     converters do.
+        Return:
+            number of bytes written
+    """
+    assert precision in (32, 64), "precision must be 32 or 64."
+    assert compression in ('zlib', 'none'), "compression must be 'zlib' or 'none'."
+    assert scans >= 1 and peaks >= 1, "scans and peaks must be positive integers."
+
+    out = []
+    offsets = []
+    position = 0
+
+    def emit(text):
+        nonlocal position
+        out.append(text)
+        position += len(text.encode('ascii'))
+
+    emit('<?xml version="1.0" encoding="ISO-8859-1"?>\n')
+    emit('<mzXML xmlns="http://sashimi.sourceforge.net/schema_revision/mzXML_3.2">\n')
+    emit(f' <msRun scanCount="{scans}">\n')
+
+    open_ms1 = False
+    for num, ms_level, mzs, intensities in random_scans(scans, peaks, ms_levels, masses, hit_rate, ppm_spread, seed):
+        data, compressed_len = encode_peaks(mzs, intensities, precision, compression)
+
+        if nested and open_ms1 and ms_level == 1:
+            emit('  </scan>\n')
+            open_ms1 = False
+
+        offsets.append((num, position + 2))
+        emit(f'  <scan num="{num}" scanType="Full" centroided="1" msLevel="{ms_level}" '
+             f'peaksCount="{peaks}" polarity="+" retentionTime="PT{num * 0.5:.1f}S" '
+             f'lowMz="{mzs[0]:.4f}" highMz="{mzs[-1]:.4f}" totIonCurrent="{intensities.sum():.1f}" '
+             f'filterLine="FTMS + p ESI Full ms{ms_level if ms_level > 1 else ""}">\n')
+        emit(f'   <peaks compressionType="{compression}" compressedLen="{compressed_len}" '
+             f'precision="{precision}" byteOrder="network" contentType="m/z-int">{data}</peaks>\n')
+
+        if nested and ms_level == 1:
+            open_ms1 = True
+        else:
+            emit('  </scan>\n')
+
+    if open_ms1:
+        emit('  </scan>\n')
+    emit(' </msRun>\n')
+
+    index_offset = position + 1
+    emit(' <index name="scan">\n')
+    for num, offset in offsets:
+        emit(f'  <offset id="{num}">{offset}</offset>\n')
+    emit(' </index>\n')
+    emit(f' <indexOffset>{index_offset}</indexOffset>\n')
+    emit('</mzXML>\n')
+
+    with open(filename, 'w', encoding='ascii', newline='\n') as fh:
+        fh.write(''.join(out))
+    return position
+
+def write_mzml(filename, *, scans=100, peaks=1000, ms_levels=(1,), precision=32, compression='zlib',
+    masses=DEMO_MASSES, hit_rate=0.5, ppm_spread=3, seed=0):
+    """ Write a synthetic indexed mzML file, with the same scans write_mzxml
+        writes for the same arguments. m/z and intensity are stored as two
+        binary arrays (little endian), and the spectrum offsets in indexList.
+
+        Parameters: see write_mzxml (spectra are never nested in mzML).
+        Return:
+            number of bytes written
+    """
+    import base64
+    import hashlib
+    import zlib
+    import numpy as np
+
+    assert precision in (32, 64), "precision must be 32 or 64."
+    assert compression in ('zlib', 'none'), "compression must be 'zlib' or 'none'."
+    assert scans >= 1 and peaks >= 1, "scans and peaks must be positive integers."
+
+    dtype = '<f4' if precision == 32 else '<f8'
+    precision_cv = ('MS:1000521', '32-bit float') if precision == 32 else ('MS:1000523', '64-bit float')
+    compression_cv = ('MS:1000574', 'zlib compression') if compression == 'zlib' else ('MS:1000576', 'no compression')
+
+    def binary(values, accession, name):
+        payload = np.asarray(values, dtype=dtype).tobytes()
+        if compression == 'zlib':
+            payload = zlib.compress(payload)
+        data = base64.b64encode(payload).decode('ascii')
+        return (f'      <binaryDataArray encodedLength="{len(data)}">\n'
+            f'       <cvParam cvRef="MS" accession="{precision_cv[0]}" name="{precision_cv[1]}"/>\n'
+            f'       <cvParam cvRef="MS" accession="{compression_cv[0]}" name="{compression_cv[1]}"/>\n'
+            f'       <cvParam cvRef="MS" accession="{accession}" name="{name}"/>\n'
+            f'       <binary>{data}</binary>\n'
+            f'      </binaryDataArray>\n')
+
+    out = []
+    offsets = []
+    position = 0
+
+    def emit(text):
+        nonlocal position
+        out.append(text)
+        position += len(text.encode('ascii'))
+
+    emit('<?xml version="1.0" encoding="utf-8"?>\n')
+    emit('<indexedmzML xmlns="http://psi.hupo.org/ms/mzml">\n')
+    emit('<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0">\n')
+    emit(' <cvList count="1">\n')
+    emit('  <cv id="MS" fullName="Proteomics Standards Initiative Mass Spectrometry Ontology" '
+         'URI="https://raw.githubusercontent.com/HUPO-PSI/psi-ms-CV/master/psi-ms.obo"/>\n')
+    emit(' </cvList>\n')
+    emit(' <run id="synthetic">\n')
+    emit(f'  <spectrumList count="{scans}" defaultDataProcessingRef="synthetic">\n')
+
+    for num, ms_level, mzs, intensities in random_scans(scans, peaks, ms_levels, masses, hit_rate, ppm_spread, seed):
+        native_id = f"controllerType=0 controllerNumber=1 scan={num}"
+        offsets.append((native_id, position + 3))
+        emit(f'   <spectrum index="{num - 1}" id="{native_id}" defaultArrayLength="{peaks}">\n')
+        emit(f'    <cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="{ms_level}"/>\n')
+        emit(f'    <cvParam cvRef="MS" accession="MS:1000504" name="base peak m/z" value="{mzs[np.argmax(intensities)]:.4f}"/>\n')
+        emit(f'    <cvParam cvRef="MS" accession="MS:1000285" name="total ion current" value="{intensities.sum():.1f}"/>\n')
+        emit('    <binaryDataArrayList count="2">\n')
+        emit(binary(mzs, 'MS:1000514', 'm/z array'))
+        emit(binary(intensities, 'MS:1000515', 'intensity array'))
+        emit('    </binaryDataArrayList>\n')
+        emit('   </spectrum>\n')
+
+    emit('  </spectrumList>\n')
+    emit(' </run>\n')
+    emit('</mzML>\n')
+
+    index_offset = position
+    emit('<indexList count="1">\n')
+    emit(' <index name="spectrum">\n')
+    for native_id, offset in offsets:
+        emit(f'  <offset idRef="{native_id}">{offset}</offset>\n')
+    emit(' </index>\n')
+    emit('</indexList>\n')
+    emit(f'<indexListOffset>{index_offset}</indexListOffset>\n')
+    emit('<fileChecksum>')
+    # SHA-1 of the file up to and including the opening fileChecksum tag.
+    checksum = hashlib.sha1(''.join(out).encode('ascii')).hexdigest()
+    emit(f'{checksum}</fileChecksum>\n')
+    emit('</indexedmzML>\n')
+
+    with open(filename, 'w', encoding='ascii', newline='\n') as fh:
+        fh.write(''.join(out))
+    return position
+
+def generate_dataset(output_dir, files=4, prefix='SAMPLE', file_format='mzXML', **kwargs):
+    """ Write files synthetic mzXML (or mzML) files (<prefix>_<n>.<file_format>)
+        to output_dir. Every file gets its own seed. kwargs are passed to
+        write_mzxml (or write_mzml).
+
+        Return:
+            list of file paths
+    """
+    import os
+
+    assert file_format in ('mzXML', 'mzML'), "file_format must be 'mzXML' or 'mzML'."
+    write = write_mzxml if file_format == 'mzXML' else write_mzml
+    os.makedirs(output_dir, exist_ok=True)
+    seed = kwargs.pop('seed', 0)
+    paths = []
+    for n in range(files):
+        path = os.path.join(output_dir, f"{prefix}_{n + 1:03d}.{file_format}")
+        write(path, seed=seed + n, **kwargs)
+        paths.append(path)
+    return paths
+
+def read_options(args=sys.argv[1:]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write synthetic mzXML or mzML files.")
+    parser.add_argument("--output", required=True, help="output directory")
+    parser.add_argument("--format", choices=['mzXML', 'mzML'], default='mzXML', help="file format")
+    parser.add_argument("--files", type=int, default=4, help="number of files")
+    parser.add_argument("--scans", type=int, default=100, help="scans per file")
+    parser.add_argument("--peaks", type=int, default=1000, help="peaks per scan")
+    parser.add_argument("--ms-levels", default="1", help="comma separated msLevel cycle, e.g. 1,2,2,2")
+    parser.add_argument("--precision", type=int, choices=[32, 64], default=32)
+    parser.add_argument("--compression", choices=['zlib', 'none'], default='zlib')
+    parser.add_argument("--hit-rate", type=float, default=0.5, help="probability of injecting each target mass")
+    parser.add_argument("--nested", action='store_true', help="nest MS2+ scans inside MS1 scans (mzXML only)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(args)
+
+def ms_levels_from_string(text):
+    return tuple(int(level) for level in text.split(','))
+
+if __name__ == '__main__':
+    opts = read_options()
+    extra = {'nested': opts.nested} if opts.format == 'mzXML' else {}
+    paths = generate_dataset(opts.output, files=opts.files, file_format=opts.format, scans=opts.scans,
+        peaks=opts.peaks, ms_levels=ms_levels_from_string(opts.ms_levels), precision=opts.precision,
+        compression=opts.compression, hit_rate=opts.hit_rate, seed=opts.seed, **extra)
+    print(f"{len(paths)} files written to {opts.output}")
@@ -1,8 +1,9 @@
-import pandas as np
 import os
+import numpy as np
 
 class DataAnalysis:
-    def __init__(self, location, output, modified_peptides, unmodified_peptides, internal_standard, template_file, debug):
+    def __init__(self, location, output, modified_peptides, unmodified_peptides, internal_standard, template_file, debug,
+            groups=None, ratios=None):
         """ Object initialization.
             
             Parameters:
@@ -15,8 +16,18 @@ class DataAnalysis:
             unmodified_peptides: set of all unmodified_peptides. Read from peak.ini file
             internal_starndard : set of all internal standard. Read from peak.ini file
             template_file: location of the excel template file 'template.xlsx'. 
+                    None: the data is written to a new workbook without template
+                    (no plots), in write-only mode: rows are streamed to the file
+                    instead of being held as workbook cells. The wide table and its
+                    columns are still loaded in memory.
             debug:  optional parameter (boolean) for debbuging purposes.
                     set to False for default.
+            groups: optional named groups (dictionary name -> set of masses). Every
+                    group adds its total and, with an internal standard, its total
+                    normalized by the internal standard.
+            ratios: optional ratios (dictionary name -> (numerator, denominator)),
+                    between group names: internal_standard, modified_peptides,
+                    unmodified_peptides or a key of groups.
             
             exceptions:
 
@@ -26,7 +37,7 @@ class DataAnalysis:
             f"{location} file does not exits.\nPLease Re-run peakEXtractor.py to generate it."
         
         # check that template file exist
-        assert os.path.exists(template_file), \
+        assert template_file is None or os.path.exists(template_file), \
             f"{template_file} template does not exits.\nPLease copy {template_file} from source code to current directory."
         
         self.location = location
@@ -37,10 +48,31 @@ class DataAnalysis:
         self.template_file = template_file
         self.debug = debug
 
+        # every group, the three of the template first.
+        self.groups = {
+            'internal_standard'  : set(internal_standard),
+            'modified_peptides'  : set(modified_peptides),
+            'unmodified_peptides': set(unmodified_peptides),
+        }
+        for name, masses in (groups or dict()).items():
+            assert name not in self.groups, f"group {name} is defined twice."
+            self.groups[name] = set(masses)
+
+        # ratios between group totals: normalizations by the internal standard, then ratios.
+        self.ratios = dict()
+        if self.internal_standard:
+            for name in (groups or dict()):
+                self.ratios[f"{name}/internal_standard"] = (name, 'internal_standard')
+        for name, (numerator, denominator) in (ratios or dict()).items():
+            assert numerator in self.groups and denominator in self.groups, \
+                f"ratio {name}: unknown group {numerator if numerator not in self.groups else denominator}."
+            self.ratios[name] = (numerator, denominator)
+
     def do_analysis(self):
+        """ Totals of every group and ratios between them, one row per sample, written
+            to the 'Raw data' sheet of self.output (see group_totals).
         """
-        Add description
-        """
+        import math
         import pandas as pd
         import os
         import openpyxl as xl
@@ -50,81 +82,108 @@ class DataAnalysis:
         df = pd.read_csv(csv_filename)
         self.debug and print(df.head())
 
-        # make a new column with empty values
-        df['internal_s_total'] = pd.to_numeric(0)
-        
-        # add all internal standard columns in one column
-        for i_standard in self.internal_standard:
-            self.debug and print(f"internal_standard={i_standard}")
-            header = f"{i_standard}-M/Z"
-            # error checking, just in case M/Z is not found in the 
-            # experimental data. 
-            if header in df.columns:
-                df['internal_s_total'] = df['internal_s_total'] + df[header]
-        
-        # make a new column with empty values
-        df['modified_peptides'] = pd.to_numeric(0)
-        
-        # add all modified peptide-columns in one column
-        for m in self.modified_peptides:
-            header = f"{m}-M/Z"
-            new_header = f"{header}-RATIO"
-            # error checking, just in case M/Z is not found 
-            # in the experimental data.
-            if header in df.columns:
-                df['modified_peptides'] = df['modified_peptides'] + df[header]
-        
-        # make a new column with empty values
-        df['unmodified_peptides'] = pd.to_numeric(0)
-        
-        # add all modified peptides columns in one column
-        for m in self.unmodified_peptides:
-            header = f"{m}-M/Z"
-            # error checking
-            if header in df.columns:
-                df['unmodified_peptides'] = df['unmodified_peptides'] + df[header]
-        
-        self.debug and print(df.head())
-    
+        totals, ratios = self.group_totals(df)
+        names = list(self.groups)
+        self.debug and print(pd.DataFrame(totals, columns=names).head())
+
+        # columns of the 'Raw data' sheet, in order: the three of the template, then
+        # the named groups and the ratios.
         sheet_name = 'Raw data'
-        column_number = 1
-        column_name = "SAMPLE"
-        
-        file_list = list()
-        for file in df['SAMPLE']:
-            self.debug and print(f"file={file} HERE")
-            
-            file_name = os.path.basename(file)
-            self.debug and print(f"file_name ={file_name}")
-            file_list.append(file_name)
-        
+        headers = ["Angiotensin", "Modified peptide", "Unmodified peptide"] + names[3:] + list(self.ratios)
+        table = np.concatenate([totals, ratios], axis=1)
+        columns = [("SAMPLE", [ os.path.basename(file) for file in df['SAMPLE'] ])]
+        # undefined values (missing intensities, division by 0) are written as empty cells.
+        columns += [ (header, [ v if math.isfinite(v) else None for v in table[:, i].tolist() ])
+            for i, header in enumerate(headers) ]
+
+        if self.template_file is None:
+            self.write_without_template(sheet_name, columns)
+            return
+
         # opening an excel template file
         wb = xl.load_workbook(self.template_file) 
         self.debug and print(f"opening = {self.template_file}")
         
-        self.update_excel_column_values(wb, sheet_name, column_number, column_name, df, file_list)   
+        for column_number, (column_name, values) in enumerate(columns, start=1):
+            self.update_excel_column_values(wb, sheet_name, column_number, column_name, df, values)   
         
-        sheet_name = 'Raw data'
-        column_number = 2
-        column_name = "Angiotensin"
-        self.update_excel_column_values(wb, sheet_name, column_number, column_name, df, df['internal_s_total'])   
-        
-        sheet_name = 'Raw data'
-        column_number = 3
-        column_name = "Modified peptide"
-        self.update_excel_column_values(wb, sheet_name, column_number, column_name, df, df['modified_peptides'])   
+        wb.save(self.output)
 
-        sheet_name = 'Raw data'
-        column_number = 4
-        column_name = "Unmodified peptide"
-        self.update_excel_column_values(wb, sheet_name, column_number, column_name, df, df['unmodified_peptides'])   
-        
+    def membership(self, columns):
+        """ Membership matrix of the groups: one row per mass column of the wide
+            table ("<mass>-M/Z" headers), one column per group, 1.0 where the mass
+            belongs to the group. Masses not found in the table are left out.
+
+            Return: list of the mass columns, membership matrix (numpy array).
+        """
+        mass_columns = [ c for c in columns if c.endswith('-M/Z') ]
+        # headers are matched by value, not by text.
+        position = { float(c[:-len('-M/Z')]): i for i, c in enumerate(mass_columns) }
+        matrix = np.zeros((len(mass_columns), len(self.groups)))
+        for g, masses in enumerate(self.groups.values()):
+            rows = [ position[m] for m in masses if m in position ]
+            matrix[rows, g] = 1.0
+        self.debug and print(f"{len(mass_columns)} mass columns, {len(self.groups)} groups")
+        return mass_columns, matrix
+
+    def group_totals(self, df):
+        """ Total of every group and every ratio, for all the samples at once.
+
+            The sample x mass intensities are multiplied once by the membership
+            matrix. A total with a missing intensity (NaN) is NaN, like a sum of
+            columns: the missing values of the mass columns having some are
+            multiplied by their rows of the membership matrix. Ratios divide two
+            columns of the totals.
+
+            Parameters:
+            ----------
+            df: wide table (pandas DataFrame) of highest_intensities_per_raw_wide.csv
+
+            Return
+            ------
+            totals (samples x groups) and ratios (samples x ratios), numpy arrays.
+        """
+        mass_columns, matrix = self.membership(df.columns)
+        intensities = df[mass_columns].to_numpy(dtype=np.float64)
+        missing = np.isnan(intensities)
+        totals = np.where(missing, 0.0, intensities) @ matrix
+        gaps = missing.any(axis=0)
+        if gaps.any():
+            # counts of missing values: exact in float32, twice as fast as float64.
+            counts = missing[:, gaps].astype(np.float32) @ matrix[gaps].astype(np.float32)
+            totals[counts > 0] = np.nan
+
+        index = { name: g for g, name in enumerate(self.groups) }
+        numerators = [ index[n] for n, _ in self.ratios.values() ]
+        denominators = [ index[d] for _, d in self.ratios.values() ]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = totals[:, numerators] / totals[:, denominators]
+        return totals, ratios
+
+    def write_without_template(self, sheet_name, columns):
+        """ Write columns (list of (name, values)) to a new workbook, one row at a
+            time (openpyxl write-only mode): rows are streamed to self.output and
+            never held as cells.
+        """
+        import openpyxl as xl
+
+        wb = xl.Workbook(write_only=True)
+        sheet = wb.create_sheet(sheet_name)
+        sheet.append([ name for name, _ in columns ])
+        for row in zip(*[ values for _, values in columns ]):
+            sheet.append(row)
         wb.save(self.output)
+        self.debug and print(f"{self.output} written without template")
 
     @classmethod
     def update_excel_column_values(cls, wb, sheet_name, column_number, column_name, df, new_values):   
-        import openpyxl as xl
-        import itertools 
+        """ Replace column column_number of sheet_name by column_name (row 1) and
+            new_values, one per row of df (rows 2 to len(df) + 1).
+
+            The column is overwritten in place: no cell of the other columns is
+            moved (delete_cols + insert_cols moved every cell of the sheet twice
+            for the same result).
+        """
         debug = False
 
         #wb = xl.Workbook(path) 
@@ -134,40 +193,20 @@ class DataAnalysis:
         debug and print(f"sheet_name={sheet_name}")
         sheet = wb[sheet_name]
 
-        # count the number of rows and columns in sheet_name        
-        row    = sheet.max_row
-        column = sheet.max_column
-        
-        # count number of rows in the dataframe
-        df_number_of_rows = len(df)
-        debug and print(f'number of row={row}')
-        debug and print(f'number of row={df_number_of_rows}')
-
-        # delete column B
-        sheet.delete_cols(column_number)
-        # insert column B
-        sheet.insert_cols(column_number)
-        # and add column name
-        sheet.cell(row=1, column=column_number).value=column_name
-        
-        # load the dataframe' data into a Python list
-        data = []
-        #for v in df['internal_s_total']:
-        for v in new_values:
-            data.append(v)
-            debug and print(f"dataframe values {v}") 
-        #debug and print(f"dimension = {len(data)}")
-        
-        # loop will print all values of column_number   
-        #for i, v in zip( range(column_number, row + 1), df['internal_s_total'] ) :
-        counter = 0
-        start = 2
-        stop = df_number_of_rows + 1
-        for i in range(start, stop):
-            cell_obj = sheet.cell(row = i, column = column_number)
-            debug and print(f"column={column_number},row={i}, value={cell_obj.value} c={counter}")
-            cell_obj.value = data[counter]
-            counter += 1
+        new_values = list(new_values)
+        assert len(new_values) == len(df), \
+            f"update_excel_column_values. {len(new_values)} values for {len(df)} rows."
+        debug and print(f'number of row={sheet.max_row}')
+        debug and print(f'number of row={len(df)}')
+
+        # column name, then one value per row of the dataframe.
+        values = [column_name] + new_values
+        for row, value in enumerate(values, start=1):
+            sheet.cell(row=row, column=column_number).value = value
+
+        # clear the rest of the column (template rows beyond the samples).
+        for row in range(len(values) + 1, sheet.max_row + 1):
+            sheet.cell(row=row, column=column_number).value = None
 
 if __name__ == '__main__':
     import os
@@ -200,6 +239,8 @@ if __name__ == '__main__':
     i_standard = values['internal_standard']
     m_peptides = values['modified_peptides']
     u_peptides = values['unmodified_peptides']
+    groups = values['groups']
+    ratios = values['ratios']
 
     csv_filename='highest_intensities_per_raw_wide.csv'
     template_file = 'template.xlsx'
@@ -213,7 +254,9 @@ if __name__ == '__main__':
             internal_standard  = i_standard,
             debug = debug,
             template_file = template_file,
-            output = output_plot_file
+            output = output_plot_file,
+            groups = groups,
+            ratios = ratios
         )
         d.do_analysis()
     except AssertionError as error:
@@ -0,0 +1,160 @@
+import os
+import json
+import numpy as np
+
+class Manifest:
+    # directory, inside the output directory, holding the manifest and the
+    # matched peaks of every processed mzXML file.
+    dirname = '_manifest'
+    filename = 'manifest.json'
+
+    def __init__(self, output_dir, parameters, debug=False) -> None:
+        """ Object initialization.
+            Record of the mzXML files already processed, so a rerun only processes
+            new or changed files (--incremental):
+
+                {
+                    "parameters": {masses, ppm, ms_level, ...},
+                    "files": {
+                        "<file name>": {"path", "size", "mtime_ns", "sha1", "raw_name", "result"}
+                    }
+                }
+
+            A file is recorded once it is completely processed; a file interrupted
+            by a crash is not in the manifest and it is processed again.
+            The matched peaks of every file (filter_file output) are saved in
+            <output_dir>/_manifest/<raw_name>.peaks.npz, so reports can be rebuilt
+            without reading the mzXML files again.
+
+            Parameters:
+            ----------
+            output_dir: output directory ([output] in peak.ini)
+            parameters: extraction parameters (JSON serializable dictionary). Results
+                    recorded with other parameters are stale.
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a Manifest object.
+        """
+        self.output_dir = output_dir
+        self.location = os.path.join(output_dir, self.dirname)
+        self.parameters = json.loads(json.dumps(parameters))
+        self.debug = debug
+        self.files = dict()
+        self.stale = False
+
+        manifest_file = os.path.join(self.location, self.filename)
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as fh:
+                content = json.load(fh)
+            if content.get('parameters') == self.parameters:
+                self.files = content.get('files', {})
+            else:
+                # same output directory, different extraction: nothing can be reused.
+                self.stale = True
+                self.debug and print(f"{manifest_file} was written with other parameters")
+
+    def __len__(self):
+        return len(self.files)
+
+    def __str__(self):
+        """ string representation of the Manifest object.
+        """
+        return f"location={self.location}, files={len(self.files)}, stale={self.stale}, debug={self.debug}"
+
+    @staticmethod
+    def sha1(file_xml, block_size=1 << 20):
+        """ SHA-1 of the content of file_xml (hex string).
+        """
+        import hashlib
+
+        digest = hashlib.sha1()
+        with open(file_xml, 'rb') as fh:
+            for block in iter(lambda: fh.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def is_current(self, file_xml):
+        """ True if file_xml was processed with the current parameters and has not
+            changed since. Size and mtime are checked first; when only the mtime
+            differs (e.g. the file was copied again) the content hash decides.
+        """
+        entry = self.files.get(os.path.basename(file_xml))
+        if entry is None or not os.path.exists(os.path.join(self.location, entry['result'])):
+            return False
+
+        stat = os.stat(file_xml)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        if self.sha1(file_xml) != entry['sha1']:
+            return False
+        entry['mtime_ns'] = stat.st_mtime_ns
+        self.save()
+        return True
+
+    def record(self, file_xml, result):
+        """ Save the matched peaks of file_xml (filter_file output) and record the
+            file as processed. The manifest is saved right away.
+        """
+        os.makedirs(self.location, exist_ok=True)
+
+        raw_name = result['raw_name']
+        result_file = f"{raw_name}.peaks.npz"
+        tmp_location = os.path.join(self.location, f"{result_file}.tmp")
+        with open(tmp_location, 'wb') as fh:
+            np.savez(fh, scan=result['scan'], targets=result['targets'],
+                mzs=result['mzs'], intensities=result['intensities'])
+        os.replace(tmp_location, os.path.join(self.location, result_file))
+
+        stat = os.stat(file_xml)
+        self.files[os.path.basename(file_xml)] = {
+            'path': os.path.abspath(file_xml),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha1': self.sha1(file_xml),
+            'raw_name': raw_name,
+            'result': result_file,
+        }
+        self.save()
+
+    def forget(self, name):
+        """ Drop file name (basename of the mzXML file) and its matched peaks.
+
+            Return: raw_name of the file, None if it was not recorded.
+        """
+        entry = self.files.pop(name, None)
+        if entry is None:
+            return None
+        result_file = os.path.join(self.location, entry['result'])
+        if os.path.exists(result_file):
+            os.remove(result_file)
+        self.save()
+        return entry['raw_name']
+
+    def load(self, file_xml):
+        """ Matched peaks of file_xml, as saved by record.
+
+            Return: dictionary with the arguments of PeakTable.append.
+        """
+        entry = self.files[os.path.basename(file_xml)]
+        with np.load(os.path.join(self.location, entry['result'])) as npz:
+            return {
+                'raw_name'   : entry['raw_name'],
+                'scan'       : npz['scan'],
+                'targets'    : npz['targets'],
+                'mzs'        : npz['mzs'],
+                'intensities': npz['intensities'],
+            }
+
+    def save(self):
+        """ Write the manifest. It is written under a temporary name and renamed,
+            so a crash never leaves a partially written manifest.
+        """
+        os.makedirs(self.location, exist_ok=True)
+        manifest_file = os.path.join(self.location, self.filename)
+        with open(f"{manifest_file}.tmp", 'w') as fh:
+            json.dump({'parameters': self.parameters, 'files': self.files}, fh, indent=2)
+        os.replace(f"{manifest_file}.tmp", manifest_file)
+        self.stale = False
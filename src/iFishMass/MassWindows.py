@@ -0,0 +1,218 @@
+import numpy as np
+from iFishMass import kernels
+
+class MassWindows:
+    def __init__(self, list_of_masses, ppm_tolerance, debug=False) -> None:
+        """ Object initialization.
+            Turn a list of target masses into ppm windows, once.
+            A peak matches a target mass when
+
+                abs(mz - mass) / mass * 1_000_000 <= ppm_tolerance
+
+            Parameters:
+            ----------
+            list_of_masses: target masses (iterable of floats). Order is preserved.
+            ppm_tolerance : tolerance of mz values (in ppm)
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a MassWindows object.
+        """
+        assert ppm_tolerance >= 0, "mz_tolerance must be a positive scalar."
+
+        self.masses = np.array(list(list_of_masses), dtype=np.float64)
+        self.ppm_tolerance = ppm_tolerance
+        self.debug = debug
+
+        assert np.all(self.masses > 0), "list_of_masses must contain positive scalars."
+
+        delta = self.masses * ppm_tolerance / 1_000_000
+        self.lower = self.masses - delta
+        self.upper = self.masses + delta
+
+        # windows used for the binary search are slightly wider than the ppm
+        # windows, the exact ppm test is done on the candidates afterwards.
+        # This way rounding errors never drop a peak sitting on the window edge.
+        self._search_lower = self.lower - np.abs(self.lower) * 1e-9
+        self._search_upper = self.upper + np.abs(self.upper) * 1e-9
+
+        # overlapping windows merged into sorted, disjoint intervals. Every
+        # interval covers a contiguous range of the targets sorted by mass, so a
+        # peak is mapped back to all its targets with one binary search.
+        self._order = np.argsort(self.masses, kind='stable')
+        lower, upper = self._search_lower[self._order], np.maximum.accumulate(self._search_upper[self._order])
+        starts = np.flatnonzero(np.r_[True, lower[1:] > upper[:-1]]) if len(self.masses) else np.empty(0, dtype=np.int64)
+        ends = np.r_[starts[1:], len(self.masses)].astype(np.int64)
+        self._merged_lower = lower[starts]
+        self._merged_upper = upper[ends - 1] if len(ends) else np.empty(0)
+        self._merged_start = starts
+        self._merged_end = ends
+
+    def __len__(self):
+        return len(self.masses)
+
+    def __str__(self):
+        """ string representation of the MassWindows object.
+        """
+        return f"masses={self.masses}, ppm_tolerance={self.ppm_tolerance}, debug={self.debug}"
+
+    def merged(self):
+        """ Number of merged (disjoint) windows.
+        """
+        return len(self._merged_lower)
+
+    def match(self, mzs, is_sorted=None):
+        """ Find the peaks within the ppm window of every target mass.
+
+            The cheapest search is used: a binary search of every window edge in
+            the peaks (sorted peaks, few targets), or of every peak in the merged
+            windows (many targets, or unsorted peaks). Cost grows with
+            log(peaks) or log(targets) respectively; matches are the same.
+
+            Parameters:
+            ----------
+            mzs: m/z array (numpy array)
+            is_sorted: True if mzs is sorted in ascending order. Checked when None.
+
+            Return
+            ------
+            peak_idx, target_idx (numpy arrays). One element per (peak, target) match;
+            mzs[peak_idx[i]] matched self.masses[target_idx[i]].
+            Matches are ordered by target (list_of_masses order) and then by peak.
+        """
+        mzs = np.asarray(mzs)
+        empty = np.empty(0, dtype=np.int64)
+        if len(mzs) == 0 or len(self.masses) == 0:
+            return empty, empty
+
+        if is_sorted is None:
+            is_sorted = bool(np.all(mzs[:-1] <= mzs[1:]))
+        if not is_sorted or 2 * len(self.masses) > len(mzs):
+            return self.match_by_peak(mzs)
+
+        # merge of the peaks and the windows (see kernels.match_sorted).
+        peak_idx, target_idx = kernels.match_sorted(mzs, self.masses, self._order,
+            self._search_lower, self._search_upper, self.ppm_tolerance)
+
+        self.debug and print(f"matches={len(peak_idx)} out of {len(mzs)} peaks")
+        return peak_idx, target_idx
+
+    def match_by_peak(self, mzs):
+        """ match(), searching every peak in the merged windows. mzs need not be sorted.
+
+            Return: peak_idx, target_idx (numpy arrays), see match.
+        """
+        mzs = np.asarray(mzs)
+        empty = np.empty(0, dtype=np.int64)
+        if len(mzs) == 0 or len(self.masses) == 0:
+            return empty, empty
+
+        # merged window holding every peak, if any.
+        window = np.searchsorted(self._merged_lower, mzs, side='right') - 1
+        inside = window >= 0
+        inside[inside] = mzs[inside] <= self._merged_upper[window[inside]]
+        peaks, window = np.flatnonzero(inside), window[inside]
+
+        # every peak against every target of its merged window.
+        counts = self._merged_end[window] - self._merged_start[window]
+        total = int(counts.sum())
+        if total == 0:
+            return empty, empty
+        peak_idx = np.repeat(peaks, counts)
+        first = np.repeat(self._merged_start[window] - (np.cumsum(counts) - counts), counts)
+        target_idx = self._order[np.arange(total) + first]
+
+        # exact ppm test on the candidates.
+        keep = self.within(mzs[peak_idx], target_idx)
+        peak_idx, target_idx = peak_idx[keep], target_idx[keep]
+        order = np.lexsort((peak_idx, target_idx))
+        self.debug and print(f"matches={len(order)} out of {len(mzs)} peaks")
+        return peak_idx[order], target_idx[order]
+
+    def within(self, mzs, target_idx):
+        """ Exact ppm test: True for every mzs[i] within the ppm window of
+            self.masses[target_idx[i]] (numpy array of booleans).
+        """
+        return kernels.ppm_mask(mzs, self.masses[target_idx], self.ppm_tolerance)
+
+    def keep(self, mzs, is_sorted=None):
+        """ Indices (ascending) of the peaks within the ppm window of any target mass.
+        """
+        peak_idx, _ = self.match(mzs, is_sorted=is_sorted)
+        return np.unique(peak_idx)
+
+    def select(self, spectrum_in):
+        """ Keep the peaks of spectrum_in within the ppm window of any target mass.
+            The spectrum is not copied: only the kept peaks and the header
+            fields 'num' and 'msLevel' are stored in the result.
+
+            Parameters:
+            ----------
+            spectrum_in: spectrum (dictionary with 'm/z array' and 'intensity array')
+
+            Return
+            ------
+            a FilteredScan object.
+        """
+        mzs, intensities = spectrum_in['m/z array'], spectrum_in['intensity array']
+        peak_idx, target_idx = self.match(mzs)
+
+        # kept peaks in m/z order; every match points to one of them.
+        kept, match_peak = np.unique(peak_idx, return_inverse=True)
+        return FilteredScan(
+            num=spectrum_in.get('num'),
+            msLevel=spectrum_in.get('msLevel'),
+            mzs=mzs[kept],
+            intensities=intensities[kept],
+            match_peak=match_peak.reshape(-1),
+            match_target=target_idx,
+            masses=self.masses,
+        )
+
+class FilteredScan:
+    __slots__ = ('num', 'msLevel', 'mzs', 'intensities', 'match_peak', 'match_target', 'masses')
+
+    def __init__(self, num, msLevel, mzs, intensities, match_peak, match_target, masses) -> None:
+        """ Object initialization.
+            Peaks of a scan kept by MassWindows.select. Memory is proportional
+            to the number of kept peaks, not to the number of peaks read.
+
+            Parameters:
+            ----------
+            num, msLevel: scan header fields
+            mzs, intensities: kept peaks (numpy arrays, m/z order)
+            match_peak, match_target: one element per (peak, target) match;
+                    mzs[match_peak[i]] matched masses[match_target[i]].
+            masses: target masses of the MassWindows object.
+
+            Return: a FilteredScan object.
+        """
+        self.num = num
+        self.msLevel = msLevel
+        self.mzs = mzs
+        self.intensities = intensities
+        self.match_peak = match_peak
+        self.match_target = match_target
+        self.masses = masses
+
+    def __len__(self):
+        return len(self.mzs)
+
+    def __str__(self):
+        """ string representation of the FilteredScan object.
+        """
+        return f"num={self.num}, msLevel={self.msLevel}, peaks={len(self.mzs)}, matches={len(self.match_peak)}"
+
+    def __getitem__(self, key):
+        """ Spectrum-like access, so a FilteredScan can be used where a
+            filtered spectrum (dictionary) is expected. e.g. save_as_csv
+        """
+        fields = {'num': 'num', 'msLevel': 'msLevel', 'm/z array': 'mzs', 'intensity array': 'intensities'}
+        if key not in fields:
+            raise KeyError(key)
+        return getattr(self, fields[key])
+
+    def matches(self):
+        """ Return targets, mzs, intensities (numpy arrays). One element per match.
+        """
+        return self.masses[self.match_target], self.mzs[self.match_peak], self.intensities[self.match_peak]
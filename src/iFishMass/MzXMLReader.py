@@ -0,0 +1,190 @@
+import base64
+import re
+import zlib
+import numpy as np
+
+class MzXMLReader:
+    def __init__(self, location, debug=False) -> None:
+        """ Object initialization.
+            Streaming mzXML reader. Scans are parsed with lxml iterparse, and every
+            parsed element is cleared, so memory does not grow with the file.
+            Only the scan attributes and the raw peaks payload are kept; the peaks
+            are decoded (base64, zlib, np.frombuffer) the first time 'm/z array' or
+            'intensity array' is read. Scans skipped by msLevel are never decoded.
+
+                with MzXMLReader(file_xml) as reader:
+                    for scan in reader:
+                        scan['msLevel'], scan['num'], scan['m/z array'] ...
+
+            Arrays are the same pyteomics returns (dtype and values), see
+            tests/test_mzxml_reader.py.
+
+            Parameters:
+            ----------
+            location: path to the mzXML file
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a MzXMLReader object (context manager and iterator over ScanRecord objects).
+        """
+        self.location = location
+        self.debug = debug
+
+    def __str__(self):
+        """ string representation of the MzXMLReader object.
+        """
+        return f"location={self.location}, debug={self.debug}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __iter__(self):
+        """ Yield a ScanRecord per scan, in document order.
+            Nested scans (MS2 inside MS1) are yielded after their parent.
+        """
+        from lxml import etree
+
+        stack, pending = [], []
+        for event, elem in etree.iterparse(self.location, events=('start', 'end'), huge_tree=True):
+            tag = elem.tag.rpartition('}')[2]
+            if tag == 'scan':
+                if event == 'start':
+                    record = ScanRecord(dict(elem.attrib))
+                    stack.append(record)
+                    pending.append(record)
+                    continue
+                stack.pop()
+                # outermost scan done: free it, with everything parsed before it.
+                if len(stack) == 0:
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+                    yield from pending
+                    pending = []
+            elif tag == 'peaks' and event == 'end' and len(stack) > 0:
+                stack[-1].set_peaks(dict(elem.attrib), elem.text)
+                self.debug and print(f"scan {stack[-1].num}: peaks read")
+
+class ScanRecord:
+    __slots__ = ('attrib', 'num', 'msLevel', '_peaks_attrib', '_payload', '_arrays')
+
+    def __init__(self, attrib) -> None:
+        """ Object initialization.
+            A scan read by MzXMLReader. It supports the dictionary access filter_file,
+            select_peaks and save_as_csv use on pyteomics spectra:
+            scan['num'] (string), scan['msLevel'] (integer), scan['m/z array'],
+            scan['intensity array'] and the other scan attributes.
+
+            Parameters:
+            ----------
+            attrib: attributes of the scan element (dictionary)
+
+            Return: a ScanRecord object.
+        """
+        self.attrib = attrib
+        self.num = attrib.get('num')
+        self.msLevel = int(attrib['msLevel']) if 'msLevel' in attrib else None
+        self._peaks_attrib = None
+        self._payload = None
+        self._arrays = None
+
+    def __str__(self):
+        """ string representation of the ScanRecord object.
+        """
+        return f"num={self.num}, msLevel={self.msLevel}, peaksCount={self.attrib.get('peaksCount')}"
+
+    def set_peaks(self, attrib, text):
+        """ Keep the peaks element (attributes and base64 text) for decoding on demand.
+        """
+        self._peaks_attrib = attrib
+        self._payload = text
+        self._arrays = None
+
+    def peaks(self):
+        """ Decode the peaks payload, once.
+
+            Return: m/z array, intensity array (numpy arrays, declared precision and byte order)
+        """
+        if self._arrays is None:
+            self._arrays = decode_peaks_payload(self._peaks_attrib or {}, self._payload)
+        return self._arrays
+
+    def keys(self):
+        return ['num', 'msLevel', 'id'] + [ k for k in self.attrib if k not in ('num', 'msLevel') ] \
+            + ['m/z array', 'intensity array']
+
+    def __getitem__(self, key):
+        if key == 'num' or key == 'id':
+            return self.num
+        if key == 'msLevel':
+            return self.msLevel
+        if key == 'm/z array':
+            return self.peaks()[0]
+        if key == 'intensity array':
+            return self.peaks()[1]
+        if key == 'retentionTime' and key in self.attrib:
+            return duration_to_minutes(self.attrib[key])
+        if key == 'peaksCount' and key in self.attrib:
+            return int(self.attrib[key])
+        return self.attrib[key]
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+def decode_peaks_payload(attrib, text):
+    """ Decode the base64 payload of a mzXML peaks element.
+
+        Parameters:
+        ----------
+        attrib: attributes of the peaks element (precision, byteOrder,
+                compressionType, contentType or pairOrder)
+        text  : base64 payload (string or None)
+
+        Return: m/z array, intensity array (numpy arrays).
+                Empty float arrays are returned for scans without peaks.
+    """
+    precision = int(attrib.get('precision', 32))
+    if precision not in (32, 64):
+        raise ValueError(f"unsupported peaks precision {precision}")
+    order = '<' if attrib.get('byteOrder', 'network') == 'little' else '>'
+    dtype = np.dtype(f"{order}f{precision // 8}")
+
+    content = attrib.get('contentType', attrib.get('pairOrder', 'm/z-int'))
+    if content != 'm/z-int':
+        raise ValueError(f"unsupported peaks contentType {content}. Use the pyteomics reader.")
+
+    if not text or not text.strip():
+        return np.empty(0, dtype=dtype), np.empty(0, dtype=dtype)
+
+    data = base64.b64decode(text)
+    compression = attrib.get('compressionType', 'none')
+    if compression == 'zlib':
+        data = zlib.decompress(data)
+    elif compression != 'none':
+        raise ValueError(f"unsupported peaks compressionType {compression}. Use the pyteomics reader.")
+
+    # m/z and intensity are interleaved: one (m/z, intensity) pair per peak.
+    pairs = np.frombuffer(data, dtype=dtype).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+_duration = re.compile(r'^-?P(?:(\d+(?:\.\d*)?)D)?(?:T(?:(\d+(?:\.\d*)?)H)?(?:(\d+(?:\.\d*)?)M)?(?:(\d+(?:\.\d*)?)S)?)?$')
+
+def duration_to_minutes(text):
+    """ Convert a xs:duration (e.g. PT12.5S) to minutes, like pyteomics does.
+        The text is returned unchanged if it is not a duration.
+    """
+    match = _duration.match(text.strip())
+    if match is None:
+        return text
+    days, hours, minutes, seconds = (float(g) if g else 0.0 for g in match.groups())
+    value = days * 1440 + hours * 60 + minutes + seconds / 60
+    return -value if text.strip().startswith('-') else value
@@ -0,0 +1,212 @@
+import os
+import json
+import numpy as np
+
+class PeakIndex:
+    # metadata file: RAW names, source files, ms_level and number of peaks.
+    meta_file = 'index.json'
+    # column -> dtype. Every column is a .npy file, read memory-mapped.
+    columns = {'mz': np.float64, 'intensity': np.float64, 'scan': np.int64, 'raw': np.int32}
+
+    def __init__(self, location, debug=False) -> None:
+        """ Object initialization.
+            On-disk index of all the peaks of a set of mzXML files (one ms_level),
+            sorted by m/z:
+
+                mz.npy       : m/z of every peak (float64, ascending)
+                intensity.npy: intensity (float64)
+                scan.npy     : scan number (int64)
+                raw.npy      : RAW id (int32), position in index.json 'raw_names'
+
+            Columns are memory-mapped, so any list of masses and ppm tolerance is
+            answered by binary search without loading the index, or reading the
+            mzXML files again.
+
+            Parameters:
+            ----------
+            location: index directory
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a PeakIndex object.
+        """
+        self.location = location
+        self.debug = debug
+        self.meta = None
+        self.data = None
+
+    def __len__(self):
+        return 0 if self.meta is None else self.meta['peaks']
+
+    def __str__(self):
+        """ string representation of the PeakIndex object.
+        """
+        return f"location={self.location}, peaks={len(self)}, debug={self.debug}"
+
+    def exists(self):
+        """ True if the index has been built in self.location.
+        """
+        return os.path.isfile(os.path.join(self.location, self.meta_file))
+
+    def build(self, raw_files, ms_level, sources=(), bucket_peaks=20_000_000):
+        """ Build the index from the peaks of every RAW file.
+
+            Every RAW file is sorted by m/z and saved on its own first. They are
+            then merged by m/z range (bucket_peaks peaks at a time), so memory use
+            does not depend on the size of the index.
+
+            Parameters:
+            ----------
+            raw_files: iterable of (raw_name, scans, mzs, intensities), one per RAW
+                    file; scans holds the scan number of every peak.
+            ms_level: ms_level (string) of the indexed scans.
+            sources: mzXML files indexed (list of paths), recorded in index.json.
+            bucket_peaks: maximum number of peaks sorted at once while merging.
+
+            Return: number of peaks in the index.
+        """
+        import shutil
+        from numpy.lib.format import open_memmap
+        from iFishMass.PeakTable import as_float64
+
+        assert bucket_peaks >= 1, "bucket_peaks must be a positive integer."
+
+        os.makedirs(self.location, exist_ok=True)
+        tmp_dir = os.path.join(self.location, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # 1. every RAW file sorted by m/z.
+        raw_names, parts = [], []
+        for raw_name, scans, mzs, intensities in raw_files:
+            raw_id = len(raw_names)
+            raw_names.append(raw_name)
+            mzs = as_float64(mzs)
+            order = np.argsort(mzs, kind='stable')
+            paths = { c: os.path.join(tmp_dir, f"{raw_id}.{c}.npy") for c in ('mz', 'intensity', 'scan') }
+            np.save(paths['mz'], mzs[order])
+            np.save(paths['intensity'], as_float64(intensities)[order])
+            np.save(paths['scan'], np.asarray(scans, dtype=np.int64)[order])
+            parts.append((raw_id, len(mzs), paths))
+            self.debug and print(f"{raw_name}: {len(mzs)} peaks")
+
+        # 2. merge by m/z range. Bucket boundaries are quantiles of a sample of every part.
+        total = sum(n for _, n, _ in parts)
+        buckets = max(1, -(-total // bucket_peaks))
+        boundaries = np.empty(0)
+        if buckets > 1:
+            sample = np.concatenate([ np.load(p['mz'], mmap_mode='r')[::max(1, n // 10_000)] for _, n, p in parts if n > 0 ])
+            boundaries = np.quantile(sample, np.linspace(0, 1, buckets + 1)[1:-1])
+        edges = np.concatenate(([-np.inf], boundaries, [np.inf]))
+
+        out = { c: open_memmap(os.path.join(self.location, f"{c}.npy"), mode='w+', dtype=d, shape=(total,))
+            for c, d in self.columns.items() }
+        part_mzs = [ np.load(p['mz'], mmap_mode='r') for _, _, p in parts ]
+        offset = 0
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            pieces = { c: [] for c in self.columns }
+            for (raw_id, _, paths), mz in zip(parts, part_mzs):
+                a, b = np.searchsorted(mz, lo, side='left'), np.searchsorted(mz, hi, side='left')
+                if a == b:
+                    continue
+                pieces['mz'].append(np.asarray(mz[a:b]))
+                pieces['intensity'].append(np.load(paths['intensity'], mmap_mode='r')[a:b])
+                pieces['scan'].append(np.load(paths['scan'], mmap_mode='r')[a:b])
+                pieces['raw'].append(np.full(b - a, raw_id, dtype=np.int32))
+            if len(pieces['mz']) == 0:
+                continue
+            # stable: equal m/z values stay in RAW file order.
+            order = np.argsort(np.concatenate(pieces['mz']), kind='stable')
+            n = len(order)
+            for c in self.columns:
+                out[c][offset:offset + n] = np.concatenate(pieces[c])[order]
+            offset += n
+        for c in self.columns:
+            out[c].flush()
+        del out, part_mzs
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        # index.json is written last: an interrupted build is not an index.
+        self.meta = {
+            'ms_level': str(ms_level),
+            'peaks': int(total),
+            'raw_names': raw_names,
+            'sources': [ {'path': os.path.abspath(f), 'size': os.path.getsize(f),
+                'mtime_ns': os.stat(f).st_mtime_ns} for f in sources ],
+        }
+        with open(os.path.join(self.location, self.meta_file), 'w') as fh:
+            json.dump(self.meta, fh, indent=2)
+        self.data = None
+        return total
+
+    def open(self, mmap=True):
+        """ Memory-map the index columns. Nothing is read until it is used.
+            With mmap=False the columns are loaded in memory instead.
+        """
+        assert self.exists(), f"{self.location} is not a peak index. Build it first."
+        with open(os.path.join(self.location, self.meta_file)) as fh:
+            self.meta = json.load(fh)
+        mmap_mode = 'r' if mmap else None
+        self.data = { c: np.load(os.path.join(self.location, f"{c}.npy"), mmap_mode=mmap_mode) for c in self.columns }
+        return self
+
+    def is_stale(self, files):
+        """ True if the mzXML files differ (added, removed or modified) from the indexed ones.
+        """
+        if self.meta is None:
+            self.open()
+        indexed = { s['path']: (s['size'], s['mtime_ns']) for s in self.meta['sources'] }
+        current = { os.path.abspath(f): (os.path.getsize(f), os.stat(f).st_mtime_ns) for f in files }
+        return indexed != current
+
+    def match(self, list_of_masses, ppm_tolerance):
+        """ Peaks within ppm_tolerance of every mass of list_of_masses.
+
+            Parameters:
+            ----------
+            list_of_masses: list of masses, or a MassWindows object
+            ppm_tolerance : tolerance of mz values (in ppm)
+
+            Return
+            ------
+            dictionary of numpy arrays, one element per (peak, target) match:
+            raw (RAW id), scan, target, mz, intensity.
+            Matches are ordered by RAW id, target, scan and m/z.
+        """
+        from iFishMass.MassWindows import MassWindows
+
+        if self.data is None:
+            self.open()
+
+        windows = list_of_masses
+        if not isinstance(windows, MassWindows):
+            windows = MassWindows(list_of_masses, ppm_tolerance, debug=self.debug)
+
+        # binary search on the memory-mapped m/z column; only the matches are read.
+        peak_idx, target_idx = windows.match(self.data['mz'], is_sorted=True)
+        raw = np.asarray(self.data['raw'][peak_idx])
+        scan = np.asarray(self.data['scan'][peak_idx])
+        order = np.lexsort((peak_idx, scan, target_idx, raw))
+        peak_idx = peak_idx[order]
+        return {
+            'raw'      : raw[order],
+            'scan'     : scan[order],
+            'target'   : windows.masses[target_idx[order]],
+            'mz'       : np.asarray(self.data['mz'][peak_idx]),
+            'intensity': np.asarray(self.data['intensity'][peak_idx]),
+        }
+
+    def fill(self, peak_table, list_of_masses, ppm_tolerance):
+        """ Append the matches of list_of_masses to peak_table (PeakTable), the
+            same matches filter_files would have appended.
+
+            Return: peak_table
+        """
+        matches = self.match(list_of_masses, ppm_tolerance)
+        raws = matches['raw']
+        # one append per RAW file, in RAW id order.
+        starts = np.flatnonzero(np.r_[True, raws[1:] != raws[:-1]]) if len(raws) else []
+        ends = list(starts[1:]) + [len(raws)]
+        for a, b in zip(starts, ends):
+            peak_table.append(self.meta['raw_names'][raws[a]], matches['scan'][a:b],
+                matches['target'][a:b], matches['mz'][a:b], matches['intensity'][a:b])
+        return peak_table
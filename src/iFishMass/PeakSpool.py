@@ -0,0 +1,292 @@
+import os
+import numpy as np
+from iFishMass.MassWindows import MassWindows
+from iFishMass.PeakTable import as_float64, group_argmax
+
+class PeakSpool:
+    # columns of a run: target (position in list_of_masses), RAW code, scan,
+    # sequence number (append order) and the peak itself.
+    columns = {'mass': np.int32, 'raw': np.int32, 'scan': np.int64, 'seq': np.int64,
+        'mz': np.float64, 'intensity': np.float64}
+    # bytes per row, all columns.
+    row_bytes = sum(np.dtype(d).itemsize for d in columns.values())
+
+    def __init__(self, list_of_masses, ppm_tolerance, max_memory, directory=None, debug=False) -> None:
+        """ Object initialization.
+            Bounded-memory store of the peaks matched during the extraction. It
+            takes the same appends as PeakTable, but never holds more than
+            max_memory bytes of peaks:
+
+                - appended peaks are buffered until half of max_memory is used.
+                  The buffer is then sorted in report order (target, RAW file,
+                  append order) and spilled to a run of .npy files on disk.
+                - the highest intensity of every (target, RAW file) pair is kept
+                  for every run. These partial maxima are small, and merged at
+                  the end (see maxima).
+                - reports read the runs back with a k-way merge, a block of every
+                  run at a time, within the other half of max_memory (see merge).
+
+            Data that fits in max_memory is never written to disk.
+
+            Parameters:
+            ----------
+            list_of_masses: target masses (list). Peaks are appended with these targets.
+            ppm_tolerance: tolerance of mz values (in ppm). Appended peaks outside the
+                    ppm window of their target are dropped, like the reports of
+                    PeakTable drop them (see Raw.filter_by_mz_in_memory).
+            max_memory: memory budget in bytes (integer).
+            directory: where the runs are spilled. A temporary directory by default.
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a PeakSpool object (context manager removing the spilled runs).
+        """
+        assert max_memory >= 1024 * 1024, "max_memory must be at least 1 MB."
+        assert len(set(list_of_masses)) == len(list_of_masses), \
+            "list_of_masses holds the same mass twice. Remove duplicated masses to use a memory budget."
+
+        self.list_of_masses = list(list_of_masses)
+        self.windows = MassWindows(self.list_of_masses, ppm_tolerance, debug=debug)
+        self.max_memory = max_memory
+        self.directory = directory
+        self.debug = debug
+        self.raw_names = []
+        self._raw_codes = dict()
+        masses = np.asarray(self.list_of_masses, dtype=np.float64)
+        self._mass_order = np.argsort(masses, kind='stable')
+        self._sorted_masses = masses[self._mass_order]
+        self._buffer = []
+        self._buffered = 0
+        self._rows = 0
+        self._seq = 0
+        self._runs = []
+        self._maxima = []
+        self._memory_run = None
+        self._tmp_dir = None
+
+    def __len__(self):
+        return self._rows
+
+    def __str__(self):
+        """ string representation of the PeakSpool object.
+        """
+        return f"raw_names={len(self.raw_names)}, rows={len(self)}, runs={len(self._runs)}, " \
+            f"max_memory={self.max_memory}, debug={self.debug}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def raw_code(self, raw_name):
+        """ Return the integer code of raw_name. New names are added to self.raw_names.
+        """
+        code = self._raw_codes.get(raw_name)
+        if code is None:
+            code = len(self.raw_names)
+            self._raw_codes[raw_name] = code
+            self.raw_names.append(raw_name)
+        return code
+
+    def mass_codes(self, targets):
+        """ Position in list_of_masses of every target (numpy array).
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        idx = np.minimum(np.searchsorted(self._sorted_masses, targets), len(self._sorted_masses) - 1)
+        assert np.all(self._sorted_masses[idx] == targets), "append. targets must be masses of list_of_masses."
+        return self._mass_order[idx].astype(np.int32)
+
+    def append(self, raw_name, scan, targets, mzs, intensities):
+        """ Append the matches found in a scan, or in all scans, of a RAW file.
+            Same arguments as PeakTable.append.
+        """
+        assert len(targets) == len(mzs) == len(intensities), \
+            "append. targets, mzs and intensities must have the same length."
+        if len(mzs) == 0:
+            return
+
+        n = len(mzs)
+        code = self.raw_code(raw_name)
+        chunk = {
+            'mass'     : self.mass_codes(targets),
+            'raw'      : np.full(n, code, dtype=np.int32),
+            'scan'     : np.full(n, int(scan), dtype=np.int64) if np.ndim(scan) == 0 else np.asarray(scan, dtype=np.int64),
+            'seq'      : np.arange(self._seq, self._seq + n, dtype=np.int64),
+            'mz'       : as_float64(mzs),
+            'intensity': as_float64(intensities),
+        }
+        keep = self.windows.within(chunk['mz'], chunk['mass'])
+        if not np.all(keep):
+            chunk = { c: v[keep] for c, v in chunk.items() }
+        self._buffer.append(chunk)
+        self._seq += n
+        self._rows += len(chunk['mz'])
+        self._buffered += len(chunk['mz']) * self.row_bytes
+        if self._buffered > self.max_memory // 2:
+            self.spill()
+
+    def sorted_buffer(self):
+        """ Concatenate the buffer and sort it in report order: target, RAW file
+            name, then append order (scan order within a RAW file).
+
+            Return: dictionary of numpy arrays (empty if nothing is buffered).
+        """
+        if len(self._buffer) == 0:
+            return { c: np.empty(0, dtype=d) for c, d in self.columns.items() }
+        run = { c: np.concatenate([ b[c] for b in self._buffer ]) for c in self.columns }
+        self._buffer, self._buffered = [], 0
+        # RAW file names are ordered as strings, so every run is sorted the same way.
+        order = np.lexsort((run['seq'], self.raw_ranks()[run['raw']], run['mass']))
+        return { c: v[order] for c, v in run.items() }
+
+    def raw_ranks(self):
+        """ Rank of every RAW code in the sorted RAW file names (numpy array).
+        """
+        ranks = np.empty(len(self.raw_names), dtype=np.int64)
+        ranks[np.argsort(np.array(self.raw_names, dtype=str), kind='stable')] = np.arange(len(self.raw_names))
+        return ranks
+
+    def keep_maxima(self, run):
+        """ Keep the highest intensity of every (target, RAW file) pair of a run.
+            Ties go to the first peak, in report order.
+        """
+        if len(run['mz']) == 0:
+            return
+        groups = run['mass'].astype(np.int64) * len(self.raw_names) + run['raw']
+        idx = group_argmax(groups, run['intensity'])
+        self._maxima.append({ c: v[idx] for c, v in run.items() })
+
+    def spill(self):
+        """ Sort the buffered peaks and write them to disk as a new run.
+        """
+        import tempfile
+
+        run = self.sorted_buffer()
+        if len(run['mz']) == 0:
+            return
+        self.keep_maxima(run)
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='ifishmass_spool_', dir=self.directory)
+        paths = dict()
+        for c, values in run.items():
+            paths[c] = os.path.join(self._tmp_dir, f"run{len(self._runs)}.{c}.npy")
+            np.save(paths[c], values)
+        self._runs.append(paths)
+        self.debug and print(f"spilled run {len(self._runs)}: {len(run['mz'])} peaks")
+
+    def open_runs(self):
+        """ The spilled runs and the buffered peaks, sorted in report order.
+
+            Return: list of (rows, read) pairs, one per run. read(column, a, b)
+            returns rows a to b of a column. Spilled runs are read from disk a
+            block at a time, not memory-mapped: mapped pages would stay in memory
+            until the end of the merge.
+        """
+        final = self.sorted_buffer()
+        if len(final['mz']) > 0:
+            self.keep_maxima(final)
+            self._memory_run = final
+
+        runs = []
+        for paths in self._runs:
+            columns = dict()
+            for c, path in paths.items():
+                with open(path, 'rb') as fh:
+                    version = np.lib.format.read_magic(fh)
+                    read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) \
+                        else np.lib.format.read_array_header_2_0
+                    shape, _, dtype = read_header(fh)
+                    columns[c] = (path, fh.tell(), dtype, shape[0])
+
+            def read(c, a, b, columns=columns):
+                path, offset, dtype, _ = columns[c]
+                return np.fromfile(path, dtype=dtype, count=b - a, offset=offset + a * dtype.itemsize)
+            runs.append((columns['mz'][3], read))
+
+        if self._memory_run is not None:
+            run = self._memory_run
+            runs.append((len(run['mz']), lambda c, a, b, run=run: run[c][a:b]))
+        return runs
+
+    def merge(self):
+        """ Yield the peaks in report order, one block at a time: target (list_of_masses
+            order), RAW file (sorted names), append order. Every block is a dictionary
+            of numpy arrays (mass, raw, scan, seq, mz, intensity).
+
+            Runs are merged a block of rows at a time, so at most half of
+            max_memory is read at once, whatever the number of peaks.
+        """
+        runs = self.open_runs()
+        if len(runs) == 0:
+            return
+        ranks = self.raw_ranks()
+        n_raws = max(1, len(self.raw_names))
+        block_rows = max(1024, (self.max_memory // 2) // (self.row_bytes * len(runs)))
+
+        def keys(read, a, b):
+            return read('mass', a, b).astype(np.int64) * n_raws + ranks[read('raw', a, b)]
+
+        cursors = [0] * len(runs)
+        while True:
+            pending = [ i for i, (rows, _) in enumerate(runs) if cursors[i] < rows ]
+            if len(pending) == 0:
+                break
+            blocks = dict()
+            bound = None
+            truncated = []
+            for i in pending:
+                rows, read = runs[i]
+                a = cursors[i]
+                b = min(a + block_rows, rows)
+                blocks[i] = keys(read, a, b)
+                # rows after this block are not read yet: nothing beyond its last key is safe.
+                if b < rows:
+                    bound = blocks[i][-1] if bound is None else min(bound, blocks[i][-1])
+                    truncated.append(i)
+            # runs hold increasing append orders: rows of the bound key are safe up to the
+            # first run that may have more of them (later runs give them in the next block).
+            first = min((i for i in truncated if blocks[i][-1] == bound), default=None)
+
+            pieces = []
+            for i in pending:
+                side = 'right' if first is None or i <= first else 'left'
+                take = len(blocks[i]) if bound is None else int(np.searchsorted(blocks[i], bound, side=side))
+                if take == 0:
+                    continue
+                a = cursors[i]
+                read = runs[i][1]
+                pieces.append(({ c: read(c, a, a + take) for c in self.columns }, blocks[i][:take]))
+                cursors[i] += take
+
+            block = { c: np.concatenate([ p[c] for p, _ in pieces ]) for c in self.columns }
+            order = np.lexsort((block['seq'], np.concatenate([ k for _, k in pieces ])))
+            yield { c: v[order] for c, v in block.items() }
+
+    def maxima(self):
+        """ Highest intensity of every (target, RAW file) pair, merged from the
+            maxima of every run. Call after merge (or open_runs).
+
+            Return: dictionary of numpy arrays, one row per pair, in report order.
+        """
+        if len(self._maxima) == 0:
+            return { c: np.empty(0, dtype=d) for c, d in self.columns.items() }
+        rows = { c: np.concatenate([ m[c] for m in self._maxima ]) for c in self.columns }
+        ranks = self.raw_ranks()
+        order = np.lexsort((rows['seq'], ranks[rows['raw']], rows['mass']))
+        rows = { c: v[order] for c, v in rows.items() }
+        # ties go to the first peak: lowest index in report order.
+        groups = rows['mass'].astype(np.int64) * len(self.raw_names) + rows['raw']
+        idx = np.sort(group_argmax(groups, rows['intensity']))
+        return { c: v[idx] for c, v in rows.items() }
+
+    def close(self):
+        """ Remove the spilled runs.
+        """
+        import shutil
+
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+        self._runs = []
@@ -0,0 +1,150 @@
+import numpy as np
+from iFishMass.kernels import group_argmax
+
+def as_float64(values):
+    """ Convert m/z or intensity values to float64.
+        32-bit values are converted through their shortest decimal representation,
+        so they are equal to the values read back from the CSV files per scan.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f' and values.dtype.itemsize < 8:
+        return values.astype(str).astype(np.float64)
+    return values.astype(np.float64)
+
+class PeakTable:
+    def __init__(self, debug=False) -> None:
+        """ Object initialization.
+            In-memory, columnar store of the peaks matched during the extraction.
+            Each row is a single (target m/z, experimental peak) match:
+
+                RAW, SCAN, TARGET_M/Z, EXPERIMENTAL_M/Z, INTENSITY
+
+            RAW file names are interned; the RAW column only holds an integer
+            code pointing into self.raw_names.
+
+            Parameters:
+            ----------
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a PeakTable object.
+        """
+        self.raw_names = []
+        self.debug = debug
+        self._raw_codes = dict()
+        self._chunks = []
+        self._columns = None
+        # rows sorted by RAW code, and the first row of every RAW code (see select_raw).
+        self._raw_order = None
+
+    def __len__(self):
+        return len(self.columns()['intensity'])
+
+    def __str__(self):
+        """ string representation of the PeakTable object.
+        """
+        return f"raw_names={self.raw_names}, rows={len(self)}, debug={self.debug}"
+
+    def raw_code(self, raw_name):
+        """ Return the integer code of raw_name. New names are added to self.raw_names.
+        """
+        code = self._raw_codes.get(raw_name)
+        if code is None:
+            code = len(self.raw_names)
+            self._raw_codes[raw_name] = code
+            self.raw_names.append(raw_name)
+        return code
+
+    def append(self, raw_name, scan, targets, mzs, intensities):
+        """ Append the matches found in a scan, or in all scans, of a RAW file.
+
+            Parameters:
+            ----------
+            raw_name   : name of the RAW file (mzXML file name without extension).
+            scan       : scan number (int), or the scan number of every match (array like)
+            targets    : target m/z of every match (array like)
+            mzs        : experimental m/z of every match (array like)
+            intensities: intensity of every match (array like)
+        """
+        assert len(targets) == len(mzs) == len(intensities), \
+            "append. targets, mzs and intensities must have the same length."
+
+        # RAW files without matches are not listed, the same way no
+        # CSV directory is created for them.
+        if len(mzs) == 0:
+            return
+
+        code = self.raw_code(raw_name)
+        n = len(mzs)
+        self._chunks.append((
+            np.full(n, code, dtype=np.int32),
+            np.full(n, int(scan), dtype=np.int64) if np.ndim(scan) == 0 else np.asarray(scan, dtype=np.int64),
+            np.asarray(targets, dtype=np.float64),
+            as_float64(mzs),
+            as_float64(intensities),
+        ))
+        # columns are rebuilt on the next query.
+        self._columns = None
+        self._raw_order = None
+
+    def columns(self):
+        """ Return the table as a dictionary of numpy arrays
+            (raw, scan, target, mz, intensity).
+            Appended chunks are concatenated once and kept until the next append.
+        """
+        if self._columns is None:
+            names = ('raw', 'scan', 'target', 'mz', 'intensity')
+            if len(self._chunks) == 0:
+                dtypes = (np.int32, np.int64, np.float64, np.float64, np.float64)
+                self._columns = { n: np.empty(0, dtype=d) for n, d in zip(names, dtypes) }
+            else:
+                self._columns = { n: np.concatenate([c[i] for c in self._chunks]) for i, n in enumerate(names) }
+                # keep a single chunk, so the concatenation is not repeated.
+                self._chunks = [ tuple(self._columns[n] for n in names) ]
+        return self._columns
+
+    def select(self, raw_name, target):
+        """ Select the matches of a target m/z in a given RAW file.
+
+            Parameters:
+            ----------
+            raw_name: name of the RAW file (string)
+            target  : target m/z (float)
+
+            Return
+            ------
+            scans, mzs, intensities (numpy arrays). Empty arrays are returned
+            when raw_name is unknown or the target has no matches.
+        """
+        columns = self.columns()
+        code = self._raw_codes.get(raw_name)
+        if code is None:
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty, empty
+
+        rows = (columns['raw'] == code) & (columns['target'] == target)
+        return columns['scan'][rows], columns['mz'][rows], columns['intensity'][rows]
+
+    def select_raw(self, raw_name):
+        """ Select all the matches of a given RAW file, in table order.
+            Rows are grouped by RAW file once, so selecting every RAW file
+            reads the table once.
+
+            Return
+            ------
+            scans, targets, mzs, intensities (numpy arrays). Empty arrays are
+            returned when raw_name is unknown.
+        """
+        columns = self.columns()
+        code = self._raw_codes.get(raw_name)
+        if code is None:
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty, empty, empty
+
+        if self._raw_order is None:
+            order = np.argsort(columns['raw'], kind='stable')
+            starts = np.searchsorted(columns['raw'][order], np.arange(len(self.raw_names) + 1))
+            self._raw_order = (order, starts)
+        order, starts = self._raw_order
+        rows = order[starts[code]:starts[code + 1]]
+        return columns['scan'][rows], columns['target'][rows], columns['mz'][rows], columns['intensity'][rows]
@@ -0,0 +1,116 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+class Profiler:
+    def __init__(self, enabled=True, cprofile_stages=(), cprofile_prefix='profile_', debug=False) -> None:
+        """ Object initialization.
+            Wall and CPU time per pipeline stage, plus counters (files, scans, peaks, bytes ...).
+
+                with profiler.stage('parse'):
+                    ...
+                profiler.count('scans_read')
+
+            A disabled Profiler does nothing, so it can be passed around
+            unconditionally.
+
+            Parameters:
+            ----------
+            enabled: record stages and counters (boolean).
+            cprofile_stages: names of the stages run under cProfile. Statistics are
+                    dumped to <cprofile_prefix><stage>.prof (pstats format).
+                    cProfile cannot be nested, use it for top-level stages only.
+            cprofile_prefix: path prefix of the cProfile dumps.
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a Profiler object.
+        """
+        self.enabled = enabled
+        self.cprofile_stages = set(cprofile_stages)
+        self.cprofile_prefix = cprofile_prefix
+        self.debug = debug
+        # stage -> {'wall': seconds, 'cpu': seconds, 'calls': integer}
+        self.stages = dict()
+        self.counters = dict()
+        self.cprofile_files = []
+
+    def __str__(self):
+        """ string representation of the Profiler object.
+        """
+        return f"enabled={self.enabled}, stages={list(self.stages)}, counters={self.counters}"
+
+    def stage(self, name):
+        """ Context manager adding the wall and CPU time of the block to stage name.
+            Stages are re-entrant: time of every call is added up.
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name):
+        profile = None
+        if name in self.cprofile_stages:
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            if profile is not None:
+                profile.disable()
+                filename = f"{self.cprofile_prefix}{name}.prof"
+                profile.dump_stats(filename)
+                self.cprofile_files.append(filename)
+            self.add_time(name, wall, cpu)
+            self.debug and print(f"stage {name}: wall={wall:.3f}s cpu={cpu:.3f}s")
+
+    def add_time(self, name, wall, cpu, calls=1):
+        """ Add wall and CPU time (seconds) to stage name.
+        """
+        if not self.enabled:
+            return
+        entry = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+        entry['wall'] += wall
+        entry['cpu'] += cpu
+        entry['calls'] += calls
+
+    def count(self, name, n=1):
+        """ Add n to counter name.
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, report):
+        """ Add up the stages and counters of a report (see report()) into this
+            Profiler. Used to collect the profiles of the worker processes.
+        """
+        if not self.enabled or report is None:
+            return
+        for name, entry in report.get('stages', {}).items():
+            self.add_time(name, entry['wall'], entry['cpu'], entry['calls'])
+        for name, n in report.get('counters', {}).items():
+            self.count(name, n)
+
+    def report(self):
+        """ Return stages and counters as a dictionary (JSON serializable).
+        """
+        return {
+            'stages': { name: dict(entry) for name, entry in self.stages.items() },
+            'counters': dict(self.counters),
+            'cprofile': list(self.cprofile_files),
+        }
+
+    def save(self, filename, **metadata):
+        """ Save report() to filename (JSON). metadata is saved under the 'run' key.
+        """
+        import json
+
+        report = self.report()
+        report['run'] = metadata
+        with open(filename, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        return filename
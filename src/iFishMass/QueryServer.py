@@ -0,0 +1,172 @@
+import os
+import json
+import math
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class QueryServer:
+    # reports answered by the server (see Raw.build_reports).
+    reports = ('intensities_among_all_raw', 'highest_intensities_per_raw', 'highest_intensities_among_all_raw')
+
+    def __init__(self, experiments, host='127.0.0.1', port=8765, debug=False) -> None:
+        """ Object initialization.
+            Long-running server answering report queries from peak indexes loaded
+            once (see PeakIndex). Every request builds its reports with the same
+            code as the command line (PeakTable + Raw.build_reports); requests are
+            served concurrently, one thread each, from the shared read-only arrays.
+
+                GET  /experiments  -> {"experiments": {name: {"peaks", "raw_files", "ms_level"}}}
+                POST /report       <- {"experiment": name, "masses": [...], "ppm": 10,
+                                       "report": "highest_intensities_per_raw" | ... | "all"}
+                                   -> {"columns": [...], "<report>": [[row], ...], ...}
+
+            "experiment" can be left out when a single experiment is served.
+            Rows of every report have the same fields, in "columns" order:
+            M/Z, EXPERIMENTAL_M/Z, INTENSITY, SAMPLE, FILE. The scan file path of
+            highest_intensities_among_all_raw (one field in the CSV report) is
+            split in SAMPLE (RAW directory) and FILE (file name) like the others.
+            A malformed request is answered 400, a failed one 500, both with
+            {"error": message}.
+
+            Parameters:
+            ----------
+            experiments: dictionary experiment name -> PeakIndex (opened).
+            host, port : address the HTTP server listens on. Use localhost only,
+                    there is no authentication.
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a QueryServer object.
+        """
+        assert len(experiments) > 0, "at least one experiment (peak index) is needed."
+        self.experiments = experiments
+        self.host = host
+        self.port = port
+        self.debug = debug
+        self.httpd = None
+
+    def __str__(self):
+        """ string representation of the QueryServer object.
+        """
+        return f"host={self.host}, port={self.port}, experiments={list(self.experiments)}, debug={self.debug}"
+
+    def describe(self):
+        """ Experiments served: number of peaks, RAW files and ms_level of each one.
+        """
+        return { name: {'peaks': len(index), 'raw_files': len(index.meta['raw_names']),
+            'ms_level': index.meta['ms_level']} for name, index in self.experiments.items() }
+
+    def query(self, request):
+        """ Answer a report request (dictionary, see __init__).
+
+            Return
+            ------
+            dictionary report name -> list of rows, plus 'columns'.
+            Raise ValueError on a malformed request: masses and ppm must be
+            finite numbers greater than 0.
+        """
+        from iFishMass.Raw import Raw
+        from iFishMass.PeakTable import PeakTable
+
+        name = request.get('experiment')
+        if name is None and len(self.experiments) == 1:
+            name = next(iter(self.experiments))
+        if name not in self.experiments:
+            raise ValueError(f"unknown experiment {name}. Available: {sorted(self.experiments)}")
+
+        try:
+            masses = [ float(m) for m in request['masses'] ]
+            ppm = float(request.get('ppm', 10))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("'masses' (list of numbers) is required and 'ppm' must be a number.")
+        if len(masses) == 0 or not all(math.isfinite(x) and x > 0 for x in masses + [ppm]):
+            raise ValueError("'masses' must hold positive finite numbers and 'ppm' must be a positive finite number.")
+
+        report = request.get('report', 'all')
+        names = self.reports if report == 'all' else (report,)
+        if any(n not in self.reports for n in names):
+            raise ValueError(f"unknown report {report}. Available: {list(self.reports)} or 'all'")
+
+        # same report logic as the command line, on this request's own PeakTable.
+        peaks = self.experiments[name].fill(PeakTable(), masses, ppm)
+        reports = Raw('', peaks=peaks).build_reports(ppm, masses)
+
+        response = {'experiment': name, 'columns': ['M/Z', 'EXPERIMENTAL_M/Z', 'INTENSITY', 'SAMPLE', 'FILE']}
+        for n in names:
+            rows = [ [ x.item() if isinstance(x, np.generic) else x for x in row ] for row in reports[n] ]
+            # among all RAW files, the scan file is a path: SAMPLE/FILE.
+            response[n] = [ row if len(row) == 5 else
+                row[:3] + [ os.path.basename(os.path.dirname(row[3])), os.path.basename(row[3]) ] for row in rows ]
+        return response
+
+    def handler(self):
+        """ Request handler class bound to this server.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self, status, content):
+                body = json.dumps(content).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/experiments':
+                    self.reply(200, {'experiments': server.describe()})
+                else:
+                    self.reply(404, {'error': f"unknown path {self.path}"})
+
+            def do_POST(self):
+                if self.path.rstrip('/') != '/report':
+                    self.reply(404, {'error': f"unknown path {self.path}"})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    request = json.loads(self.rfile.read(length) or b'{}')
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object.")
+                    self.reply(200, server.query(request))
+                except ValueError as error:
+                    self.reply(400, {'error': str(error)})
+                except Exception as error:
+                    self.reply(500, {'error': f"{type(error).__name__}: {error}"})
+
+            def log_message(self, format, *args):
+                server.debug and BaseHTTPRequestHandler.log_message(self, format, *args)
+
+        return Handler
+
+    def start(self):
+        """ Bind the HTTP server and serve requests in a background thread.
+
+            Return: the (host, port) the server listens on.
+        """
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self.handler())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.httpd.server_address
+
+    def serve_forever(self):
+        """ Serve requests until interrupted (Ctrl-C).
+        """
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self.handler())
+        self.httpd.daemon_threads = True
+        print(f"serving {list(self.experiments)} on http://{self.host}:{self.port} (Ctrl-C to stop)")
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("Bye!")
+        finally:
+            self.httpd.server_close()
+
+    def stop(self):
+        """ Stop a server started with start().
+        """
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
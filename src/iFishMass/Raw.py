@@ -3,11 +3,24 @@ import os
 import glob
 import numpy as np
 import logging
+from iFishMass.MassWindows import MassWindows
+from iFishMass.ScanStore import ScanStore
 
 log = logging.getLogger(__name__)
     
 class Raw:
-    def __init__(self, location, debug=False) -> None:
+    # report name -> CSV file written by write_reports.
+    report_files = {
+        'intensities_among_all_raw'          : 'intensities_among_all_raw.csv',
+        'highest_intensities_per_raw'        : 'highest_intensities_per_raw.csv',
+        'highest_intensities_among_all_raw'  : 'highest_intensities_among_all_raw.csv',
+        'highest_intensities_per_raw_wide'   : 'highest_intensities_per_raw_wide.csv',
+    }
+
+    # extensions of the scan files (CSV files) of a RAW directory.
+    scan_extensions = ('.csv', '.CSV')
+
+    def __init__(self, location, debug=False, peaks=None, cache_size=None) -> None:
         """ Object initialization.
             
             Parameters:
@@ -15,50 +28,170 @@ class Raw:
             location: directory path 
             debug:  optional parameter (boolean) for debbuging purposes.
                     set to False for default.
+            peaks:  optional PeakTable object holding the matched peaks in memory.
+                    When provided, location is not scanned for CSV files and
+                    the reports are built from peaks.
+            cache_size: maximum number of RAW directories kept in the peak cache
+                    (see load_raw). None, the default, keeps all of them.
             
             Return: a Raw object.
         """
+        from collections import OrderedDict
+
+        assert cache_size is None or cache_size >= 1, "cache_size must be None or a positive integer."
+
         self.location = location
+        # reports iterate subdirs in sorted order, so they do not depend on
+        # the order the directories were found (or the hash of their names).
         self.subdirs = set()
         self.data = []
         self.debug = debug
+        self.peaks = peaks
+        self.cache_size = cache_size
+        # dir -> binary scan file (ScanStore) of the RAW file.
+        self.stores = dict()
+        # dir -> (mtime, scan files, sub-directories), see refresh.
+        # scan files are listed in scan order.
+        self.catalogue = dict()
+        # dir -> size of every scan file, read on demand (see scan_file_sizes).
+        self.sizes = dict()
+        # dir -> (mtime, masses, intensities, file codes, filenames, positions)
+        # kept in least recently used order.
+        self._cache = OrderedDict()
+        # RAW directories and scan files read by load_raw (cache misses only).
+        self.counters = {'raw_loads': 0, 'scan_files_read': 0, 'peaks_loaded': 0, 'dirs_listed': 0}
+
+        # in-memory pipeline: every RAW file of the PeakTable is a subdir.
+        if self.peaks is not None:
+            for raw_name in self.peaks.raw_names:
+                self.subdirs.add(os.path.join(self.location, raw_name))
+            return
 
         # find sub-directories containing CSV files only and add it to subdirs set.
-        # iterate directory
-        for path in os.listdir(self.location):
-            self.debug and print(f"path={path}, dir={os.path.join(self.location,path)}")
-            #log.debug("path={}, dir={}".format(path, os.path.join(self.location,path)))
-            
-            for (root,dirs,file) in os.walk(os.path.join(self.location,path)):
-                for f in file:
-                    self.debug and print(f"\troot={root} dirs={dirs} file={f}")
-                    # check only for CSV files and discard eveything else.
-                    if f.endswith('.csv') :
-                        self.subdirs.add(root)
-        
+        self.refresh()
+
         # We need to add some error checking (throw an exception) in case of:
         # 1. A non-existing directory 
         # 2. or directory with no CSV files is used as argument.
 
+    @staticmethod
+    def scan_order(name):
+        """ Sort key of scan file names (without directory): scan number first
+            (2.csv before 10.csv), then any other name in alphabetical order.
+        """
+        stem = name.rpartition('.')[0]
+        return (0, int(stem), name) if stem.isdigit() else (1, 0, name)
+
+    def refresh(self):
+        """ Find the RAW files of self.location, in a single os.scandir pass,
+            and update the catalogue of scan files (self.catalogue) and self.subdirs.
+
+            The catalogue is refreshed incrementally: a directory whose modification
+            time has not changed since the last refresh is not listed again, so a
+            run can call refresh() after writing scan files at the cost of one
+            os.stat per directory.
+
+            A RAW file is either:
+                - a directory holding scan files (CSV files), or
+                - a binary scan file <raw_name>.npz (see ScanStore), named after
+                  the directory the CSV files would have been saved in.
+
+            Return: number of directories listed (not found in the catalogue or modified).
+        """
+        if self.peaks is not None:
+            return 0
+
+        listed = self.counters['dirs_listed']
+        stores, found = dict(), set()
+        with os.scandir(self.location) as entries:
+            for entry in entries:
+                self.debug and print(f"path={entry.name}, dir={entry.path}")
+                if ScanStore.is_store(entry.name) and entry.is_file():
+                    dir = os.path.join(self.location, os.path.splitext(entry.name)[0])
+                    stores[dir] = entry.path
+                elif entry.is_dir():
+                    self.catalogue_tree(entry.path, found)
+
+        # directories removed since the last refresh.
+        for dir in set(self.catalogue) - found:
+            del self.catalogue[dir]
+            self.sizes.pop(dir, None)
+            self.invalidate(dir)
+
+        self.stores = stores
+        self.subdirs = set(stores) | { dir for dir, (_, files, _) in self.catalogue.items() if len(files) > 0 }
+        return self.counters['dirs_listed'] - listed
+
+    def catalogue_tree(self, top, found):
+        """ Catalogue top and its sub-directories (see refresh). An unmodified
+            directory keeps its catalogue entry; its sub-directories are still checked.
+
+            Parameters:
+            -----------
+            top:   directory path (string)
+            found: set of the directories seen, updated in place.
+        """
+        stack = [top]
+        while stack:
+            dir = stack.pop()
+            found.add(dir)
+            try:
+                mtime = os.stat(dir).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            entry = self.catalogue.get(dir)
+            if entry is None or entry[0] != mtime:
+                entry = self.list_dir(dir, mtime)
+            stack.extend(entry[2])
+
+    def list_dir(self, dir, mtime=None):
+        """ List the scan files (in scan order) and the
+            sub-directories of dir with os.scandir, and save them in the catalogue.
+
+            Return: catalogue entry (mtime, scan files, sub-directories)
+        """
+        if mtime is None:
+            mtime = os.stat(dir).st_mtime_ns
+        files, dirs = [], []
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.endswith(self.scan_extensions) and entry.is_file():
+                    self.debug and print(f"\troot={dir} file={name}")
+                    files.append((self.scan_order(name), entry.path))
+                elif entry.is_dir():
+                    dirs.append(entry.path)
+        files.sort()
+        self.catalogue[dir] = (mtime, [ path for _, path in files ], sorted(dirs))
+        self.sizes.pop(dir, None)
+        self.counters['dirs_listed'] += 1
+        return self.catalogue[dir]
+
     def list_csv_files(self, dir):
-        """ List all CSV files in a given directory (dir)
+        """ List all CSV files in a given directory (dir), from the catalogue.
             
             Parameters:
             -----------
             dir: dir_path (string)
 
             Return:
-            list of csv files(list)
+            list of csv files(list), in scan order
+        """
+        entry = self.catalogue.get(dir)
+        if entry is None:
+            entry = self.list_dir(dir)
+        return entry[1]
+
+    def scan_file_sizes(self, dir):
+        """ Size (bytes) of every scan file of dir, in list_csv_files order.
+            Sizes are read once per catalogue entry, not while listing: a stat
+            per file would cost more than the listing itself.
+
+            Return: list of integers
         """
-        csv_files = list()
-        for (root,dirs,file) in os.walk(os.path.join(self.location, dir)):
-            self.debug and print(f"\troot={type(root)} dirs={type(str(dirs))} file={type(str(file))}")
-
-            for f in file:
-                if f.endswith('.csv') or f.endswith('.CSV'):
-                    f = os.path.join(str(root), str(f))
-                    csv_files.append(f) 
-        return csv_files
+        if dir not in self.sizes:
+            self.sizes[dir] = [ os.stat(path).st_size for path in self.list_csv_files(dir) ]
+        return self.sizes[dir]
         
     def __str__(self):
         """ string representation of the RAW object.
@@ -66,8 +199,9 @@ class Raw:
         """
         return f"location={self.location}, subdirs={self.subdirs}, debug={self.debug}"
     
-    def save_to_csv(self, output_filename, header=True):
-        """ Save content of self.data (list of lists) to a text file in CSV format.
+    def save_to_csv(self, output_filename, header=True, data=None):
+        """ Save content of self.data (ResultTable or list of lists) to a text file in CSV format.
+            A ResultTable is written in bulk (see ResultTable.write_csv).
             
             Parameters:
             -----------
@@ -76,14 +210,22 @@ class Raw:
             header: boolean that determines the writing of the header. Optional argument.
                     header names
                     'M/Z', 'Experimental_M/Z', 'INTENSITY', 'RAW_FILE_NAME', 'IN_FILE (SCAN)'
+            data:   optional ResultTable or list of lists saved instead of self.data. e.g. a report of build_reports
             
             Throw an exception if ouput file cannot to saved?
         """
         import csv
+        from iFishMass.ResultTable import ResultTable
         
+        if data is not None:
+            self.data = data
         if len(self.data) == 0:
             assert len(self.data) >= 0, "save_to_csv. data is empty. Do some filtering before saving to csv." 
 
+        if isinstance(self.data, ResultTable):
+            self.data.to_csv(output_filename, header=header)
+            return
+
         #field_names = ['M/Z', 'Experimental_M/Z', 'INTENSITY', 'RAW_FILE_NAME', 'IN_FILE (SCAN)']
         field_names = ['M/Z', 'EXPERIMENTAL_M/Z', 'INTENSITY', 'SAMPLE', 'FILE']
         
@@ -96,14 +238,14 @@ class Raw:
             csv_file_writer.writerows(self.data)  # write the data
     
     def print_data(self):
-        """ print the values of the list self.data 
+        """ print the rows of self.data 
         """
         import pprint
         pp = pprint.PrettyPrinter(indent=4)
         
         if len(self.data) == 0:
              assert len(self.data) >= 0, "print_data. data is empty. Do some filtering before saving to csv." 
-        pp.pprint(self.data)
+        pp.pprint(list(self.data))
         
     def get_highest_intensities_per_raw(self, ppm_tolerance, list_of_masses):
         """ get the highest intensity value for a given m/z in all scans of a given RAW file.
@@ -125,56 +267,78 @@ class Raw:
             [   6983.36,'595.74756','15172.969','C:\\temp\\MERCK\\CSV\\20210910_Jenny_Merck_Expt1_DI_B4_D6_2','15.csv'],
             [   6983.36,'441.20245','7860.515','C:\\temp\\MERCK\\CSV\\20210910_Jenny_Merck_Expt1_DI_B2_B6_1','170.csv'],
         """
-        import numpy as np
-        import os
-        
-        assert ppm_tolerance >= 0, "mz_tolerance must be a positive scalar."
-        self.data = []
-        
-        for mz in list_of_masses:
-            self.debug and print(f"looking for mz = {mz}")
-
-            for dir in self.subdirs:
-                self.debug and print(f"dir= {dir}") 
-                
-                my_mzs, my_intensities, my_filenames  = self.filter_by_mz_per_raw(dir, ppm_tolerance, mz)
-                
-                # error checking
-                # skipping directories (RAW) having m/z not within the ppm_tolerance
-                if len(my_mzs) == 0: # and len(my_intensities) == 0 and len(my_filenames) == 0:
-                    continue
-
-                masses      = np.array(my_mzs).astype(float)  
-                intensities = np.array(my_intensities).astype(float)  
-                filenames   = np.array(my_filenames).astype(str)
-                
-                intensities_to_keep = np.array(intensities).astype(float)  
-                
-                ## get the index of maximum intensity for the massess to keep.
-                # get the index of maximum element in numpy array
-                result = np.where( intensities_to_keep == np.amax(intensities_to_keep) )
-                if self.debug:
-                    print('Returned tuple of arrays :', result)
-                    print('List of Indices of maximum element :', result[0])   
-                #index_max_element = result[0] # it is a tuple
-                index_max_element = result[0][0]
-                self.debug and print(f"index_max_element={index_max_element}  type={type(index_max_element)}")
-                
-                # get the filename and experimental m/z
-                mz_experimental    = masses[index_max_element]
-                max_intensity      = intensities[index_max_element]
-                full_path_filename = filenames[index_max_element]
-                filename           = os.path.basename(full_path_filename)
-            
-                self.debug and print(f"SEARCH FOR mz={mz}, mzexp={mz_experimental}, max_inten={max_intensity}, dir={dir}, filename={filename}")
-                self.data.append([mz, mz_experimental, max_intensity, dir, filename])
-                #self.data.append([mz, mz_experimental, max_intensity, full_path_filename])
+        self.data = self.build_reports(ppm_tolerance, list_of_masses)['highest_intensities_per_raw']
 
         if self.debug:
             print("THIS IS DATA")        
             print(self.data)        
         
         
+    def filter_per_raw(self, dir, windows):
+        """ Filter all the m/z of windows (MassWindows), in all scans of a given RAW file.
+        Same peaks as filter_by_mz_per_raw for every m/z, found with a single match.
+
+            Parameters
+            ---------
+            dir :  directory name (string) representing a single RAW file.
+            windows: MassWindows object of the list of masses.
+
+            Return
+            ------
+            targets (position of the m/z in windows.masses), m/z, intensities, file
+            codes (numpy arrays) and scan file names. filenames[file_codes[i]] is
+            the scan file of the i-th peak. Peaks are ordered by target and then
+            by scan file.
+        """
+        import numpy as np
+
+        if self.peaks is not None:
+            return self.filter_in_memory(dir, windows)
+
+        # all scan files of the RAW file, loaded once and shared by every report.
+        masses, intensities, file_codes, filenames, positions = self.load_raw(dir)
+
+        # cached masses are sorted; the windows are found by binary search.
+        peak_idx, target_idx = windows.match(masses, is_sorted=True)
+
+        # back to the order of the scan files, within every target.
+        order = np.lexsort((positions[peak_idx], target_idx))
+        peak_idx, target_idx = peak_idx[order], target_idx[order]
+        return target_idx, masses[peak_idx], intensities[peak_idx], file_codes[peak_idx], filenames
+
+    def filter_in_memory(self, dir, windows):
+        """ Same as filter_per_raw, but the peaks are taken from the PeakTable
+        (self.peaks) instead of the scan files. Only the peaks matched to a m/z
+        during the extraction are available for it (see filter_by_mz_in_memory).
+
+            Return
+            ------
+            targets, m/z, intensities, file codes and scan file names (see
+            filter_per_raw), ordered by target and then by PeakTable row.
+        """
+        import numpy as np
+        import os
+
+        scans, targets, masses, intensities = self.peaks.select_raw(os.path.basename(dir))
+
+        # every row goes to each position of its target in windows.masses.
+        order = np.argsort(windows.masses, kind='stable')
+        sorted_masses = windows.masses[order]
+        lo = np.searchsorted(sorted_masses, targets, side='left')
+        counts = np.searchsorted(sorted_masses, targets, side='right') - lo
+        rows = np.repeat(np.arange(len(targets)), counts)
+        target_idx = order[np.arange(len(rows)) + np.repeat(lo - (np.cumsum(counts) - counts), counts)]
+
+        keep = windows.within(masses[rows], target_idx)
+        rows, target_idx = rows[keep], target_idx[keep]
+        regroup = np.lexsort((rows, target_idx))
+        rows, target_idx = rows[regroup], target_idx[regroup]
+
+        # every scan file name is made once.
+        scans, file_codes = np.unique(scans[rows], return_inverse=True)
+        filenames = np.array([ os.path.join(dir, f"{scan}.csv") for scan in scans ]).astype(str)
+        return target_idx, masses[rows], intensities[rows], file_codes.reshape(-1), filenames
+
     def filter_by_mz_per_raw(self, dir, ppm_tolerance, mz):
         """ Filter m/z, within a specified ppm_tolerance, in all scans of a given RAW file.
         
@@ -209,45 +373,175 @@ class Raw:
         assert ppm_tolerance >= 0, "mz_tolerance must be a positive scalar."
         assert mz >= 0, "mass_in must be a positive scalar"
 
+        if self.peaks is not None:
+            return self.filter_by_mz_in_memory(dir, ppm_tolerance, mz)
+
+        # all scan files of the RAW file, loaded once and shared by every report.
+        masses, intensities, file_codes, filenames, positions = self.load_raw(dir)
+        
+        # cached masses are sorted, the ppm window of mz is found by binary search.
+        peak_idx, _ = MassWindows([mz], ppm_tolerance).match(masses, is_sorted=True)
+
+        # Error checking
+        if len(peak_idx) == 0:
+            return [], [] , []
+
+        # back to the order of the scan files.
+        peak_idx = peak_idx[np.argsort(positions[peak_idx], kind='stable')]
+
+        # get the mz, intensities and filenames of the masses to keep.
+        m_to_keep = masses[peak_idx]
+        i_to_keep = intensities[peak_idx]
+        f_to_keep = filenames[file_codes[peak_idx]]
+        
+        return m_to_keep, i_to_keep, f_to_keep
+
+    def load_raw(self, dir):
+        """ Load all scans (CSV files or binary file) of a RAW directory into numpy arrays.
+
+        The arrays are cached, so every RAW directory is read once no matter how
+        many masses or reports are computed. Cache policy:
+            - a cached RAW directory is re-read when its modification time changes
+              (scan files added or removed), or the binary scan file is rewritten.
+            - when cache_size is set, the least recently used RAW directory is
+              evicted once the cache holds more than cache_size directories.
+            - invalidate() drops cached directories explicitly.
+
+            Parameters
+            ---------
+            dir :  directory name (string) representing a single RAW file.
+
+            Return
+            ------
+            masses, intensities, file_codes, filenames, positions (numpy arrays).
+            Peaks are sorted by m/z (masses). filenames[file_codes[i]] is the scan
+            file of masses[i], intensities[i], and positions[i] the row of the
+            peak in the scan files order.
+        """
+        import numpy as np
+
+        # RAW files saved in binary format are a single file.
+        store = self.stores.get(dir)
+        mtime = os.stat(dir if store is None else store).st_mtime_ns
+        entry = self._cache.get(dir)
+        if entry is not None and entry[0] == mtime:
+            self._cache.move_to_end(dir)
+            return entry[1:]
+
+        if store is None:
+            # scan files added or removed since the catalogue was made.
+            if dir not in self.catalogue or self.catalogue[dir][0] != mtime:
+                self.list_dir(dir, mtime)
+            masses, intensities, file_codes, filenames = self.read_csv_dir(dir)
+            self.counters['scan_files_read'] += len(filenames)
+        else:
+            masses, intensities, file_codes, filenames = self.read_store(dir, store)
+            self.counters['scan_files_read'] += 1
+        self.counters['raw_loads'] += 1
+        self.counters['peaks_loaded'] += len(masses)
+
+        # sort peaks by m/z once, so ppm windows can be found by binary search.
+        positions = np.argsort(masses, kind='stable')
+        entry = (
+            mtime,
+            masses[positions],
+            intensities[positions],
+            file_codes[positions],
+            filenames,
+            positions,
+        )
+
+        self._cache[dir] = entry
+        self._cache.move_to_end(dir)
+        if self.cache_size is not None:
+            while len(self._cache) > self.cache_size:
+                evicted, _ = self._cache.popitem(last=False)
+                self.debug and print(f"evicting {evicted} from the peak cache")
+        return entry[1:]
+
+    def read_csv_dir(self, dir):
+        """ Read all scan files (CSV) of a RAW directory.
+
+            Return
+            ------
+            masses, intensities, file_codes, filenames (numpy arrays), in the
+            scan files order. filenames[file_codes[i]] is the scan file of masses[i].
+        """
+        import numpy as np
+
         # listing all scan files.
         my_list = self.list_csv_files(dir) 
         self.debug and print(f"list_csv_files output = {my_list}")
-        
+
         # loading scan files into a bidimensional list.
         filename_mz_intensity_list =  self.load_all_files_in_memory(my_list)
-        self.debug and pp.pprint(filename_mz_intensity_list)
-        
-        # extract m/z, intensities and filenames from the bidimensional list and keep m/z, intensity
-        # within a given ppm_tolerance range.
-        filenames   = [ my_list[0] for my_list in filename_mz_intensity_list ]
-        masses      = [ my_list[1] for my_list in filename_mz_intensity_list ]
-        intensities = [ my_list[2] for my_list in filename_mz_intensity_list ]
-        
-        self.debug and print(f"type={type(masses)} type={type(intensities)}")
-        
-        # ppm calculation
-        masses      = np.array(masses).astype(float)  
-        intensities = np.array(intensities).astype(float)  
-        filenames   = np.array(filenames).astype(str)
-        # lists were converted into a numpy array to avoid this error
+
+        # the file name is replaced by its position in my_list.
+        codes = { f: i for i, f in enumerate(my_list) }
+        file_codes  = [ codes[row[0]] for row in filename_mz_intensity_list ]
+        masses      = [ row[1] for row in filename_mz_intensity_list ]
+        intensities = [ row[2] for row in filename_mz_intensity_list ]
+
+        # lists are converted into a numpy array to avoid this error
         # TypeError: unsupported operand type(s) for -: 'list' and 'float'
+        return (
+            np.array(masses).astype(float),
+            np.array(intensities).astype(float),
+            np.array(file_codes, dtype=np.int64),
+            np.array(my_list).astype(str),
+        )
+
+    def read_store(self, dir, store):
+        """ Read the binary scan file (ScanStore) of a RAW file in a single bulk read.
+        Scans are named <dir>/<scan>.csv, like in the CSV files layout.
+
+            Return
+            ------
+            masses, intensities, file_codes, filenames (numpy arrays), in the
+            scans order. filenames[file_codes[i]] is the scan of masses[i].
+        """
+        import numpy as np
+
+        scans, offsets, masses, intensities = ScanStore(store, debug=self.debug).read()
+        file_codes = np.repeat(np.arange(len(scans), dtype=np.int64), np.diff(offsets))
+        filenames  = np.array([ os.path.join(dir, f"{scan}.csv") for scan in scans ]).astype(str)
+        return masses, intensities, file_codes, filenames
+
+    def invalidate(self, dir=None):
+        """ Drop dir from the peak cache. All directories are dropped when dir is None.
+        """
+        if dir is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(dir, None)
         
-        masses_to_keep = (np.abs(masses - mz) / mz ) * 1_000_000
-        masses_to_keep = masses_to_keep <= ppm_tolerance
-        # At this point masses_to_keep is an array of booleans. 
-        # The indexes of all masses within the ppm_tolerance range have a True value. 
-        
+    def filter_by_mz_in_memory(self, dir, ppm_tolerance, mz):
+        """ Same as filter_by_mz_per_raw, but the peaks are taken from the
+        PeakTable (self.peaks) instead of the CSV files.
+
+        Only the peaks matched to mz during the extraction are available, so mz
+        must be one of the masses used to build the PeakTable.
+
+            Return
+            ------
+            m/z, intensities and scan file names (numpy arrays) within ppm_tolerance.
+            Scan file names are built as <dir>/<scan>.csv, like in the CSV files layout.
+        """
+        import numpy as np
+        import os
+
+        scans, masses, intensities = self.peaks.select(os.path.basename(dir), mz)
+
+        peak_idx, _ = MassWindows([mz], ppm_tolerance).match(masses)
+
         # Error checking
-        if not np.any(masses_to_keep):
+        if len(peak_idx) == 0:
             return [], [] , []
-        
-        # get the mz, intensities and filenames of the masses to keep.
-        m_to_keep = masses[masses_to_keep]
-        i_to_keep = intensities[masses_to_keep]
-        f_to_keep = filenames[masses_to_keep]
-        
-        return m_to_keep, i_to_keep, f_to_keep
-        
+
+        peak_idx = np.sort(peak_idx)
+        filenames = np.array([ os.path.join(dir, f"{scan}.csv") for scan in scans[peak_idx] ])
+        return masses[peak_idx], intensities[peak_idx], filenames
+
     def load_all_files_in_memory(self, list_of_files):
         """ Load a list of CSV files, containing m/z and intensities pairs,
         into a bidimensional list. 
@@ -342,22 +636,7 @@ class Raw:
         ppm_tolerance  = ppm value 
         list_of_masses = list()
         """
-        import numpy as np
-        import itertools
-
-        self.data = []
-        for mz in list_of_masses:
-            self.debug and print(f"looking for mz = {mz}")
-
-            for dir in self.subdirs:
-                self.debug and print(f"dir= {dir}") 
-                my_mzs, my_intensities, my_filenames  = self.filter_by_mz_per_raw(dir, ppm_tolerance, mz)
-                
-                # iterating over multiples list at a time
-                for (my_mz, my_intensity, full_path_filename) in zip(my_mzs, my_intensities, my_filenames):
-                    filename = os.path.basename(full_path_filename)
-                    #self.data.append([mz, my_mz, my_intensity, full_path_filename, filename])
-                    self.data.append([mz, my_mz, my_intensity, dir, filename])
+        self.data = self.build_reports(ppm_tolerance, list_of_masses)['intensities_among_all_raw']
                     
         if self.debug:
             print("THIS IS DATA")        
@@ -373,72 +652,204 @@ class Raw:
         ppm   = ppm
         list_of_masses = list()
         """
+        self.data = self.build_reports(ppm_tolerance, list_of_masses)['highest_intensities_among_all_raw']
+
+        if self.debug:
+            print("THIS IS DATA")        
+            print(self.data)
+
+    def build_reports(self, ppm_tolerance, list_of_masses):
+        """ Build the three reports in a single pass over the matched peaks:
+        the peaks of every (m/z, RAW file) pair are filtered once and used by all of them.
+
+            intensities_among_all_raw  : all intensities of every m/z in each RAW file.
+                [mz, experimental_mz, intensity, dir, filename]
+            highest_intensities_per_raw: highest intensity of every m/z in each RAW file.
+                [mz, experimental_mz, max_intensity, dir, filename]
+            highest_intensities_among_all_raw: highest intensity of every m/z among all RAW files.
+                [mz, experimental_mz, max_intensity, full_path_filename]
+
+        Ties go to the first peak found (first RAW file, then first scan file).
+        Maxima are computed for all the groups at once (see PeakTable.group_argmax).
+
+        Parameters:
+        -----------
+        ppm_tolerance  = ppm tolerance value.
+        list_of_masses = a list containing a list of m/z values. 
+
+        Return:
+        dictionary report name -> ResultTable. Rows are ordered by list_of_masses,
+        then by RAW file (sorted).
+        """
         import numpy as np
         import os
-        import pprint
-        pp = pprint.PrettyPrinter(indent=4)
-        
+        from iFishMass.PeakTable import group_argmax
+        from iFishMass.ResultTable import ResultTable
+
+        list_of_masses = list(list_of_masses)
+        dirs = sorted(self.subdirs)
+        table = self.matched_peaks(ppm_tolerance, list_of_masses, dirs)
+        mass_idx, dir_idx, file_idx = table['mass'], table['dir'], table['file']
+        masses, intensities, filenames = table['mz'], table['intensity'], table['filenames']
+
+        # scan files are named once: by file name in the reports per RAW file,
+        # by full path in the report among all RAW files.
+        names, name_codes = np.unique([ os.path.basename(f) for f in filenames ], return_inverse=True)
+        all_intensities = ResultTable(list_of_masses, mass_idx, masses, intensities,
+            dirs, dir_idx, names.tolist(), name_codes.reshape(-1)[file_idx], debug=self.debug)
+
+        # highest intensity per (m/z, RAW file) and per m/z, for all of them at once.
+        # Group keys follow the report order: list_of_masses, then RAW files.
+        per_raw = all_intensities.take(group_argmax(mass_idx * len(dirs) + dir_idx, intensities))
+        idx = group_argmax(mass_idx, intensities)
+        among_all = ResultTable(list_of_masses, mass_idx[idx], masses[idx], intensities[idx],
+            filenames.tolist(), file_idx[idx], debug=self.debug)
+
+        return {
+            'intensities_among_all_raw'        : all_intensities,
+            'highest_intensities_per_raw'      : per_raw,
+            'highest_intensities_among_all_raw': among_all,
+        }
+
+    def matched_peaks(self, ppm_tolerance, list_of_masses, dirs=None):
+        """ Table of the peaks within ppm_tolerance of every m/z in every RAW file.
+
+        Parameters:
+        -----------
+        ppm_tolerance  = ppm tolerance value.
+        list_of_masses = a list containing a list of m/z values. 
+        dirs           = RAW directories, sorted self.subdirs by default.
+
+        Return:
+        dictionary of numpy arrays, one element per peak:
+            mass     : index of the m/z in list_of_masses
+            dir      : index of the RAW directory in dirs
+            mz       : experimental m/z
+            intensity: intensity
+            file     : index of the scan file in filenames
+            filenames: scan files (one element per file, not per peak)
+        Rows are ordered by list_of_masses, then RAW directory, then scan file.
+        """
+        import numpy as np
+
         assert ppm_tolerance >= 0, "mz_tolerance must be a positive scalar."
-        self.data = []
-        for mz in list_of_masses:
-            self.debug and print(f"looking for mz = {mz}")
-
-            all_mzs         = list()    
-            all_intensities = list()    
-            all_filenames   = list()    
-            for dir in self.subdirs:
-                self.debug and print(f"dir= {dir}") 
-                
-                my_mzs, my_intensities, my_filenames  = self.filter_by_mz_per_raw(dir, ppm_tolerance, mz)
-                # error checking
-                # skipping directories (RAW) having m/z not within the ppm_tolerance
-                if len(my_mzs) == 0: #and len(my_intensities) == 0 and len(my_filenames) == 0:
-                    continue
-                
-                for m in my_mzs: 
-                    all_mzs.append(m)
-                for i in my_intensities: 
-                    all_intensities.append(i)
-                for f in my_filenames: 
-                    all_filenames.append(f)
-            
-            # skipping directories (RAW) having m/z not within the ppm_tolerance
-            if len(all_mzs) == 0: #and len(my_intensities) == 0 and len(my_filenames) == 0:
+        if dirs is None:
+            dirs = sorted(self.subdirs)
+
+        # ppm windows of all the masses, built once: every RAW directory is
+        # matched against all of them at once (see MassWindows.match).
+        windows = MassWindows(list_of_masses, ppm_tolerance, debug=self.debug)
+
+        columns = {'mass': [], 'dir': [], 'mz': [], 'intensity': [], 'file': []}
+        filenames = []
+        for d, dir in enumerate(dirs):
+            my_targets, my_mzs, my_intensities, my_file_codes, my_filenames = self.filter_per_raw(dir, windows)
+
+            # skipping directories (RAW) having no m/z within the ppm_tolerance
+            if len(my_mzs) == 0:
                 continue
-                
-            self.debug and print("PRINTING ALL_MZS")         and pp.pprint(all_mzs)
-            self.debug and print("PRINTING ALL_INTENSIITES") and pp.pprint(all_intensities) 
-            self.debug and print("PRINTING ALL_FILENAMES")   and pp.pprint(all_filenames)
 
-            all_mzs         = np.array(all_mzs).astype(float)  
-            all_intensities = np.array(all_intensities).astype(float)  
-            all_filenames   = np.array(all_filenames).astype(str)
-            
-            intensities_to_keep = np.array(all_intensities).astype(float)  
-            
-            ## get the index of maximum intensity for the massess to keep.
-            # get the index of maximum element in numpy array
-            result = np.where( intensities_to_keep == np.amax(intensities_to_keep) )
-            if self.debug:
-                print('Returned tuple of arrays :', result)
-                print('List of Indices of maximum element :', result[0])   
-            #index_max_element = result[0] # it is a tuple
-            index_max_element = result[0][0]
-            self.debug and print(f"index_max_element={index_max_element}  type={type(index_max_element)}")
-            
-            # get the filename and experimental m/z
-            mz_experimental    = all_mzs[index_max_element]
-            max_intensity      = all_intensities[index_max_element]
-            full_path_filename = all_filenames[index_max_element]
-            filename           = os.path.basename(full_path_filename)
-        
-            self.debug and print(f"SEARCH FOR mz={mz}, mzexp={mz_experimental}, max_inten={max_intensity}, dir={dir}, filename={filename}")
-            #self.data.append([mz, mz_experimental, max_intensity, dir, filename])
-            self.data.append([mz, mz_experimental, max_intensity, full_path_filename])
+            columns['mass'].append(my_targets.astype(np.int64))
+            columns['dir'].append(np.full(len(my_mzs), d, dtype=np.int64))
+            columns['mz'].append(np.array(my_mzs).astype(float))
+            columns['intensity'].append(np.array(my_intensities).astype(float))
+            # file codes of every directory follow the ones of the previous directories.
+            columns['file'].append(my_file_codes.astype(np.int64) + sum(len(f) for f in filenames))
+            filenames.append(my_filenames)
+
+        dtypes = {'mass': np.int64, 'dir': np.int64, 'mz': float, 'intensity': float, 'file': np.int64}
+        table = {
+            name: np.concatenate(chunks) if len(chunks) else np.empty(0, dtype=dtypes[name])
+            for name, chunks in columns.items()
+        }
+        # RAW directories come ordered by m/z and scan file: a stable sort by m/z
+        # gives the report order.
+        order = np.argsort(table['mass'], kind='stable')
+        table = { name: values[order] for name, values in table.items() }
+        table['filenames'] = np.concatenate(filenames) if len(filenames) else np.empty(0, dtype=str)
+        return table
+
+    def write_reports(self, ppm_tolerance, list_of_masses, output_dir=''):
+        """ Build all the reports at once (see build_reports) and save them to
+        output_dir (current directory by default), together with the wide-format
+        table of highest_intensities_per_raw.
+        File names are listed in Raw.report_files.
 
-        if self.debug:
-            print("THIS IS DATA")        
-            print(self.data)
+        Return:
+        list of the CSV files written.
+        """
+        import os
+        from iFishMass.PeakSpool import PeakSpool
+
+        # bounded memory: reports are streamed from the spilled peaks.
+        if isinstance(self.peaks, PeakSpool):
+            return self.write_spooled_reports(list_of_masses, output_dir)
+
+        reports = self.build_reports(ppm_tolerance, list_of_masses)
+        written = []
+        for name, data in reports.items():
+            output_filename = os.path.join(output_dir, self.report_files[name])
+            self.save_to_csv(output_filename, data=data)
+            written.append(output_filename)
+
+        wide_filename = os.path.join(output_dir, self.report_files['highest_intensities_per_raw_wide'])
+        self.long_to_wide(csv_filename=wide_filename, data=reports['highest_intensities_per_raw'])
+        written.append(wide_filename)
+        return written
+
+    def write_spooled_reports(self, list_of_masses, output_dir=''):
+        """ Same reports as write_reports, built from a PeakSpool (self.peaks)
+        within its memory budget: intensities_among_all_raw is written one merged
+        block at a time, and the highest intensities come from the maxima merged
+        over every spilled run (see PeakSpool). Only these maxima, one per
+        (m/z, RAW file), are held in memory.
+
+        Return:
+        list of the CSV files written.
+        """
+        import csv
+        import os
+        import numpy as np
+        from iFishMass.PeakTable import group_argmax
+        from iFishMass.ResultTable import ResultTable
+
+        spool = self.peaks
+        list_of_masses = list(list_of_masses)
+        assert list_of_masses == spool.list_of_masses, \
+            "write_spooled_reports. list_of_masses must be the masses of the PeakSpool."
+        dirs = [ os.path.join(self.location, raw_name) for raw_name in spool.raw_names ]
+
+        def table(rows):
+            # scans are named once per table.
+            scans, file_codes = np.unique(rows['scan'], return_inverse=True)
+            return ResultTable(list_of_masses, rows['mass'], rows['mz'], rows['intensity'], dirs, rows['raw'],
+                [ f"{scan}.csv" for scan in scans.tolist() ], file_codes.reshape(-1), debug=self.debug)
+
+        written = []
+        output_filename = os.path.join(output_dir, self.report_files['intensities_among_all_raw'])
+        with open(output_filename, mode='w', newline='') as csv_file:
+            csv.writer(csv_file, delimiter=',').writerow(ResultTable.field_names)
+            for block in spool.merge():
+                table(block).write_csv(csv_file, header=False)
+        written.append(output_filename)
+
+        per_raw = table(spool.maxima())
+        # maxima are in report order: the first maximum of an m/z is the among all one.
+        idx = group_argmax(per_raw.mass, per_raw.intensity)
+        # scan files are named once, even when several m/z peak in the same one.
+        paths, path_codes = np.unique([ os.path.join(dirs[raw], per_raw.files[f])
+            for raw, f in zip(per_raw.sample[idx].tolist(), per_raw.file[idx].tolist()) ], return_inverse=True)
+        among_all = ResultTable(list_of_masses, per_raw.mass[idx], per_raw.mz[idx], per_raw.intensity[idx],
+            paths.tolist(), path_codes.reshape(-1), debug=self.debug)
+        for name, data in (('highest_intensities_per_raw', per_raw), ('highest_intensities_among_all_raw', among_all)):
+            output_filename = os.path.join(output_dir, self.report_files[name])
+            self.save_to_csv(output_filename, data=data)
+            written.append(output_filename)
+
+        wide_filename = os.path.join(output_dir, self.report_files['highest_intensities_per_raw_wide'])
+        self.long_to_wide(csv_filename=wide_filename, data=per_raw)
+        written.append(wide_filename)
+        return written
 
     def reshape_long_to_wide(self, csv_filename):
         """ Take a CSV file in long-format and reshape it to wide-format.
@@ -470,17 +881,24 @@ class Raw:
         # write to CSV file
         df_wide.to_csv("wide.csv")     
     
-    def long_to_wide(self, csv_filename):
-        """ Reshape a list of lists (self.data) to wide-format for printing.
+    def long_to_wide(self, csv_filename, data=None):
+        """ Reshape a ResultTable or a list of lists (self.data) to wide-format for printing.
         Wide-tables have conditions in column_names and sample_names in the rows. 
         
         Long-format; each row in the table represents a single observation.
+        data: optional ResultTable or list of lists reshaped instead of self.data (highest_intensities_per_raw).
         """                
         import pandas as pd
         import numpy as np
+        from iFishMass.ResultTable import ResultTable
             
-        # create the panda dataframe from the list of lists
-        df = pd.DataFrame(self.data, columns=['M/Z', 'EXPERIMENTAL_MZ', 'INTENSITY', 'SAMPLE', 'FILE'])
+        if data is None:
+            data = self.data
+        # create the panda dataframe from the table, or from the list of lists
+        if isinstance(data, ResultTable):
+            df = data.to_frame().rename(columns={'EXPERIMENTAL_M/Z': 'EXPERIMENTAL_MZ'})
+        else:
+            df = pd.DataFrame(data, columns=['M/Z', 'EXPERIMENTAL_MZ', 'INTENSITY', 'SAMPLE', 'FILE'])
         
         # drop a column from data frame on the original object.
         # inplace=True means the operation would work
@@ -0,0 +1,162 @@
+import numpy as np
+
+class ResultTable:
+    # header of the CSV reports.
+    field_names = ['M/Z', 'EXPERIMENTAL_M/Z', 'INTENSITY', 'SAMPLE', 'FILE']
+    # rows formatted and written at once by write_csv.
+    chunk_rows = 1 << 20
+
+    def __init__(self, masses, mass, mz, intensity, samples, sample, files=None, file=None, debug=False) -> None:
+        """ Object initialization.
+            Typed, columnar table of report rows
+
+                [mz, experimental_mz, intensity, sample, file]
+
+            String columns are categorical: every row holds an integer code, and
+            every name (RAW directory, scan file) is stored once, however many
+            rows refer to it.
+
+            Parameters:
+            ----------
+            masses: target masses (list). mass[i] is a position in masses.
+            mass:   code of the target mass of every row (numpy array of integers)
+            mz, intensity: experimental m/z and intensity of every row (numpy arrays of floats)
+            samples: RAW directory names (list of unique strings). sample[i] is a position in samples.
+            sample: code of the sample of every row (numpy array of integers)
+            files:  scan file names (list of unique strings). Optional: rows have four fields without it.
+            file:   code of the scan file of every row (numpy array of integers)
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a ResultTable object.
+        """
+        assert len(mass) == len(mz) == len(intensity) == len(sample), \
+            "ResultTable. columns must have the same length."
+        assert (files is None) == (file is None), "ResultTable. files and file go together."
+        assert len(set(samples)) == len(samples) and (files is None or len(set(files)) == len(files)), \
+            "ResultTable. samples and files names must be unique."
+
+        self.masses = list(masses)
+        self.samples = list(samples)
+        self.files = None if files is None else list(files)
+        self.mass = np.asarray(mass, dtype=np.int64)
+        self.mz = np.asarray(mz, dtype=np.float64)
+        self.intensity = np.asarray(intensity, dtype=np.float64)
+        self.sample = np.asarray(sample, dtype=np.int64)
+        self.file = None if file is None else np.asarray(file, dtype=np.int64)
+        self.debug = debug
+
+    def __len__(self):
+        return len(self.mz)
+
+    def __str__(self):
+        """ string representation of the ResultTable object.
+        """
+        return f"rows={len(self)}, masses={len(self.masses)}, samples={len(self.samples)}, " \
+            f"files={None if self.files is None else len(self.files)}, debug={self.debug}"
+
+    def __iter__(self):
+        """ Rows as lists, like the reports were kept before (list of lists).
+        """
+        columns = [
+            [ self.masses[m] for m in self.mass.tolist() ],
+            self.mz.tolist(),
+            self.intensity.tolist(),
+            [ self.samples[s] for s in self.sample.tolist() ],
+        ]
+        if self.files is not None:
+            columns.append([ self.files[f] for f in self.file.tolist() ])
+        return map(list, zip(*columns))
+
+    def take(self, idx):
+        """ Rows idx of the table (new ResultTable sharing the names).
+        """
+        return ResultTable(self.masses, self.mass[idx], self.mz[idx], self.intensity[idx],
+            self.samples, self.sample[idx], self.files, None if self.file is None else self.file[idx],
+            debug=self.debug)
+
+    def to_frame(self):
+        """ pandas DataFrame of the table. SAMPLE and FILE are categorical columns
+            holding only the names used by the rows.
+        """
+        import pandas as pd
+
+        columns = {
+            'M/Z'             : np.asarray(self.masses, dtype=np.float64)[self.mass],
+            'EXPERIMENTAL_M/Z': self.mz,
+            'INTENSITY'       : self.intensity,
+            'SAMPLE'          : pd.Categorical.from_codes(self.sample, self.samples),
+        }
+        if self.files is not None:
+            columns['FILE'] = pd.Categorical.from_codes(self.file, self.files)
+        df = pd.DataFrame(columns)
+        for name in ('SAMPLE', 'FILE'):
+            if name in df:
+                df[name] = df[name].cat.remove_unused_categories()
+        return df
+
+    def to_csv(self, output_filename, header=True):
+        """ Save the table to a text file in CSV format (see write_csv).
+        """
+        # newline='': rows end with '\r\n', like csv.writer writes them.
+        with open(output_filename, mode='w', newline='') as csv_file:
+            self.write_csv(csv_file, header=header)
+
+    def write_csv(self, csv_file, header=True):
+        """ Write the table to an open text file, chunk_rows rows at a time.
+            Columns are formatted in bulk: every name and target mass once, every
+            distinct m/z value once. The text is the one csv.writer writes for the
+            same rows (list of lists).
+        """
+        import csv
+
+        if header:
+            csv.writer(csv_file, delimiter=',').writerow(self.field_names)
+
+        masses = [ repr(float(m)) for m in self.masses ]
+        samples = self.format_strings(self.samples)
+        files = None if self.files is None else self.format_strings(self.files)
+        line = '{},{},{},{},{}\r\n' if files is not None else '{},{},{},{}\r\n'
+        for a in range(0, len(self), self.chunk_rows):
+            b = min(a + self.chunk_rows, len(self))
+            columns = [
+                [ masses[m] for m in self.mass[a:b].tolist() ],
+                self.format_floats(self.mz[a:b]),
+                self.format_floats(self.intensity[a:b]),
+                [ samples[s] for s in self.sample[a:b].tolist() ],
+            ]
+            if files is not None:
+                columns.append([ files[f] for f in self.file[a:b].tolist() ])
+            csv_file.write(''.join(map(line.format, *columns)))
+        self.debug and print(f"{len(self)} rows written")
+
+    @staticmethod
+    def format_floats(values):
+        """ repr of every value (list of strings), as csv.writer formats floats.
+            Repeated values (m/z values of the same target) are formatted once.
+        """
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        # distinct bit patterns: -0.0 and 0.0 are written differently.
+        _, first, inverse = np.unique(values.view(np.int64), return_index=True, return_inverse=True)
+        if 2 * len(first) > len(values):
+            return list(map(repr, values.tolist()))
+        text = list(map(repr, values[first].tolist()))
+        return [ text[i] for i in inverse.reshape(-1).tolist() ]
+
+    @staticmethod
+    def format_strings(values):
+        """ Every string as a CSV field (quoted when csv.writer would quote it).
+        """
+        import io
+        import csv
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=',', lineterminator='\n')
+        fields = []
+        for value in values:
+            buffer.seek(0)
+            buffer.truncate()
+            # csv.writer quotes an empty field only when it is alone in the row.
+            writer.writerow(['', value])
+            fields.append(buffer.getvalue()[1:-1])
+        return fields
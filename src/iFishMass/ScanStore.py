@@ -0,0 +1,77 @@
+import os
+import numpy as np
+
+class ScanStore:
+    # file extension of the binary scan files.
+    extension = '.npz'
+
+    def __init__(self, location, debug=False) -> None:
+        """ Object initialization.
+            Binary file holding all the scans of a single RAW file. It replaces
+            the directory with one CSV file per scan:
+
+                scan   : scan numbers (int64), one element per scan.
+                offset : peaks of scan[i] are mz[offset[i]:offset[i+1]] (int64).
+                mz     : concatenated m/z values of all scans (float64).
+                intensity: concatenated intensities of all scans (float64).
+
+            Parameters:
+            ----------
+            location: file path (<output>/<raw_name>.npz)
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a ScanStore object.
+        """
+        self.location = location
+        self.debug = debug
+
+    def __str__(self):
+        """ string representation of the ScanStore object.
+        """
+        return f"location={self.location}, debug={self.debug}"
+
+    @classmethod
+    def is_store(cls, filename):
+        """ True if filename is a binary scan file.
+        """
+        return filename.endswith(cls.extension)
+
+    def write(self, scans, mzs, intensities):
+        """ Write the scans of a RAW file in a single binary file.
+            The file is written under a temporary name and renamed when complete,
+            so a partially written file is never read back.
+
+            Parameters:
+            ----------
+            scans      : scan numbers (list of integers)
+            mzs        : m/z array of every scan (list of numpy arrays)
+            intensities: intensity array of every scan (list of numpy arrays)
+        """
+        from iFishMass.PeakTable import as_float64
+
+        assert len(scans) == len(mzs) == len(intensities), \
+            "write. scans, mzs and intensities must have the same length."
+
+        offset = np.zeros(len(scans) + 1, dtype=np.int64)
+        offset[1:] = np.cumsum([ len(m) for m in mzs ])
+
+        # values are stored as float64, the same values the CSV files hold.
+        mz = as_float64(np.concatenate(mzs)) if len(mzs) else np.empty(0)
+        intensity = as_float64(np.concatenate(intensities)) if len(intensities) else np.empty(0)
+
+        tmp_location = f"{self.location}.tmp"
+        with open(tmp_location, 'wb') as fh:
+            np.savez(fh, scan=np.asarray(scans, dtype=np.int64), offset=offset, mz=mz, intensity=intensity)
+        os.replace(tmp_location, self.location)
+        self.debug and print(f"{self.location} saved. scans={len(scans)} peaks={len(mz)}")
+
+    def read(self):
+        """ Read all the scans of the RAW file in a single bulk read.
+
+            Return
+            ------
+            scan, offset, mz, intensity (numpy arrays). See __init__.
+        """
+        with np.load(self.location) as npz:
+            return npz['scan'], npz['offset'], npz['mz'], npz['intensity']
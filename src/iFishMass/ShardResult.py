@@ -0,0 +1,173 @@
+import os
+import json
+import numpy as np
+
+class ShardResult:
+    # directory, inside the output directory, holding the partial result of every shard.
+    dirname = '_shards'
+    extension = '.shard.npz'
+
+    def __init__(self, output_dir, parameters, debug=False) -> None:
+        """ Object initialization.
+            Partial results of a run split in N shards (--shard i/N), possibly on
+            several machines sharing the output directory, and their merge.
+
+            Every mzXML file belongs to one shard: crc32 of its file name modulo N
+            (see shard_of), the same on every machine and every run. A shard saves
+            the peaks it matched in <output_dir>/_shards/shard_<i>_of_<N>.shard.npz,
+            with what is needed to check and merge it:
+
+                meta       : JSON {"parameters", "shard", "shards", "files", "raw_names"}
+                raw, scan, target, mz, intensity: PeakTable columns
+
+            "files" lists every mzXML file of the data folder seen by the shard.
+            The merge appends the peaks of every file in that order, so the
+            PeakTable (and the reports) are the ones of a single run.
+
+            Parameters:
+            ----------
+            output_dir: output directory ([output] in peak.ini)
+            parameters: extraction parameters (JSON serializable dictionary). Shards
+                    saved with other parameters cannot be merged.
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a ShardResult object.
+        """
+        self.output_dir = output_dir
+        self.location = os.path.join(output_dir, self.dirname)
+        self.parameters = json.loads(json.dumps(parameters))
+        self.debug = debug
+
+    def __str__(self):
+        """ string representation of the ShardResult object.
+        """
+        return f"location={self.location}, parameters={self.parameters}, debug={self.debug}"
+
+    @staticmethod
+    def parse(text):
+        """ Shard number and number of shards of 'i/N' (1 <= i <= N).
+
+            Return: (i, N) tuple of integers.
+        """
+        shard, _, shards = text.partition('/')
+        assert shard.strip().isdigit() and shards.strip().isdigit(), f"shard {text} must be i/N, e.g. 1/4."
+        shard, shards = int(shard), int(shards)
+        assert 1 <= shard <= shards, f"shard {text}: i must be between 1 and N."
+        return shard, shards
+
+    @staticmethod
+    def shard_of(file_xml, shards):
+        """ Shard (1 to shards) of file_xml: crc32 of its file name, so it does not
+            depend on the directory, the machine or the Python process.
+        """
+        import zlib
+        return zlib.crc32(os.path.basename(file_xml).encode('utf-8')) % shards + 1
+
+    @classmethod
+    def select(cls, files, shard, shards):
+        """ Files of files (list of paths) belonging to shard i of N, in files order.
+        """
+        return [ file_xml for file_xml in files if cls.shard_of(file_xml, shards) == shard ]
+
+    def filename(self, shard, shards):
+        """ Location of the partial result of shard i of N.
+        """
+        return os.path.join(self.location, f"shard_{shard}_of_{shards}{self.extension}")
+
+    def save(self, peak_table, shard, shards, files):
+        """ Save the peaks matched by shard i of N (peak_table) as its partial result.
+            It is written under a temporary name and renamed, so an interrupted
+            shard never leaves a partial result to merge.
+
+            Parameters:
+            ----------
+            peak_table: PeakTable filled with the files of the shard
+            shard, shards: shard number (1 to shards) and number of shards
+            files: every mzXML file of the data folder (list of paths), in processing order
+
+            Return: location of the partial result.
+        """
+        os.makedirs(self.location, exist_ok=True)
+        meta = {
+            'parameters': self.parameters,
+            'shard'     : shard,
+            'shards'    : shards,
+            'files'     : [ os.path.basename(file_xml) for file_xml in files ],
+            'raw_names' : list(peak_table.raw_names),
+        }
+        columns = peak_table.columns()
+        location = self.filename(shard, shards)
+        with open(f"{location}.tmp", 'wb') as fh:
+            np.savez(fh, meta=np.array(json.dumps(meta)), **columns)
+        os.replace(f"{location}.tmp", location)
+        self.debug and print(f"{len(peak_table)} peaks of shard {shard}/{shards} saved to {location}")
+        return location
+
+    def load(self, location):
+        """ Partial result saved by save.
+
+            Return: meta (dictionary) and columns (dictionary of numpy arrays).
+        """
+        with np.load(location) as npz:
+            meta = json.loads(str(npz['meta']))
+            columns = { name: npz[name] for name in ('raw', 'scan', 'target', 'mz', 'intensity') }
+        return meta, columns
+
+    def merge(self, peak_table, files=None):
+        """ Append the partial results of all the shards to peak_table, file by file
+            in the order of the data folder.
+
+            Every shard of the same run (same parameters, number of shards and
+            files) must be there, once.
+
+            Parameters:
+            ----------
+            peak_table: empty PeakTable
+            files: optional mzXML files of the data folder now (list of paths). A
+                    warning is printed if they are not the files the shards saw.
+
+            Return: number of shards merged.
+        """
+        assert os.path.isdir(self.location), f"no shard results in {self.location}."
+        partials = sorted(name for name in os.listdir(self.location) if name.endswith(self.extension))
+        assert len(partials) > 0, f"no shard results in {self.location}."
+
+        shards = dict()
+        first = None
+        for name in partials:
+            meta, columns = self.load(os.path.join(self.location, name))
+            assert meta['parameters'] == self.parameters, \
+                f"{name} was saved with other parameters (masses, ppm or ms_level)."
+            first = first or meta
+            assert meta['shards'] == first['shards'] and meta['files'] == first['files'], \
+                f"{self.location} holds shards of different runs. Please remove it and run the shards again."
+            shards[meta['shard']] = (meta, columns)
+
+        missing = [ str(i) for i in range(1, first['shards'] + 1) if i not in shards ]
+        assert not missing, f"shard(s) {', '.join(missing)} of {first['shards']} not found in {self.location}."
+
+        if files is not None and [ os.path.basename(f) for f in files ] != first['files']:
+            print(f"WARNING: mzXML files changed since the shards were run. Run the shards again.")
+
+        # rows of every RAW name, grouped once per shard.
+        rows = dict()
+        for i, (meta, columns) in shards.items():
+            order = np.argsort(columns['raw'], kind='stable')
+            starts = np.searchsorted(columns['raw'][order], np.arange(len(meta['raw_names']) + 1))
+            for code, raw_name in enumerate(meta['raw_names']):
+                rows[(i, raw_name)] = order[starts[code]:starts[code + 1]]
+
+        # files order: the order a single run appends them in.
+        for name in first['files']:
+            i = self.shard_of(name, first['shards'])
+            raw_name = os.path.splitext(name)[0]
+            # files without matches have no rows; files sharing a RAW name are appended once.
+            idx = rows.pop((i, raw_name), None)
+            if idx is None:
+                continue
+            columns = shards[i][1]
+            peak_table.append(raw_name, columns['scan'][idx], columns['target'][idx],
+                columns['mz'][idx], columns['intensity'][idx])
+        self.debug and print(f"{len(peak_table)} peaks of {len(shards)} shards merged")
+        return len(shards)
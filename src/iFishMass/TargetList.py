@@ -0,0 +1,124 @@
+import os
+
+class TargetList:
+    # accepted header names of every column (lower case).
+    mz_columns = ('m/z', 'mz', 'mass', 'target', 'target_mz')
+    group_columns = ('group', 'groups')
+
+    def __init__(self, location, debug=False) -> None:
+        """ Object initialization.
+            List of target masses read from a CSV or TSV file, one target per row,
+            for lists too long for peak.ini (thousands of masses):
+
+                m/z,name,group
+                881.39739,PEPTIDE_1,modified_peptides
+                1296.68481,STANDARD_1,internal_standard
+                ...
+
+            The m/z column is required and group is optional; a target can belong
+            to several groups, separated by ';'. Other columns (a name, ...) are
+            ignored. The delimiter (',', tab or ';') is found from the first lines.
+            A file without header is read as a single m/z column.
+
+            Parameters:
+            ----------
+            location: path to the CSV or TSV file
+            debug:  optional parameter (boolean) for debbuging purposes.
+                    set to False for default.
+
+            Return: a TargetList object. Call read() to load the targets.
+        """
+        self.location = location
+        self.debug = debug
+        self.masses = []
+        self.groups = dict()
+
+    def __len__(self):
+        return len(self.masses)
+
+    def __str__(self):
+        """ string representation of the TargetList object.
+        """
+        return f"location={self.location}, targets={len(self)}, groups={sorted(self.groups)}, debug={self.debug}"
+
+    def read(self):
+        """ Read the targets of the file.
+
+            Return: self. Targets are in self.masses (list of floats, file order,
+            duplicated masses once) and self.groups (group -> set of masses).
+        """
+        import csv
+
+        assert os.path.isfile(self.location), f"target list {self.location} does not exist."
+
+        with open(self.location, newline='') as fh:
+            sample = fh.read(64 * 1024)
+            fh.seek(0)
+            if self.location.lower().endswith(('.tsv', '.tab')):
+                delimiter = '\t'
+            else:
+                try:
+                    delimiter = csv.Sniffer().sniff(sample, delimiters=',\t;').delimiter
+                except csv.Error:
+                    delimiter = ','
+            rows = csv.reader(fh, delimiter=delimiter)
+
+            header = next(rows, None)
+            assert header is not None, f"target list {self.location} is empty."
+            columns = [ h.strip().lower() for h in header ]
+            mz_col = self.column(columns, self.mz_columns)
+            if mz_col is None:
+                # no header: a single column of masses.
+                assert self.is_number(header[0]), \
+                    f"target list {self.location}: no m/z column. Use one of {self.mz_columns} as header."
+                mz_col, group_col = 0, None
+                rows = self.chain([header], rows)
+                first_line = 1
+            else:
+                first_line = 2
+                group_col = self.column(columns, self.group_columns)
+
+            seen = set()
+            for line, row in enumerate(rows, start=first_line):
+                if len(row) == 0 or not row[mz_col].strip() or row[0].startswith('#'):
+                    continue
+                assert self.is_number(row[mz_col]), f"target list {self.location} line {line}: {row[mz_col]} is not a m/z value."
+                mass = float(row[mz_col])
+                assert mass > 0, f"target list {self.location} line {line}: m/z must be positive."
+                if mass not in seen:
+                    seen.add(mass)
+                    self.masses.append(mass)
+                if group_col is not None and group_col < len(row):
+                    for group in row[group_col].split(';'):
+                        if group.strip():
+                            self.groups.setdefault(group.strip(), set()).add(mass)
+
+        self.debug and print(f"{len(self.masses)} targets, groups {sorted(self.groups)} read from {self.location}")
+        return self
+
+    def group(self, name):
+        """ Masses of a group (set). An empty set is returned for unknown groups.
+        """
+        return set(self.groups.get(name, set()))
+
+    @staticmethod
+    def column(columns, names):
+        """ Position of the first column named as one of names, or None.
+        """
+        for i, column in enumerate(columns):
+            if column in names:
+                return i
+        return None
+
+    @staticmethod
+    def is_number(text):
+        try:
+            float(text)
+            return True
+        except ValueError:
+            return False
+
+    @staticmethod
+    def chain(first, rest):
+        yield from first
+        yield from rest
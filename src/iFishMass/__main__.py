@@ -16,9 +16,21 @@ import sys
 #import spectrum_utils.spectrum as sus
 #from Raw import Raw 
 
+# mass spectrometry files read by iFishMass (see read_spectra).
+MS_FILE_EXTENSIONS = ('.mzXML', '.mzML')
+
+def mass_windows(list_of_masses, ppm_tolerance, debug=False):
+    """ Return list_of_masses as a MassWindows object (ppm windows of every mass).
+        list_of_masses is returned as is when it already is a MassWindows object.
+    """
+    from iFishMass.MassWindows import MassWindows
+
+    if isinstance(list_of_masses, MassWindows):
+        return list_of_masses
+    return MassWindows(list_of_masses, ppm_tolerance, debug=debug)
+
 def keep_peaks_around_mass_cma(spectrum_in, mass_in, ppm_tolerance):
     import numpy as np
-    import copy
     """ Keep peaks that are within mz_tolerance (in ppm) of the mass_in.
         
         Paramaters:
@@ -36,16 +48,14 @@ def keep_peaks_around_mass_cma(spectrum_in, mass_in, ppm_tolerance):
     assert ppm_tolerance >= 0, "mz_tolerance must be a positive scalar." 
     assert mass_in >= 0, "mass_in must be a positive scalar"
 
-    spectrum = copy.deepcopy(spectrum_in)   
+    # shallow copy: header fields are shared, only the kept peaks are new arrays.
+    spectrum = dict(spectrum_in)
 
     mzs, intensities = spectrum['m/z array'], spectrum['intensity array']
     
-    # ppm calculation
-    peaks_to_keep = (np.abs(mzs - mass_in) / mass_in ) * 1_000_000
+    # peaks within the ppm window of mass_in (binary search).
+    peaks_to_keep = mass_windows([mass_in], ppm_tolerance).keep(mzs)
     
-    peaks_to_keep = peaks_to_keep <= ppm_tolerance
-    
-    #condition = np.logical_and(spectrum.peaks.mz <= spectrum.peaks.mz,)
     new_mzs, new_intensities = mzs[peaks_to_keep], intensities[peaks_to_keep]
     spectrum['m/z array'] = new_mzs
     spectrum['intensity array'] = new_intensities
@@ -53,7 +63,6 @@ def keep_peaks_around_mass_cma(spectrum_in, mass_in, ppm_tolerance):
 
 def filter_peaks(spectrum_in, list_of_masses, ppm_tolerance, debug=False):
     import numpy as np
-    import copy
     """ Keep peaks that are within mz_tolerance (in ppm) of the list_of_masses
         
         Paramaters:
@@ -61,7 +70,8 @@ def filter_peaks(spectrum_in, list_of_masses, ppm_tolerance, debug=False):
         spectrum_in: 
             Input spectrum
         list_of_masses: 
-            list of masses to filter the peaks
+            list of masses to filter the peaks, or a MassWindows object
+            built once for all the scans.
         ppm_tolerance: 
             tolerance of mz values (in ppm)
         Return:
@@ -73,34 +83,198 @@ def filter_peaks(spectrum_in, list_of_masses, ppm_tolerance, debug=False):
     assert ppm_tolerance >= 0, "mz_tolerance must be a positive scalar." 
     assert len(list_of_masses) >= 0, "list_of_masses is empty"
 
-    spectrum = copy.deepcopy(spectrum_in)   
-    #mzs, intensities = np.array(spectrum['m/z array']), np.array(spectrum['intensity array'])
+    windows = mass_windows(list_of_masses, ppm_tolerance, debug=debug)
+
+    # shallow copy: header fields are shared, only the kept peaks are new arrays.
+    # see select_peaks for a result holding the kept peaks only.
+    spectrum = dict(spectrum_in)
     mzs, intensities = spectrum['m/z array'], spectrum['intensity array']
-    #if np.all(mzs):
-    #    print(f"mzs all elements are True")
-    #else:
-    #    print(f"mzs all elements are False")
-
-    # list where to store the peaks, initialized with zeros.
-    peaks_to_keep = np.zeros(len(mzs), dtype=bool)
-    #peaks_to_keep = np.full(len(mzs), False)
-    
-    for mass_in in list_of_masses:
-        debug and print (f"LOOKING for {mass_in} type={type(mass_in)}")
-        # ppm calculation
-        tmp_peaks_to_keep = (np.abs(mzs - mass_in) / mass_in) * 1_000_000
-        tmp_peaks_to_keep = tmp_peaks_to_keep <= ppm_tolerance
 
-        peaks_to_keep = np.logical_or(peaks_to_keep, tmp_peaks_to_keep)
-        if debug and np.any(tmp_peaks_to_keep):
-            print(f"TRUE values")
+    # indices of the peaks within the ppm window of any mass.
+    # m/z arrays are sorted, every window is found by binary search.
+    peaks_to_keep = windows.keep(mzs)
+    debug and print(f"PEAKS_TO_KEEP={peaks_to_keep}")
 
-    #print(f"PEAKS_TO_KEEP={peaks_to_keep}")
     new_mzs, new_intensities = mzs[peaks_to_keep], intensities[peaks_to_keep]
     spectrum['m/z array'] = new_mzs
     spectrum['intensity array'] = new_intensities
     return spectrum
 
+def select_peaks(spectrum_in, list_of_masses, ppm_tolerance, debug=False):
+    """ Keep peaks that are within mz_tolerance (in ppm) of the list_of_masses.
+        Like filter_peaks, but nothing is copied from spectrum_in: the result
+        only holds the kept peaks, the matched masses and the 'num' and
+        'msLevel' header fields.
+
+        Paramaters:
+        ----------
+        spectrum_in: 
+            Input spectrum
+        list_of_masses: 
+            list of masses to filter the peaks, or a MassWindows object
+        ppm_tolerance: 
+            tolerance of mz values (in ppm)
+        Return:
+            FilteredScan object. It supports sp['m/z array'], sp['intensity array'],
+            sp['num'] and sp['msLevel'] like a filtered spectrum.
+    """
+    if spectrum_in is None:
+        return None
+
+    windows = mass_windows(list_of_masses, ppm_tolerance, debug=debug)
+    return windows.select(spectrum_in)
+
+def match_peaks(spectrum_in, list_of_masses, ppm_tolerance):
+    import numpy as np
+    """ Match the peaks of spectrum_in against every mass of list_of_masses.
+        A peak within ppm_tolerance of several masses is reported once per mass.
+
+        Paramaters:
+        ----------
+        spectrum_in:
+            Input spectrum (usually the output of filter_peaks)
+        list_of_masses:
+            list of masses to match the peaks, or a MassWindows object
+        ppm_tolerance:
+            tolerance of mz values (in ppm)
+        Return:
+            targets, mzs, intensities (numpy arrays). One element per match.
+    """
+    if spectrum_in is None:
+        return np.empty(0), np.empty(0), np.empty(0)
+
+    windows = mass_windows(list_of_masses, ppm_tolerance)
+    mzs, intensities = spectrum_in['m/z array'], spectrum_in['intensity array']
+
+    peak_idx, target_idx = windows.match(mzs)
+    return windows.masses[target_idx], mzs[peak_idx], intensities[peak_idx]
+
+def read_mzxml(file_xml, decode_binary=True, reader='pyteomics'):
+    """ Open file_xml with pyteomics (same as mzxml.read).
+        With decode_binary=False the peak arrays are returned undecoded; see decode_peaks.
+
+        Paramaters:
+        ----------
+        file_xml:
+            path to the mzXML file
+        decode_binary:
+            decode the peak arrays of every scan (boolean)
+        reader:
+            'pyteomics', or 'native' for the streaming MzXMLReader. The native
+            reader always decodes the peaks on first access, whatever decode_binary.
+        Return:
+            pyteomics MzXML reader, or MzXMLReader (context manager and iterator over the scans)
+    """
+    import numpy as np
+    from pyteomics import mzxml
+
+    assert reader in ('pyteomics', 'native'), "reader must be 'pyteomics' or 'native'."
+    if reader == 'native':
+        from iFishMass.MzXMLReader import MzXMLReader
+        return MzXMLReader(file_xml)
+
+    if decode_binary:
+        return mzxml.read(file_xml)
+
+    class SelectiveMzXML(mzxml.MzXML):
+        # pyteomics fails with KeyError on scans without peaks when
+        # decode_binary=False; those scans get empty arrays instead.
+        def _decode_peaks(self, info):
+            if isinstance(info.get('peaks'), (dict, list)):
+                arrays = info.pop('peaks')[0]
+                for k in self._array_keys:
+                    info[k] = arrays.get(k, np.array([]))
+                return
+            super()._decode_peaks(info)
+
+    return SelectiveMzXML(file_xml, decode_binary=False)
+
+def read_mzml(file_mzml, decode_binary=True):
+    """ Open an (indexed) mzML file with pyteomics. The offset index of the file
+        is used for random access (reader.get_by_id, reader.get_by_index).
+        Spectra get the 'msLevel' and 'num' (scan number) keys of mzXML scans,
+        so both formats are handled by the same code.
+
+        Paramaters:
+        ----------
+        file_mzml:
+            path to the mzML file
+        decode_binary:
+            decode the peak arrays of every spectrum (boolean). See decode_peaks.
+        Return:
+            pyteomics MzML reader (context manager and iterator over the spectra)
+    """
+    import re
+    from pyteomics import mzml, xml
+
+    class ScanMzML(mzml.MzML):
+        def _get_info_smart(self, element, **kwargs):
+            info = super()._get_info_smart(element, **kwargs)
+            if xml._local_name(element) == 'spectrum' and isinstance(info, dict):
+                info['msLevel'] = info.get('ms level')
+                # scan number from the native id (... scan=12), or the spectrum position.
+                match = re.search(r'\bscan=(\d+)', str(info.get('id', '')))
+                info['num'] = match.group(1) if match else str(int(info.get('index', 0)) + 1)
+            return info
+
+    return ScanMzML(file_mzml, use_index=True, decode_binary=decode_binary)
+
+def read_spectra(filename, decode_binary=True, reader='native'):
+    """ Open a mzXML or mzML file. The single entry point to read mass spectrometry
+        files: every spectrum has 'num', 'msLevel', 'm/z array' and 'intensity array',
+        whatever the format.
+
+        Paramaters:
+        ----------
+        filename:
+            path to the mzXML or mzML file
+        decode_binary:
+            decode the peak arrays of every spectrum (boolean). See decode_peaks.
+        reader:
+            mzXML reader, 'native' (default) or 'pyteomics'. See read_mzxml.
+            mzML files are always read with pyteomics.
+        Return:
+            reader (context manager and iterator over the spectra)
+    """
+    if filename.endswith('.mzML'):
+        return read_mzml(filename, decode_binary=decode_binary)
+    return read_mzxml(filename, decode_binary=decode_binary, reader=reader)
+
+def decode_peaks(spectrum_in):
+    import numpy as np
+    """ Decode the peak arrays of a spectrum read with mzxml.read(..., decode_binary=False).
+        Reading without decoding lets the caller check the scan header (msLevel)
+        first and decode only the peaks of the scans it keeps.
+
+        m/z and intensity values share a single base64/zlib payload in mzXML;
+        it is decoded once for both arrays. mzML stores them apart, each one is
+        decoded on its own. The spectrum is updated in place.
+
+        Paramaters:
+        ----------
+        spectrum_in:
+            Input spectrum (dictionary)
+        Return:
+            spectrum_in, with 'm/z array' and 'intensity array' as numpy arrays.
+    """
+    if spectrum_in is None:
+        return None
+
+    record = spectrum_in['m/z array']
+    # already decoded (or a scan without peaks).
+    if isinstance(record, np.ndarray):
+        return spectrum_in
+
+    names = np.dtype(record.dtype).names
+    if names is not None and 'intensity array' in names:
+        peaks = record.source.decode_data_array(record.data, record.compression, record.dtype)
+        spectrum_in['m/z array'] = peaks['m/z array']
+        spectrum_in['intensity array'] = peaks['intensity array']
+    else:
+        spectrum_in['m/z array'] = record.decode()
+        spectrum_in['intensity array'] = spectrum_in['intensity array'].decode()
+    return spectrum_in
+
 def spectrum_is_empty(spectrum_in):
     """ Check if spectrum_in is empty
         
@@ -161,6 +335,33 @@ def save_as_csv(spectrum_in, filename):
         writer.writerows(data)  # write multiple rows
     return 1    
 
+def save_as_npz(output_dir, raw_name, scans, mzs, intensities, debug=False):
+    """ Save all the scans of a RAW file in binary format (ScanStore)
+        to <output_dir>/<raw_name>.npz
+
+        Paramaters:
+        ----------
+        output_dir:
+            dir where to store the binary file
+        raw_name:
+            mzXML file name without extension
+        scans:
+            scan numbers (list)
+        mzs, intensities:
+            m/z and intensity arrays of every scan (lists of arrays)
+    """
+    import os
+    from iFishMass.ScanStore import ScanStore
+
+    # several processes might create output_dir at the same time.
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        print(f"Directory {output_dir} created")
+
+    store = ScanStore(os.path.join(output_dir, raw_name + ScanStore.extension), debug=debug)
+    store.write(scans, mzs, intensities)
+    return 1
+
 def get_mzxml_files(dir_path):
     # list to store mxXML files
     my_list = []
@@ -170,7 +371,7 @@ def get_mzxml_files(dir_path):
         # check if current path is a file
         if os.path.isfile(os.path.join(dir_path, file)):
             my_file = os.path.join(dir_path, file)
-            if my_file.endswith('.mzXML'):
+            if my_file.endswith(MS_FILE_EXTENSIONS):
                 my_list.append(my_file)
     return my_list 
 
@@ -179,100 +380,152 @@ def get_mzxml_files_yield(dir_path):
     # using a generator expression will buid a generator function.
     # this approach is memory efficient.
 
-    # iterate directory
-    for file in os.listdir(dir_path):
-        # check only mzXML files
+    # iterate directory. Files are sorted, so they are always
+    # processed (and merged) in the same order.
+    for file in sorted(os.listdir(dir_path)):
+        # check only mzXML and mzML files
         if os.path.isfile(os.path.join(dir_path, file)):
             my_file = os.path.join(dir_path, file)
-            if my_file.endswith('.mzXML'):
+            if my_file.endswith(MS_FILE_EXTENSIONS):
                 yield my_file
 
-def filter_files(*, input_dir, output_dir, ms_level, ppm_tolerance, debug, list_of_masses):
-    """ Filter all XML files by list_of_masses with a specific ppm_tolerance
-        save the resulting filtered files in CSV format. One file per scan.
+def filter_file(file_xml, *, output_dir, ms_level, windows, debug, save_scans=True, scan_format='csv', profile=False,
+    reader='native'):
+    """ Filter a single XML file by the ppm windows of the list_of_masses and
+        save the resulting filtered scans in CSV format. One file per scan.
+        This is the work done by each process with filter_files(..., workers=N).
 
         Parameters:
         -----------
-        conf_file: 
-            file path to INI file
+        file_xml:
+            path to the mzXML file
+        output_dir:
+            dir where to store the CSV files
+        ms_level:
+            ms_level (string) of the scans to filter
+        windows:
+            MassWindows object built from the list_of_masses
+        save_scans:
+            save every filtered scan (boolean).
+        scan_format:
+            'csv' one CSV file per scan, or 'npz' one binary file (ScanStore)
+            per mzXML file holding all the filtered scans.
+        profile:
+            time the parse, decode, filter and write stages and count scans,
+            peaks and files (boolean). See Profiler.
+        reader:
+            mzXML reader: 'native' (MzXMLReader, default) or 'pyteomics'.
         Return:
+            dictionary with the matched peaks of the file (one element per match)
+            {'raw_name': string, 'scan': array, 'targets': array, 'mzs': array, 'intensities': array}
+            which are the arguments of PeakTable.append, plus 'profile':
+            Profiler.report() of the file (None when profile is False).
     """
-    import sys
     import os
-    from tqdm import tqdm
-    from pyteomics import mgf, auxiliary
-    from xml.etree.ElementTree import PI
-    from pyteomics import mzxml, auxiliary
-    from pyteomics.auxiliary import cvquery
-    import spectrum_utils.spectrum as sus
+    import numpy as np
+    from iFishMass.PeakTable import as_float64
+    from iFishMass.Profiler import Profiler
     import pprint
     pp = pprint.PrettyPrinter(indent=4)
 
-    #for file_xml in get_mzxml_files_yield(input_dir):
-    # Wrapping tqdm around an iterable.
-    pbar = tqdm(get_mzxml_files_yield(input_dir))
-    for file_xml in pbar:
-        debug and print(f"XML_FILE={file_xml}")
-        
-        filename = os.path.basename(file_xml)
-        #pbar.set_description("Processing %s" % filename)
-        pbar.set_description("Processing %s" % file_xml)
-        
-        # iterate over all scans, filter and write them
-        # into a CSV formmated file.
-        with mzxml.read(file_xml) as reader:
-            #debug and auxiliary.print_tree(next(reader))
-            for spectrum in reader:
-                spectrum_ms_level = str(spectrum['msLevel'])
-                
-                if debug:
-                    print(f"LOOP spectrum type={type(spectrum)}")
-                    print(f"keys={spectrum.keys()}")
-                    debug and print(f"THIS IS spectrum")
-                    debug and pp.pprint(spectrum)
-                    
-                    print(f"msLevel  ={spectrum['msLevel']}")
-                    print(f"polarity ={spectrum['polarity']}")
-                    print(f"filterLine= {spectrum['filterLine']}")
-                    print(f"num ={spectrum['num']}")
-                    print(f"id  ={spectrum['id']}")
-                    print(f"m/z array ={spectrum['m/z array']}")
-                    print(f"intensity array ={spectrum['intensity array']}")
-                    print(f"spectrum_ms_level={type(spectrum_ms_level)}")
-                    print(f"ms_level_config={type(ms_level)}")
-                
-                # look for peaks only in the ms_level set in the INI file
-                if spectrum_ms_level != ms_level:
-                    debug and print(f"SKIPPING spectrum_ms_level={spectrum_ms_level}  ms_level_config={ms_level}")
-                    continue
+    debug and print(f"XML_FILE={file_xml}")
 
-                debug and print(f"list_of_masses={list_of_masses}")
-                sp = filter_peaks(spectrum, list_of_masses, ppm_tolerance, debug=debug)
-                
-                debug and print (f"This is sp = {sp}")
-                if spectrum_is_empty(sp):
-                    debug and print("SPECTRUM IS EMPTY")
-                    continue
+    # 20210910_Jenny_Merck_Expt1_DI_B4_D6_2.mzXML"
+    # remove .mzXML from every mzXML file a create a directory.
+    # That directory (20210910_Jenny_Merck_Expt1_DI_B4_D6_2) it represents a single raw 
+    # file.
+    filename = os.path.basename(file_xml)
+    filename_without_extension = os.path.splitext(filename)[0]
+    debug and print(f"filename_without_extension ={filename_without_extension}")
+
+    prof = Profiler(enabled=profile)
+    prof.count('files')
+    prof.count('bytes_read', os.path.getsize(file_xml))
+
+    scans, targets, mzs, intensities = [], [], [], []
+    # filtered scans, written at once in binary format (scan_format='npz').
+    kept_scans, kept_mzs, kept_intensities = [], [], []
+
+    # iterate over all scans, filter and write them
+    # into a CSV formmated file.
+    # peaks are decoded only for the scans at the requested ms_level.
+    with read_spectra(file_xml, decode_binary=False, reader=reader) as scans_in:
+        #debug and auxiliary.print_tree(next(reader))
+        scans_in = iter(scans_in)
+        while True:
+            # parse: scan header and (undecoded) peaks.
+            with prof.stage('parse'):
+                spectrum = next(scans_in, None)
+            if spectrum is None:
+                break
+            prof.count('scans_read')
+            spectrum_ms_level = str(spectrum['msLevel'])
+            
+            if debug:
+                print(f"LOOP spectrum type={type(spectrum)}")
+                print(f"keys={spectrum.keys()}")
+                debug and print(f"THIS IS spectrum")
+                debug and pp.pprint(spectrum)
                 
-                debug and print(f"SPECTRUM is not empty {spectrum['num']} {sp['num']}")
+                print(f"msLevel  ={spectrum['msLevel']}")
+                print(f"polarity ={spectrum['polarity']}")
+                print(f"filterLine= {spectrum['filterLine']}")
+                print(f"num ={spectrum['num']}")
+                print(f"id  ={spectrum['id']}")
+                print(f"m/z array ={spectrum['m/z array']}")
+                print(f"intensity array ={spectrum['intensity array']}")
+                print(f"spectrum_ms_level={type(spectrum_ms_level)}")
+                print(f"ms_level_config={type(ms_level)}")
+            
+            # look for peaks only in the ms_level set in the INI file
+            if spectrum_ms_level != ms_level:
+                debug and print(f"SKIPPING spectrum_ms_level={spectrum_ms_level}  ms_level_config={ms_level}")
+                prof.count('scans_skipped_ms_level')
+                continue
 
-                # store csv inside of CSV directory
+            with prof.stage('decode'):
+                decode_peaks(spectrum)
+            with prof.stage('filter'):
+                sp = select_peaks(spectrum, windows, windows.ppm_tolerance, debug=debug)
+            prof.count('peaks_in', len(spectrum['m/z array']))
+            
+            debug and print (f"This is sp = {sp}")
+            if spectrum_is_empty(sp):
+                debug and print("SPECTRUM IS EMPTY")
+                prof.count('scans_empty')
+                continue
 
-                # 20210910_Jenny_Merck_Expt1_DI_B4_D6_2.mzXML"
-                # remove .mzXML from every mzXML file a create a directory.
-                # That directory (20210910_Jenny_Merck_Expt1_DI_B4_D6_2) it represents a single raw 
-                # file.
+            prof.count('scans_kept')
+            prof.count('peaks_kept', len(sp))
+            
+            debug and print(f"SPECTRUM is not empty {spectrum['num']} {sp['num']}")
+
+            # matched peaks, kept for the in-memory PeakTable.
+            sp_targets, sp_mzs, sp_intensities = sp.matches()
+            scans.append(np.full(len(sp_mzs), int(sp['num']), dtype=np.int64))
+            targets.append(sp_targets)
+            mzs.append(as_float64(sp_mzs))
+            intensities.append(as_float64(sp_intensities))
+
+            if not save_scans:
+                continue
+
+            if scan_format == 'npz':
+                kept_scans.append(int(sp['num']))
+                kept_mzs.append(sp['m/z array'])
+                kept_intensities.append(sp['intensity array'])
+                continue
+
+            with prof.stage('write_scans'):
+                # store csv inside of CSV directory
                 file_tmp_path = output_dir
                 
                 # os.path.join(os.getcwd(), 'new_folder', 'file.txt')
+                # several processes might create output_dir at the same time.
+                prof.count('dir_checks', 2)
                 if not os.path.exists(file_tmp_path):
-                    os.mkdir(file_tmp_path)
+                    os.makedirs(file_tmp_path, exist_ok=True)
                     print(f"Directory {file_tmp_path} created")
-                    
-                # removing filename extension (.mzXML) to create a dir name based on filename
-                filename = os.path.basename(file_xml)
-                filename_without_extension = os.path.splitext(filename)[0]
-                debug and print(f"filename_without_extension ={filename_without_extension}")
 
                 # create directory where to store the CSV files
                 csv_dir_name = os.path.join(file_tmp_path, filename_without_extension)
@@ -283,8 +536,198 @@ def filter_files(*, input_dir, output_dir, ms_level, ppm_tolerance, debug, list_
                 filename = f"{sp['num']}.csv"
                 csv_full_path_name = os.path.join(csv_dir_name, filename)
                 debug and print(f"filename = {filename}, full_path={csv_full_path_name}")
-                #save_as_csv(spectrum, filename) 
                 save_as_csv(sp, csv_full_path_name) 
+                prof.count('files_written')
+
+    # a single binary file for all the filtered scans of the mzXML file.
+    if len(kept_scans) > 0:
+        with prof.stage('write_scans'):
+            save_as_npz(output_dir, filename_without_extension, kept_scans, kept_mzs, kept_intensities)
+        prof.count('files_written')
+
+    result = {'raw_name': filename_without_extension, 'profile': prof.report() if profile else None}
+    if len(scans) == 0:
+        empty = np.empty(0)
+        result.update({'scan': empty.astype(np.int64), 'targets': empty, 'mzs': empty, 'intensities': empty})
+        return result
+
+    result.update({
+        'scan'       : np.concatenate(scans),
+        'targets'    : np.concatenate(targets),
+        'mzs'        : np.concatenate(mzs),
+        'intensities': np.concatenate(intensities),
+    })
+    return result
+
+def index_file(file_xml, ms_level, reader='native'):
+    """ Read all the peaks of the scans at ms_level of a mzXML file (for PeakIndex.build).
+
+        Parameters:
+        -----------
+        file_xml:
+            path to the mzXML file
+        ms_level:
+            ms_level (string) of the scans to read
+        reader:
+            mzXML reader: 'native' (default) or 'pyteomics'. See read_mzxml.
+        Return:
+            raw_name, scans, mzs, intensities. scans holds the scan number of every peak.
+    """
+    import os
+    import numpy as np
+
+    raw_name = os.path.splitext(os.path.basename(file_xml))[0]
+    scans, mzs, intensities = [], [], []
+    with read_spectra(file_xml, decode_binary=False, reader=reader) as scans_in:
+        for spectrum in scans_in:
+            if str(spectrum['msLevel']) != ms_level:
+                continue
+            decode_peaks(spectrum)
+            if spectrum_is_empty(spectrum):
+                continue
+            scans.append(np.full(len(spectrum['m/z array']), int(spectrum['num']), dtype=np.int64))
+            mzs.append(spectrum['m/z array'])
+            intensities.append(spectrum['intensity array'])
+
+    if len(scans) == 0:
+        empty = np.empty(0)
+        return raw_name, empty.astype(np.int64), empty, empty
+    return raw_name, np.concatenate(scans), np.concatenate(mzs), np.concatenate(intensities)
+
+def remove_scan_files(output_dir, raw_name):
+    """ Remove the filtered scans of a RAW file: the directory with one CSV
+        file per scan and/or the binary scan file (<raw_name>.npz).
+    """
+    import os
+    import shutil
+    from iFishMass.ScanStore import ScanStore
+
+    csv_dir_name = os.path.join(output_dir, raw_name)
+    if os.path.isdir(csv_dir_name):
+        shutil.rmtree(csv_dir_name)
+    store = csv_dir_name + ScanStore.extension
+    if os.path.isfile(store):
+        os.remove(store)
+
+def filter_files(*, input_dir, output_dir, ms_level, ppm_tolerance, debug, list_of_masses,
+    peak_table=None, save_scans=True, workers=1, scan_format='csv', profiler=None, manifest=None,
+    reader='native', shard=None):
+    """ Filter all XML files by list_of_masses with a specific ppm_tolerance
+        save the resulting filtered files in CSV format. One file per scan.
+
+        Parameters:
+        -----------
+        conf_file:
+            file path to INI file
+        peak_table:
+            optional PeakTable object. When provided, the matched peaks are
+            appended to it (in-memory pipeline).
+        save_scans:
+            save every filtered scan (boolean).
+            Set to False to keep the filtered peaks in peak_table only.
+        scan_format:
+            'csv' one CSV file per scan (default), or 'npz' one binary file per
+            mzXML file. Raw reads both layouts.
+        workers:
+            number of processes filtering XML files in parallel (integer).
+            Results are merged in the order of the XML files, so the output
+            is the same as with a single process.
+        profiler:
+            optional Profiler object. Stages and counters of every XML file
+            (including the ones filtered by worker processes) are added to it.
+        manifest:
+            optional Manifest object (incremental run). XML files processed since
+            they last changed are skipped; the others (new, changed or interrupted
+            by a crash) are processed and recorded as soon as they are done.
+            Scan files of changed or deleted XML files are removed, and
+            peak_table is filled from the matched peaks recorded in the manifest.
+        reader:
+            mzXML reader: 'native' (MzXMLReader, default) or 'pyteomics'.
+        shard:
+            optional (i, N) tuple. Only the XML files of shard i of N are
+            processed (see ShardResult).
+        Return:
+    """
+    import os
+    from tqdm import tqdm
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    assert workers >= 1, "workers must be a positive integer."
+    assert scan_format in ('csv', 'npz'), "scan_format must be 'csv' or 'npz'."
+
+    # ppm windows are computed once for all the files.
+    windows = mass_windows(list_of_masses, ppm_tolerance, debug=debug)
+    profile = profiler is not None and profiler.enabled
+    options = dict(output_dir=output_dir, ms_level=ms_level, windows=windows, 
+        debug=debug, save_scans=save_scans, scan_format=scan_format, profile=profile, reader=reader)
+
+    files = list(get_mzxml_files_yield(input_dir))
+    if shard is not None:
+        from iFishMass.ShardResult import ShardResult
+        files = ShardResult.select(files, *shard)
+        print(f"shard {shard[0]}/{shard[1]}: {len(files)} mzXML files")
+    todo = files
+
+    if manifest is not None:
+        # XML files deleted since the last run.
+        names = set(os.path.basename(file_xml) for file_xml in files)
+        for name in list(manifest.files):
+            if name not in names:
+                remove_scan_files(output_dir, manifest.forget(name))
+
+        todo = []
+        for file_xml in files:
+            if manifest.is_current(file_xml):
+                continue
+            # changed, new, or interrupted: scan files left by a previous run are removed.
+            manifest.forget(os.path.basename(file_xml))
+            remove_scan_files(output_dir, os.path.splitext(os.path.basename(file_xml))[0])
+            todo.append(file_xml)
+        print(f"{len(files) - len(todo)} mzXML files up to date, {len(todo)} to process")
+
+    def collect(file_xml, result):
+        profile and profiler.merge(result['profile'])
+        del result['profile']
+        if manifest is not None:
+            manifest.record(file_xml, result)
+        elif peak_table is not None:
+            peak_table.append(**result)
+
+    if workers == 1:
+        #for file_xml in get_mzxml_files_yield(input_dir):
+        # Wrapping tqdm around an iterable.
+        pbar = tqdm(todo)
+        for file_xml in pbar:
+            #pbar.set_description("Processing %s" % filename)
+            pbar.set_description("Processing %s" % file_xml)
+            # merge right away, results are already in files order.
+            collect(file_xml, filter_file(file_xml, **options))
+    else:
+        # one XML file per task. Progress is reported as the files are done.
+        results = dict()
+        merged = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = { executor.submit(filter_file, file_xml, **options): i for i, file_xml in enumerate(todo) }
+            pbar = tqdm(as_completed(futures), total=len(futures))
+            for future in pbar:
+                i = futures[future]
+                pbar.set_description("Processed %s" % todo[i])
+                # recorded as soon as it is done, so a crash does not lose it.
+                if manifest is not None:
+                    collect(todo[i], future.result())
+                    continue
+                # deterministic merge: files order, whatever the order the processes
+                # finished. Results are merged as soon as the files before them are,
+                # so only the results waiting for a slower file are held.
+                results[i] = future.result()
+                while merged in results:
+                    collect(todo[merged], results.pop(merged))
+                    merged += 1
+
+    # matched peaks of every XML file, processed now or in a previous run.
+    if manifest is not None and peak_table is not None:
+        for file_xml in files:
+            peak_table.append(**manifest.load(file_xml))
 
 def read_options(args=sys.argv[1:]):
     import argparse
@@ -295,20 +738,82 @@ def read_options(args=sys.argv[1:]):
         epilog='Written by Carlos Madrid-Aliste.'
     )
     
+    # run (default): filter the mzXML files and build the reports.
+    # index: build the m/z index of the mzXML files (see --from-index).
+    # serve: answer report queries over localhost HTTP from one or more indexes.
+    # merge: build the reports from the partial results of the shards (see --shard).
+    parser.add_argument("command", nargs='?', choices=['run', 'index', 'serve', 'merge'], default='run',
+        help="run: filter mzXML files and build the reports (default). index: build the m/z peak index. "
+            "serve: answer report queries over localhost HTTP from the peak indexes. "
+            "merge: build the reports from the partial results of all the shards (see --shard).")
+
     group = parser.add_mutually_exclusive_group()
 
     # add the positional arguments to the Argument Parser
     group.add_argument("--inifile", default='peak.ini', help="INI-file location")
     group.add_argument("--printini", action='store_true', help="print a demo peak.ini file to current directory.")
+
+    # pipeline options
+    parser.add_argument("--in-memory", action='store_true',
+        help="keep the filtered peaks in memory and build the reports from them. No scan file is written.")
+    parser.add_argument("--keep-scans", "--keep-csv", dest='keep_scans', action='store_true',
+        help="with --in-memory, also write the filtered scans to the output directory.")
+    parser.add_argument("--format", dest='scan_format', choices=['csv', 'npz'], default='csv',
+        help="format of the filtered scans: one CSV file per scan (default) or one binary NPZ file per mzXML file.")
+    parser.add_argument("--workers", type=int, default=1, metavar='N',
+        help="number of processes filtering mzXML files in parallel (default 1).")
+    parser.add_argument("--reader", choices=['native', 'pyteomics'], default='native',
+        help="mzXML reader: native streaming reader (default) or pyteomics.")
+    parser.add_argument("--profile", action='store_true',
+        help="record wall and CPU time per stage and counters (scans, peaks, files) to profile.json.")
+    parser.add_argument("--cprofile", action='store_true',
+        help="with --profile, also dump cProfile statistics of the main stages (profile_<stage>.prof).")
+    parser.add_argument("--incremental", action='store_true',
+        help="process only new or changed mzXML files; results of the previous runs are reused.")
+    parser.add_argument("--from-index", action='store_true',
+        help="build the reports from the m/z peak index (see the index command) instead of the mzXML files.")
+    parser.add_argument("--index-dir", metavar='DIR', action='append',
+        help="location of the m/z peak index (default: <data_folder>/iFishMass_index). "
+            "serve accepts it several times, one per experiment.")
+    parser.add_argument("--port", type=int, default=8765,
+        help="serve: localhost port of the HTTP server (default 8765).")
+    parser.add_argument("--max-memory", type=int, metavar='MB',
+        help="keep the filtered peaks within MB megabytes, spilling them to the output directory "
+            "when needed, and stream the reports from them. No scan file is written.")
+    parser.add_argument("--shard", metavar='I/N',
+        help="process only shard I of N of the mzXML files (files are split by a hash of their name) and save "
+            "its partial result in the output directory. Run I=1..N on any machines sharing it, then merge.")
+    parser.add_argument("--no-template", action='store_true',
+        help="write analysis_plot.xlsx without the Excel template: data columns only, no plots, "
+            "rows streamed to the file instead of held as workbook cells (for very large plates).")
     
     # parse arguments from terminal
     opts = parser.parse_args(args)
     if not opts.inifile:   # manually catching mistakes
         parser.error("INI file is required")
+    if opts.workers < 1:
+        parser.error("--workers must be a positive integer")
+    if opts.cprofile and not opts.profile:
+        parser.error("--cprofile requires --profile")
+    if opts.index_dir and len(opts.index_dir) > 1 and opts.command != 'serve':
+        parser.error("--index-dir can be given several times with serve only")
+    if opts.max_memory is not None and opts.max_memory < 1:
+        parser.error("--max-memory must be a positive number of megabytes")
+    if opts.shard:
+        from iFishMass.ShardResult import ShardResult
+        try:
+            opts.shard = ShardResult.parse(opts.shard)
+        except AssertionError as error:
+            parser.error(f"--shard: {error}")
+        if opts.command != 'run':
+            parser.error("--shard can be used with run only")
+        # shards share the output directory: they write their partial result only.
+        if opts.incremental or opts.from_index or opts.max_memory or opts.keep_scans:
+            parser.error("--shard cannot be used with --incremental, --from-index, --max-memory or --keep-scans")
     
     return opts
 
-def dump(*, input_dir, output_dir, ms_level):
+def dump(*, input_dir, output_dir, ms_level, scan_format='csv', debug=False, reader='native'):
     """ Save m/z and intensitites for all scans in a given raw file. Files are
     stored in CSV format and no filtering is performed at all.
 
@@ -317,16 +822,15 @@ def dump(*, input_dir, output_dir, ms_level):
         input_dir: dir containing mzxml files.
         output_dir: dir where to store the CSV files.
         ms_level: ms_level (mz or mz/mz)
+        scan_format: 'csv' one CSV file per scan (default), or 'npz' one
+            binary file (ScanStore) per mzXML file.
+        debug: optional parameter (boolean) for debbuging purposes.
+        reader: mzXML reader, 'native' (default) or 'pyteomics'.
         Return:
     """
     import sys
     import os
     from tqdm import tqdm
-    from pyteomics import mgf, auxiliary
-    from xml.etree.ElementTree import PI
-    from pyteomics import mzxml, auxiliary
-    from pyteomics.auxiliary import cvquery
-    import spectrum_utils.spectrum as sus
 
     #for file_xml in get_mzxml_files_yield(input_dir):
     # Wrapping tqdm around an iterable.
@@ -337,12 +841,16 @@ def dump(*, input_dir, output_dir, ms_level):
         filename = os.path.basename(file_xml)
         #pbar.set_description("Processing %s" % filename)
         pbar.set_description("Processing %s" % file_xml)
+
+        # scans written at once in binary format (scan_format='npz').
+        kept_scans, kept_mzs, kept_intensities = [], [], []
         
         # iterate over all scans, and write them
         # into a CSV formmated file.
-        with mzxml.read(file_xml) as reader:
+        # peaks are decoded only for the scans at the requested ms_level.
+        with read_spectra(file_xml, decode_binary=False, reader=reader) as scans_in:
             #debug and auxiliary.print_tree(next(reader))
-            for spectrum in reader:
+            for spectrum in scans_in:
                 spectrum_ms_level = str(spectrum['msLevel'])
                 if debug:
                     print(f"LOOP spectrum type={type(spectrum)}")
@@ -361,6 +869,13 @@ def dump(*, input_dir, output_dir, ms_level):
                     debug and print(f"SKIPPING spectrum_ms_level={spectrum_ms_level}  ms_level_config={ms_level}")
                     continue
 
+                decode_peaks(spectrum)
+                if scan_format == 'npz':
+                    kept_scans.append(int(spectrum['num']))
+                    kept_mzs.append(spectrum['m/z array'])
+                    kept_intensities.append(spectrum['intensity array'])
+                    continue
+
                 # store csv inside of CSV directory
 
                 # 20210910_Jenny_Merck_Expt1_DI_B4_D6_2.mzXML"
@@ -392,6 +907,10 @@ def dump(*, input_dir, output_dir, ms_level):
                 save_as_csv(spectrum, csv_full_path_name) 
                 debug and print(f"filename = {filename} SAVED SUCESSFULLY")
 
+        if len(kept_scans) > 0:
+            raw_name = os.path.splitext(os.path.basename(file_xml))[0]
+            save_as_npz(output_dir, raw_name, kept_scans, kept_mzs, kept_intensities, debug=debug)
+
 """
 def get_mzxml_files_yield(dir_path):
     import os
@@ -444,12 +963,11 @@ def main():
     import time
     import sys
     import pprint
-    import pkg_resources
     
-    import iFishMass
-    from iFishMass import Raw as r
+    # only light modules here: numpy, pandas, openpyxl and pyteomics are imported
+    # by the subcommands using them, so --printini and INI errors start fast.
+    from iFishMass.Profiler import Profiler
     from iFishMass import config_file  as cfg
-    from iFishMass import DataAnalysis as da
     
     pp = pprint.PrettyPrinter(indent=4)
     DO_PLOTS = False    
@@ -490,44 +1008,146 @@ def main():
     
     if internal_standard and modified_peptides and unmodified_peptides:
         DO_PLOTS=True
+    # named groups and ratios are written next to the template columns.
+    if values['groups'] or values['ratios']:
+        DO_PLOTS=True
+
+    # peaks of every mzXML file, sorted by m/z. Built once, queried with any
+    # list of masses and ppm (--from-index).
+    index_dirs = opts.index_dir or [os.path.join(idir, 'iFishMass_index')]
+    index_dir = index_dirs[0]
+    if opts.command == 'index':
+        from tqdm import tqdm
+        from iFishMass.PeakIndex import PeakIndex
+
+        files = list(get_mzxml_files_yield(idir))
+        index = PeakIndex(index_dir, debug=debug)
+        n = index.build((index_file(file_xml, level, reader=opts.reader) for file_xml in tqdm(files)),
+            ms_level=level, sources=files)
+        print(f"{n} peaks (ms_level={level}) of {len(files)} mzXML files indexed in {index_dir}")
+        sys.exit()
+
+    # indexes are loaded once and kept in memory; every request reuses them.
+    if opts.command == 'serve':
+        from iFishMass.QueryServer import QueryServer
+        from iFishMass.PeakIndex import PeakIndex
+
+        experiments = dict()
+        for location in index_dirs:
+            index = PeakIndex(location, debug=debug)
+            if not index.exists():
+                sys.exit(f"{location} is not a peak index\nPlease run iFishMass index --inifile {ini_file}")
+            # experiment name: the index directory, or its data folder for the default name.
+            name = os.path.basename(os.path.normpath(location))
+            if name == 'iFishMass_index':
+                name = os.path.basename(os.path.dirname(os.path.abspath(location)))
+            experiments[name] = index.open(mmap=False)
+            print(f"{name}: {len(index)} peaks loaded from {location}")
+        QueryServer(experiments, port=opts.port, debug=debug).serve_forever()
+        sys.exit()
     
+    from iFishMass import Raw as r
+    from iFishMass import PeakTable as pt
+
+    # in-memory pipeline: filtered peaks go straight into a PeakTable and
+    # scan files are written only if asked for.
+    # shards and merge keep the matched peaks in memory too: shards save them, merge reads them back.
+    in_memory = opts.in_memory or opts.from_index or opts.shard or opts.command == 'merge'
+    peaks = pt.PeakTable(debug=debug) if in_memory else None
+    save_scans = not (in_memory or opts.max_memory) or opts.keep_scans
+    # bounded memory: same pipeline, the peaks are spilled to disk beyond the budget.
+    if opts.max_memory:
+        from iFishMass.PeakSpool import PeakSpool
+        peaks = PeakSpool(masses, ppm, opts.max_memory * 1024 * 1024, directory=odir, debug=debug)
+    if opts.from_index and (opts.keep_scans or opts.incremental):
+        sys.exit("--from-index does not read the mzXML files: --keep-scans and --incremental cannot be used")
+
+    # per-stage timings and counters (--profile). A disabled profiler does nothing.
+    cprofile_stages = ('filter_files', 'reports')
+    profiler = Profiler(enabled=opts.profile, cprofile_stages=cprofile_stages if opts.cprofile else ())
+
+    # incremental run: files processed by a previous run, with the same
+    # parameters, are not processed again.
+    manifest = None
+    if opts.incremental:
+        from iFishMass.Manifest import Manifest
+        parameters = dict(list_of_masses=sorted(masses), ppm=ppm, ms_level=level,
+            scan_format=opts.scan_format, save_scans=save_scans)
+        manifest = Manifest(odir, parameters, debug=debug)
+
     # remove temporary CSV files before running analysis
     # CSV files from previous will distort results.
-    remove_dir_content(odir)
+    if save_scans and (manifest is None or len(manifest) == 0):
+        remove_dir_content(odir)
     
-    filter_files(input_dir=idir, output_dir=odir, 
-        ms_level=level, ppm_tolerance=ppm, debug=debug, list_of_masses=masses
-    )
+    # partial results of the shards, in the output directory.
+    if opts.shard or opts.command == 'merge':
+        from iFishMass.ShardResult import ShardResult
+        shard_results = ShardResult(odir, dict(list_of_masses=sorted(masses), ppm=ppm, ms_level=level), debug=debug)
+
+    if opts.command == 'merge':
+        with profiler.stage('merge'):
+            files = list(get_mzxml_files_yield(idir)) if os.path.isdir(idir) else None
+            try:
+                n = shard_results.merge(peaks, files)
+            except AssertionError as error:
+                sys.exit(f"{error}")
+        print(f"{len(peaks)} peaks of {n} shards merged from {shard_results.location}")
+    elif opts.from_index:
+        from iFishMass.PeakIndex import PeakIndex
+        with profiler.stage('index_query'):
+            index = PeakIndex(index_dir, debug=debug)
+            if not index.exists():
+                sys.exit(f"{index_dir} is not a peak index\nPlease run iFishMass index --inifile {ini_file}")
+            index.open()
+            if index.meta['ms_level'] != level:
+                sys.exit(f"{index_dir} was built for ms_level={index.meta['ms_level']}\nPlease run iFishMass index --inifile {ini_file}")
+            if index.is_stale(list(get_mzxml_files_yield(idir))):
+                print(f"WARNING: mzXML files in {idir} changed since {index_dir} was built. Run iFishMass index again.")
+            index.fill(peaks, masses, ppm)
+    else:
+        with profiler.stage('filter_files'):
+            filter_files(input_dir=idir, output_dir=odir, 
+                ms_level=level, ppm_tolerance=ppm, debug=debug, list_of_masses=masses,
+                peak_table=peaks, save_scans=save_scans, workers=opts.workers, scan_format=opts.scan_format,
+                profiler=profiler, manifest=manifest, reader=opts.reader, shard=opts.shard
+            )
+
+    # a shard saves its partial result; the reports are built by merge.
+    if opts.shard:
+        location = shard_results.save(peaks, *opts.shard, list(get_mzxml_files_yield(idir)))
+        print(f"{len(peaks)} peaks of shard {opts.shard[0]}/{opts.shard[1]} saved to {location}")
+        print(f"Run iFishMass merge --inifile {ini_file} once every shard is done.")
+        sys.exit()
 
     print(f'Generating  CSV reports ...')
     output = odir
-    r1 = r.Raw(output)
-    
-    r1.intensities_among_all_raw_files(ppm_tolerance=ppm, list_of_masses=masses)
-    output_filename = "intensities_among_all_raw.csv"
-    r1.save_to_csv(output_filename)
-    print(f"\treport {output_filename} saved!")
-    #r1.print_data()
+    with profiler.stage('raw_init'):
+        r1 = r.Raw(output, peaks=peaks)
     
-    r1.get_highest_intensities_per_raw(ppm_tolerance=ppm, list_of_masses=masses)
-    output_filename = "highest_intensities_per_raw.csv"
-    r1.save_to_csv(output_filename)
-    print(f"\treport {output_filename} saved!")
-    r1.long_to_wide(csv_filename='highest_intensities_per_raw_wide.csv')
+    # all reports are built in a single pass over the matched peaks.
+    with profiler.stage('reports'):
+        written = r1.write_reports(ppm_tolerance=ppm, list_of_masses=masses)
+    for output_filename in written:
+        print(f"\treport {output_filename} saved!")
+    if opts.max_memory:
+        peaks.close()
     #r1.print_data()
-
-    r1.get_highest_intensity_among_all_raw_files(ppm_tolerance=ppm, list_of_masses=masses)
-    output_filename = "highest_intensities_among_all_raw.csv"
-    r1.save_to_csv(output_filename)
-    print(f"\treport {output_filename} saved!")
+    # scan files read back by the reports.
+    for name, n in r1.counters.items():
+        profiler.count(name, n)
 
     if DO_PLOTS:
+        from iFishMass import DataAnalysis as da
         print(f"Generating plots ...")
         
         csv_filename = 'highest_intensities_per_raw_wide.csv'
         output_plot_file = 'analysis_plot.xlsx'
         try:
-            tmpl_file = pkg_resources.resource_filename(__name__, 'data/template.xlsx')
+            # template shipped with the package (src/iFishMass/data). None: no template.
+            tmpl_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'template.xlsx')
+            if opts.no_template:
+                tmpl_file = None
             d = da.DataAnalysis(
                 location = csv_filename, 
                 modified_peptides  = modified_peptides, 
@@ -535,10 +1155,13 @@ def main():
                 internal_standard  = internal_standard,
                 debug = debug,
                 template_file = tmpl_file,
-                output = output_plot_file
+                output = output_plot_file,
+                groups = values['groups'],
+                ratios = values['ratios']
             )
 
-            d.do_analysis() 
+            with profiler.stage('data_analysis'):
+                d.do_analysis() 
             if os.path.exists(output_plot_file):
                 print(f"\t{output_plot_file} done!")  
         
@@ -547,6 +1170,13 @@ def main():
 
     end = time.time()
     elapsed_time = end - start
+
+    # profile.json is written next to the reports.
+    if opts.profile:
+        profile_file = profiler.save('profile.json', inifile=ini_file, data_folder=idir, output=odir,
+            ms_level=level, ppm=ppm, workers=opts.workers, in_memory=opts.in_memory,
+            scan_format=opts.scan_format, wall_time=elapsed_time)
+        print(f"\tprofile {profile_file} saved!")
     print()
     print(f'Wall time: {time.strftime("%H:%M:%S", time.gmtime(elapsed_time))}')
 
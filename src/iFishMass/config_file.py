@@ -42,24 +42,51 @@ class config_file:
             
             # read list of masses from INI file. masses are loaded into
             # a set to remove reduandancy. 
+            # file=<CSV/TSV file> loads a target list too (see TargetList),
+            # relative to the INI file directory.
             my_masses = set()
+            targets = None
             for mass in config['list_of_masses']:
                 #my_masses.append(float(config['list_of_masses'][mass]))
+                if mass == 'file':
+                    targets = self.read_target_list(config['list_of_masses'][mass])
+                    my_masses.update(targets.masses)
+                    continue
                 my_masses.add(float(config['list_of_masses'][mass]))
             
             # convert list into a set to remove redundancy.
             #internal_standard = { x for x in my_list} # set comprehension
-            internal_standard = set()
-            for mass in config['internal_standard']:
-                internal_standard.add(float(config['internal_standard'][mass]))
-            
-            modified_peptides = set()
-            for mass in config['modified_peptides']:
-                modified_peptides.add(float(config['modified_peptides'][mass]))
-            
-            unmodified_peptides = set()
-            for mass in config['unmodified_peptides']:
-                unmodified_peptides.add(float(config['unmodified_peptides'][mass]))
+            # groups of the target list are added to the sections of the same name.
+            # With a target list, these sections are optional.
+            groups = dict()
+            for section in ('internal_standard', 'modified_peptides', 'unmodified_peptides'):
+                groups[section] = set() if targets is None else targets.group(section)
+                if targets is not None and not config.has_section(section):
+                    continue
+                for mass in config[section]:
+                    groups[section].add(float(config[section][mass]))
+            internal_standard   = groups['internal_standard']
+            modified_peptides   = groups['modified_peptides']
+            unmodified_peptides = groups['unmodified_peptides']
+
+            # named groups of any size: the other groups of the target list and
+            # the [groups] section (name=masses separated by commas or spaces).
+            named_groups = dict()
+            if targets is not None:
+                for name in sorted(targets.groups):
+                    if name not in groups:
+                        named_groups[name] = targets.group(name)
+            if config.has_section('groups'):
+                for name in config['groups']:
+                    assert name not in groups, f"[groups] {name} is a section of its own."
+                    text = config['groups'][name].replace(',', ' ')
+                    masses = set(float(m) for m in text.split())
+                    # a mass not extracted would give a total of 0.
+                    unknown = sorted(masses - my_masses)
+                    assert not unknown, \
+                        f"[groups] {name}: {', '.join(map(str, unknown))} not in [list_of_masses]."
+                    named_groups.setdefault(name, set()).update(masses)
+            ratios = self.read_ratios(config, list(groups) + list(named_groups))
             
             config_values['data_folder']  = data_folder
             config_values['output'] = output
@@ -70,11 +97,50 @@ class config_file:
             config_values['internal_standard'] = internal_standard
             config_values['modified_peptides'] = modified_peptides
             config_values['unmodified_peptides'] = unmodified_peptides
+            config_values['groups'] = named_groups
+            config_values['ratios'] = ratios
+        except AssertionError as error:
+            print(f'Could not read configuration file: {error}')
+            sys.exit(1)
         except:
             print('Could not read configuration file')
             sys.exit(1)
         return config_values 
     
+    def read_ratios(self, config, group_names):
+        """ Read the [ratios] section: name=numerator/denominator, both group names
+            (internal_standard, modified_peptides, unmodified_peptides or a named
+            group). Group names are not case sensitive.
+
+            Return: a dictionary name -> (numerator, denominator).
+        """
+        ratios = dict()
+        if not config.has_section('ratios'):
+            return ratios
+        names = { name.lower(): name for name in group_names }
+        for name in config['ratios']:
+            terms = [ term.strip().lower() for term in config['ratios'][name].split('/') ]
+            assert len(terms) == 2, f"[ratios] {name} must be numerator/denominator."
+            for term in terms:
+                assert term in names, f"[ratios] {name}: unknown group {term}."
+            ratios[name] = (names[terms[0]], names[terms[1]])
+        return ratios
+
+    def read_target_list(self, location):
+        """ Read a target list file (see TargetList) named in the INI file.
+            Relative paths are relative to the INI file directory.
+
+            Return: a TargetList object.
+        """
+        import os
+        from iFishMass.TargetList import TargetList
+
+        if not os.path.isabs(location):
+            location = os.path.join(os.path.dirname(os.path.abspath(self.location)), location)
+        targets = TargetList(location, debug=self.debug).read()
+        print(f"{len(targets)} target masses read from {location}")
+        return targets
+
     def write_demo_ini(self):
         import sys
         import configparser
@@ -0,0 +1,174 @@
+""" kernels.py
+Inner loops of the peak matching and of the highest-intensity reports:
+
+    - ppm_mask: exact ppm test of every (peak, target) candidate.
+    - match_sorted: merge of sorted peaks against the ppm windows of the
+      targets sorted by mass.
+    - group_argmax: index of the maximum value of every group.
+
+Every kernel has a NumPy implementation (the reference) and, when numba is
+importable, a JIT-compiled one giving the same results (kernels_numba.py). The
+numba kernels are used by default; set the environment variable
+IFISHMASS_NUMBA=0 to use NumPy.
+numba is not a requirement of iFishMass (it is installed with spectrum_utils).
+"""
+import os
+import numpy as np
+
+# numba kernels (kernels_numba module), imported on first use. None: not tried yet.
+_jit = None
+
+def jit():
+    """ The kernels_numba module, or False when numba is not installed.
+        numba is imported on the first call only, so commands matching no peaks
+        (--printini, index queries) start without it.
+    """
+    global _jit
+    if _jit is None:
+        try:
+            from iFishMass import kernels_numba
+            _jit = kernels_numba
+        except ModuleNotFoundError as error:
+            if error.name != 'numba':
+                raise
+            _jit = False
+    return _jit
+
+def numba_enabled():
+    """ True if the numba kernels are used.
+    """
+    return os.environ.get('IFISHMASS_NUMBA', '1') != '0' and bool(jit())
+
+###############################################################################
+# NumPy kernels.
+###############################################################################
+
+def ppm_mask_numpy(mzs, targets, ppm_tolerance):
+    """ True for every mzs[i] within the ppm window of targets[i] (numpy array of booleans).
+    """
+    mzs = np.asarray(mzs).astype(np.float64)
+    targets = np.asarray(targets, dtype=np.float64)
+    return (np.abs(mzs - targets) / targets) * 1_000_000 <= ppm_tolerance
+
+def match_sorted_numpy(mzs, masses, order, search_lower, search_upper, ppm_tolerance):
+    """ Peaks of mzs (sorted) within the ppm window of every target mass.
+
+        Parameters:
+        ----------
+        mzs: sorted m/z array (numpy array)
+        masses: target masses (numpy array of float64)
+        order: targets sorted by mass (numpy array of indices)
+        search_lower, search_upper: search windows of the targets, slightly wider
+                than the ppm windows (see MassWindows)
+        ppm_tolerance: tolerance of mz values (in ppm)
+
+        Return
+        ------
+        peak_idx, target_idx (numpy arrays), ordered by target and then by peak.
+    """
+    empty = np.empty(0, dtype=np.int64)
+    # one binary search per window edge, for all the windows at once.
+    lo = np.searchsorted(mzs, search_lower, side='left')
+    hi = np.searchsorted(mzs, search_upper, side='right')
+    counts = hi - lo
+    total = int(counts.sum())
+    if total == 0:
+        return empty, empty
+
+    # expand every [lo, hi) slice into peak indices.
+    target_idx = np.repeat(np.arange(len(masses)), counts)
+    starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    peak_idx = np.arange(total) + starts
+
+    # exact ppm test on the candidates.
+    keep = ppm_mask_numpy(mzs[peak_idx], masses[target_idx], ppm_tolerance)
+    return peak_idx[keep], target_idx[keep]
+
+def group_argmax_numpy(groups, values):
+    """ See group_argmax.
+    """
+    # sort by group, then by decreasing value, then by position:
+    # the first element of every group is its maximum.
+    positions = np.arange(len(values))
+    order = np.lexsort((positions, -values, groups))
+    sorted_groups = groups[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    return order[first]
+
+###############################################################################
+# numba kernels (kernels_numba.py).
+###############################################################################
+
+def native(values, dtype=None):
+    """ Contiguous array in native byte order (numba does not read the network
+        byte order of mzXML arrays).
+    """
+    values = np.ascontiguousarray(values, dtype=dtype)
+    if not values.dtype.isnative:
+        values = values.astype(values.dtype.newbyteorder('='))
+    return values
+
+def ppm_mask_numba(mzs, targets, ppm_tolerance):
+    """ ppm_mask_numpy, JIT-compiled.
+    """
+    return jit()._ppm_mask(native(mzs), native(targets, np.float64), float(ppm_tolerance))
+
+def match_sorted_numba(mzs, masses, order, search_lower, search_upper, ppm_tolerance):
+    """ match_sorted_numpy, JIT-compiled: a linear merge of the peaks and the
+        windows instead of a binary search per window edge.
+    """
+    return jit()._match_sorted(native(mzs), masses, order.astype(np.int64),
+        search_lower, search_upper, float(ppm_tolerance))
+
+def group_argmax_numba(groups, values):
+    """ group_argmax_numpy, JIT-compiled: one pass over the elements when group
+        keys are dense, a stable sort by group and a scan of every group
+        otherwise, instead of a three-key lexsort.
+    """
+    return jit()._group_argmax(native(groups, np.int64), native(values))
+
+###############################################################################
+# Kernels used by iFishMass: numba when enabled, NumPy otherwise.
+###############################################################################
+
+def ppm_mask(mzs, targets, ppm_tolerance):
+    """ Exact ppm test: True for every mzs[i] within the ppm window of targets[i].
+
+            abs(mz - target) / target * 1_000_000 <= ppm_tolerance
+
+        Return: numpy array of booleans.
+    """
+    if numba_enabled() and len(mzs) > 0:
+        return ppm_mask_numba(mzs, targets, ppm_tolerance)
+    return ppm_mask_numpy(mzs, targets, ppm_tolerance)
+
+def match_sorted(mzs, masses, order, search_lower, search_upper, ppm_tolerance):
+    """ Peaks of mzs (sorted) within the ppm window of every target mass.
+        See match_sorted_numpy.
+    """
+    if numba_enabled():
+        return match_sorted_numba(mzs, masses, order, search_lower, search_upper, ppm_tolerance)
+    return match_sorted_numpy(mzs, masses, order, search_lower, search_upper, ppm_tolerance)
+
+def group_argmax(groups, values):
+    """ Index of the maximum value of every group, for all the groups at once.
+        Ties go to the first element of the group (lowest index), like np.argmax.
+        NaN values are never selected unless a group only holds NaN values.
+
+        Parameters:
+        ----------
+        groups: integer group key of every element (array like)
+        values: value of every element (array like)
+
+        Return
+        ------
+        indices (numpy array), one per group, in ascending group key order.
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int64)
+    if numba_enabled():
+        return group_argmax_numba(groups, values)
+    return group_argmax_numpy(groups, values)
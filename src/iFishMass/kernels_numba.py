@@ -0,0 +1,88 @@
+""" kernels_numba.py
+numba kernels of kernels.py. Same float64 operations as the NumPy kernels (no
+fastmath), so the ppm tests give the same booleans. Imported by kernels.jit on
+first use only: numba takes longer to import than iFishMass itself.
+"""
+import numba
+import numpy as np
+
+@numba.njit(cache=True)
+def _ppm_mask(mzs, targets, ppm_tolerance):
+    keep = np.empty(len(mzs), dtype=np.bool_)
+    for i in range(len(mzs)):
+        mz = np.float64(mzs[i])
+        keep[i] = (abs(mz - targets[i]) / targets[i]) * 1_000_000 <= ppm_tolerance
+    return keep
+
+@numba.njit(cache=True)
+def _match_sorted(mzs, masses, order, search_lower, search_upper, ppm_tolerance):
+    n_peaks, n_targets = len(mzs), len(masses)
+    lo = np.empty(n_targets, dtype=np.int64)
+    hi = np.empty(n_targets, dtype=np.int64)
+    # windows sorted by mass have sorted edges: one pass over the peaks per
+    # edge. Pointers also step back, in case rounding breaks the edge order.
+    a = 0
+    b = 0
+    for k in range(n_targets):
+        t = order[k]
+        while a < n_peaks and mzs[a] < search_lower[t]:
+            a += 1
+        while a > 0 and mzs[a - 1] >= search_lower[t]:
+            a -= 1
+        while b < n_peaks and mzs[b] <= search_upper[t]:
+            b += 1
+        while b > 0 and mzs[b - 1] > search_upper[t]:
+            b -= 1
+        lo[t] = a
+        hi[t] = b
+
+    # exact ppm test, counted first to size the output.
+    total = 0
+    for t in range(n_targets):
+        for p in range(lo[t], hi[t]):
+            if (abs(np.float64(mzs[p]) - masses[t]) / masses[t]) * 1_000_000 <= ppm_tolerance:
+                total += 1
+    peak_idx = np.empty(total, dtype=np.int64)
+    target_idx = np.empty(total, dtype=np.int64)
+    i = 0
+    for t in range(n_targets):
+        for p in range(lo[t], hi[t]):
+            if (abs(np.float64(mzs[p]) - masses[t]) / masses[t]) * 1_000_000 <= ppm_tolerance:
+                peak_idx[i] = p
+                target_idx[i] = t
+                i += 1
+    return peak_idx, target_idx
+
+@numba.njit(cache=True)
+def _better(values, i, best):
+    # NaN values lose against any number; ties keep the first element.
+    return values[i] > values[best] or (np.isnan(values[best]) and not np.isnan(values[i]))
+
+@numba.njit(cache=True)
+def _group_argmax(groups, values):
+    low, high = groups.min(), groups.max()
+    if high - low < 4 * len(groups):
+        # dense keys (target x RAW file codes): one pass, no sort.
+        best = np.full(high - low + 1, -1, dtype=np.int64)
+        for i in range(len(groups)):
+            g = groups[i] - low
+            if best[g] < 0 or _better(values, i, best[g]):
+                best[g] = i
+        return best[best >= 0]
+
+    order = np.argsort(groups, kind='mergesort')
+    out = np.empty(len(order), dtype=np.int64)
+    n = 0
+    k = 0
+    while k < len(order):
+        group = groups[order[k]]
+        best = order[k]
+        k += 1
+        while k < len(order) and groups[order[k]] == group:
+            i = order[k]
+            if _better(values, i, best):
+                best = i
+            k += 1
+        out[n] = best
+        n += 1
+    return out[:n]
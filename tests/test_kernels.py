@@ -0,0 +1,90 @@
+""" test_kernels.py
+The numba kernels (kernels_numba.py) return the arrays of their NumPy
+implementation (kernels.py): float32/float64 and network byte order peaks,
+peaks on the ppm window edges, ties and NaN values.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("numba")
+
+from iFishMass import kernels
+from iFishMass.MassWindows import MassWindows
+
+PPM = 10
+
+def edge_peaks(windows, rng, n):
+    """ n random sorted float64 peaks, plus peaks on (or next to) the ppm window edges of the targets.
+    """
+    edges = np.concatenate([windows.lower, windows.upper])
+    near = np.concatenate([edges, np.nextafter(edges, 0), np.nextafter(edges, np.inf)])
+    return np.sort(np.concatenate([rng.uniform(200, 2000, n), rng.choice(near, size=min(n, len(near)))]))
+
+def assert_same(expected, found):
+    if isinstance(expected, tuple):
+        assert len(expected) == len(found)
+        for e, f in zip(expected, found):
+            assert_same(e, f)
+    else:
+        assert np.array_equal(expected, found)
+
+@pytest.fixture(params=[1, 13, 500], ids=lambda n: f"{n}_targets")
+def windows(request):
+    rng = np.random.default_rng(request.param)
+    masses = rng.uniform(200, 2000, request.param)
+    # targets a few ppm apart: overlapping windows.
+    masses[::5] = masses[::5] * (1 + 3e-6)
+    return MassWindows(masses, PPM)
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.dtype('>f4'), np.dtype('>f8')], ids=str)
+def test_match_sorted(windows, dtype):
+    rng = np.random.default_rng(0)
+    mzs = np.sort(edge_peaks(windows, rng, 2000).astype(dtype))
+    args = (mzs, windows.masses, windows._order, windows._search_lower, windows._search_upper, PPM)
+    expected = kernels.match_sorted_numpy(*args)
+    assert len(expected[0]) > 0
+    assert_same(expected, kernels.match_sorted_numba(*args))
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.dtype('>f4'), np.dtype('>f8')], ids=str)
+def test_ppm_mask(windows, dtype):
+    rng = np.random.default_rng(1)
+    mzs = edge_peaks(windows, rng, 2000).astype(dtype)
+    targets = windows.masses[rng.integers(0, len(windows.masses), len(mzs))]
+    assert_same(kernels.ppm_mask_numpy(mzs, targets, PPM), kernels.ppm_mask_numba(mzs, targets, PPM))
+
+def test_ppm_mask_window_edges():
+    # peaks exactly on the edges are in (<=), the next float out is not.
+    targets = np.array([500.0, 1000.0])
+    mzs = targets * (1 + np.array([PPM, -PPM]) * 1e-6)
+    expected = kernels.ppm_mask_numpy(mzs, targets, PPM)
+    assert_same(expected, kernels.ppm_mask_numba(mzs, targets, PPM))
+    outside = np.nextafter(mzs, targets + np.array([1e3, -1e3]))
+    assert_same(kernels.ppm_mask_numpy(outside, targets, PPM), kernels.ppm_mask_numba(outside, targets, PPM))
+
+# dense group keys, and sparse ones (sorted path of the numba kernel).
+@pytest.mark.parametrize('n_groups, spread', [(1, 1), (7, 1), (1000, 1), (1000, 1_000_003)])
+@pytest.mark.parametrize('ties', [False, True], ids=['distinct', 'ties'])
+def test_group_argmax(n_groups, spread, ties):
+    rng = np.random.default_rng(2)
+    groups = rng.integers(0, n_groups, 5000) * spread
+    values = rng.integers(0, 5, len(groups)).astype(np.float64) if ties else rng.uniform(0, 1e6, len(groups))
+    values[::11] = np.nan
+    values[::13] = -0.0
+    assert_same(kernels.group_argmax_numpy(groups, values), kernels.group_argmax_numba(groups, values))
+
+@pytest.mark.parametrize('spread', [1, 1_000_003])
+def test_group_argmax_nan(spread):
+    # groups of NaN values only: their first element.
+    groups = np.array([3, 1, 3, 1, 2]) * spread
+    values = np.array([np.nan, np.nan, 1.0, np.nan, np.nan])
+    expected = kernels.group_argmax_numpy(groups, values)
+    assert_same(expected, np.array([1, 4, 2]))
+    assert_same(expected, kernels.group_argmax_numba(groups, values))
+
+def test_group_argmax_ties():
+    # ties go to the first element of the group, like np.argmax.
+    groups = np.array([0, 1, 0, 1, 0])
+    values = np.array([2.0, 5.0, 7.0, 5.0, 7.0])
+    expected = kernels.group_argmax_numpy(groups, values)
+    assert_same(expected, np.array([2, 1]))
+    assert_same(expected, kernels.group_argmax_numba(groups, values))
@@ -0,0 +1,57 @@
+""" test_mzxml_reader.py
+The native mzXML reader (MzXMLReader) returns the scans of pyteomics.mzxml.read:
+same num and msLevel, same m/z and intensity arrays (values and dtype), on
+synthetic files of 32/64 bits, zlib/no compression and nested scans.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("pyteomics")
+pytest.importorskip("lxml")
+
+import synthetic_mzxml as synthetic
+from pyteomics import mzxml
+from iFishMass.MzXMLReader import MzXMLReader, duration_to_minutes
+
+# (precision, compression, nested) of the synthetic files.
+VARIANTS = [(32, 'zlib', False), (32, 'none', False), (64, 'zlib', False), (64, 'none', True), (32, 'zlib', True)]
+
+@pytest.fixture(scope='module', params=VARIANTS, ids=lambda v: f"{v[0]}_{v[1]}{'_nested' if v[2] else ''}")
+def file_xml(request, tmp_path_factory):
+    precision, compression, nested = request.param
+    location = tmp_path_factory.mktemp('mzxml') / 'SYNTHETIC.mzXML'
+    synthetic.write_mzxml(str(location), scans=24, peaks=50, ms_levels=(1, 2, 2, 2), precision=precision,
+        compression=compression, nested=nested, seed=VARIANTS.index(request.param))
+    return str(location)
+
+def test_same_scans(file_xml):
+    with mzxml.read(file_xml) as expected, MzXMLReader(file_xml) as native:
+        expected, native = list(expected), list(native)
+    assert len(native) == len(expected) == 24
+    for e, n in zip(expected, native):
+        assert (n['num'], n['msLevel'], n['peaksCount']) == (e['num'], e['msLevel'], e['peaksCount'])
+        assert n['retentionTime'] == pytest.approx(e['retentionTime'])
+        for key in ('m/z array', 'intensity array'):
+            assert n[key].dtype == e[key].dtype
+            assert np.array_equal(n[key], e[key])
+
+def test_ms_level_filter(file_xml):
+    # scans skipped by msLevel are never decoded.
+    with mzxml.read(file_xml) as expected:
+        expected = [ e['num'] for e in expected if e['msLevel'] == 1 ]
+    with MzXMLReader(file_xml) as native:
+        scans = list(native)
+    kept = [ scan for scan in scans if scan['msLevel'] == 1 ]
+    assert [ scan['num'] for scan in kept ] == expected
+    for scan in kept:
+        assert len(scan['m/z array']) == 50
+    assert all(scan._arrays is None for scan in scans if scan['msLevel'] != 1)
+
+@pytest.mark.parametrize('text, minutes', [
+    ('PT12.5S', 12.5 / 60), ('PT1M30S', 1.5), ('PT2H', 120.0), ('P1DT1H', 1500.0), ('-PT30S', -0.5), (' PT60S ', 1.0),
+])
+def test_duration_to_minutes(text, minutes):
+    assert duration_to_minutes(text) == pytest.approx(minutes)
+
+def test_duration_to_minutes_not_a_duration():
+    assert duration_to_minutes('12.5') == '12.5'